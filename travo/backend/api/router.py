@@ -7,6 +7,8 @@ from services.crowd_service.routes import router as crowd_router
 from services.vision_service.routes import router as vision_router
 from services.assistant_service.routes import router as assistant_router
 from services.business_service.routes import router as business_router
+from services.media_service.routes import router as media_router
+from services.payment_service.routes import router as payment_router
 
 # Create main API router
 api_router = APIRouter()
@@ -18,3 +20,5 @@ api_router.include_router(crowd_router, prefix="/crowds", tags=["crowds"])
 api_router.include_router(vision_router, prefix="/vision", tags=["vision"])
 api_router.include_router(assistant_router, prefix="/assistant", tags=["assistant"])
 api_router.include_router(business_router, prefix="/business", tags=["business"])
+api_router.include_router(media_router, prefix="/media", tags=["media"])
+api_router.include_router(payment_router, prefix="/payments", tags=["payments"])
@@ -1,5 +1,8 @@
 import os
-from pydantic import BaseSettings
+try:
+    from pydantic_settings import BaseSettings
+except ImportError:  # pydantic < 2
+    from pydantic import BaseSettings
 from typing import Optional, Dict, Any, List
 
 
@@ -30,6 +33,8 @@ class Settings(BaseSettings):
     # File storage settings
     UPLOAD_FOLDER: str = os.getenv("UPLOAD_FOLDER", "./uploads")
     MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16 MB
+    MEDIA_BASE_URL: str = os.getenv("MEDIA_BASE_URL", "https://api.travo.com/api/media")
+    THUMBNAIL_MAX_SIZE: int = 320  # Longest side of generated thumbnails, in pixels
     
     # Logging settings
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
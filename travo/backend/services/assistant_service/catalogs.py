@@ -0,0 +1,58 @@
+from typing import Dict, List
+
+
+def load_catalog_records() -> List[Dict]:
+    """Collect the destination, attraction, monument and business catalogs in one shape
+
+    Returns:
+        Records with "type", "id", "name", "description", "city", "country",
+        "latitude", "longitude", "tags" and "url" (None where a catalog has no such field)
+    """
+    # Imported here so the assistant does not load every other service at import time
+    from services.recommendation_service.service_logic import mock_destinations, mock_attractions
+    from services.vision_service.service_logic import MONUMENTS_DB, LABELS
+    from services.business_service.service_logic import MOCK_BUSINESSES
+    from .service_logic import ATTRACTIONS
+
+    records = []
+
+    def add(entity_type, entity_id, name, description=None, city=None, country=None, tags=(), url=None, coordinates=None):
+        coordinates = coordinates or {}
+        records.append({
+            "type": entity_type,
+            "id": entity_id,
+            "name": name,
+            "description": description,
+            "city": city,
+            "country": country,
+            "latitude": coordinates.get("latitude"),
+            "longitude": coordinates.get("longitude"),
+            "tags": list(tags),
+            "url": url
+        })
+
+    for destination in mock_destinations:
+        location = destination["location"]
+        add("destination", destination["id"], destination["name"], destination["description"],
+            location.get("city"), location.get("country"), destination["tags"] + destination["highlights"],
+            coordinates=location)
+    for attraction in mock_attractions:
+        location = attraction["location"]
+        add("attraction", attraction["id"], attraction["name"], attraction["description"],
+            location.get("city"), location.get("country"), attraction["tags"], coordinates=location)
+    for attraction in ATTRACTIONS:
+        add("attraction", attraction["id"], attraction["name"], attraction["description"],
+            attraction["city"], attraction["country"])
+    for monument in MONUMENTS_DB:
+        add("monument", monument["monument_id"], monument["name"], monument["description"],
+            monument["city"], monument["country"], [monument.get("style", "")] + monument.get("fun_facts", []),
+            monument.get("wikipedia_url"), monument["location"])
+    for label in LABELS:
+        add("monument", label["id"], label["name"], country=label.get("country"), coordinates=label)
+    for business in MOCK_BUSINESSES:
+        location = business["location"]
+        add("business", business["id"], business["name"], business["description"],
+            location.get("city"), location.get("country"), business["tags"] + [str(business["category"].value)],
+            business.get("website"), location)
+
+    return records
@@ -0,0 +1,153 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .llm_client import estimate_tokens
+
+# Fixed per-message cost of role markers and separators in a chat prompt
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Summarizer = Callable[[str, List[Dict], int], Awaitable[str]]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the end of the text that fits in max_tokens"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    text = text[-max_chars:]
+    # Start at a line, or at least a word, boundary
+    newline = text.find("\n")
+    if 0 <= newline < len(text) // 2:
+        return text[newline + 1:]
+    space = text.find(" ")
+    return text[space + 1:] if 0 <= space < 40 else text
+
+
+def first_sentence(text: str, max_chars: int = 160) -> str:
+    sentence = text.strip().split("\n", 1)[0]
+    for mark in (". ", "? ", "! "):
+        end = sentence.find(mark)
+        if end != -1:
+            sentence = sentence[:end + 1]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars - 3].rstrip() + "..."
+
+
+async def extractive_summary(summary: str, messages: List[Dict], max_tokens: int) -> str:
+    """Fold messages into a summary by keeping the first sentence of each
+
+    Used when no language model is configured. Older lines are dropped once
+    the summary outgrows max_tokens.
+    """
+    lines = [summary] if summary else []
+    lines.extend(f"{m['role'].capitalize()}: {first_sentence(m['content'])}" for m in messages)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+class ContextWindow:
+    """Builds bounded prompt context for conversations
+
+    Each conversation keeps a window of its most recent messages that fits in
+    `budget_tokens`, plus a rolling summary of everything older capped at
+    `summary_tokens`. Messages pushed out of the window are folded into the
+    summary by a background task, so neither the prompt nor the work to
+    assemble it grows with the length of the conversation.
+
+    State lives on the conversation dicts of the ConversationStore, so it is
+    evicted with them; the summary is kept in the conversation metadata and
+    therefore survives in the archive.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = 1500,
+        summary_tokens: int = 300,
+        summarize: Summarizer = extractive_summary
+    ):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize
+
+    def _state(self, conversation: Dict) -> Dict:
+        state = conversation.get("context")
+        if state is None:
+            metadata = conversation["metadata"]
+            state = conversation["context"] = {
+                "turns": deque(),
+                "tokens": 0,
+                "pending": [],
+                "summary": metadata.get("summary", ""),
+                # Sequence number of the first message not covered by the summary
+                "summarized_through": metadata.get("summarized_through", 0),
+                "task": None
+            }
+        return state
+
+    def has_state(self, conversation: Dict) -> bool:
+        return "context" in conversation
+
+    def restore(self, conversation: Dict, messages: List[Dict]) -> None:
+        """Rebuild the window of a conversation loaded from the archive
+
+        Args:
+            messages: Its most recent messages, oldest first; any already covered by the summary are skipped
+        """
+        state = self._state(conversation)
+        for message in messages:
+            if message["sequence"] >= state["summarized_through"]:
+                self.add(conversation, message)
+
+    def add(self, conversation: Dict, message: Dict) -> None:
+        """Add a message to the window, moving the oldest ones out to the summary if it overflows"""
+        state = self._state(conversation)
+        tokens = estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        state["turns"].append((message, tokens))
+        state["tokens"] += tokens
+
+        # The newest message always stays, even if it is larger than the budget on its own
+        while state["tokens"] > self.budget_tokens and len(state["turns"]) > 1:
+            oldest, oldest_tokens = state["turns"].popleft()
+            state["tokens"] -= oldest_tokens
+            state["pending"].append(oldest)
+
+        if state["pending"] and (state["task"] is None or state["task"].done()):
+            state["task"] = asyncio.create_task(self._fold_pending(conversation, state))
+
+    async def _fold_pending(self, conversation: Dict, state: Dict) -> None:
+        # Messages that overflow while the summarizer runs are picked up by the next round
+        while state["pending"]:
+            batch, state["pending"] = state["pending"], []
+            try:
+                summary = await self.summarize(state["summary"], batch, self.summary_tokens)
+            except Exception:
+                # Keep the messages for the next attempt rather than losing them from the context
+                state["pending"][:0] = batch
+                return
+            state["summary"] = truncate_to_tokens(summary, self.summary_tokens)
+            state["summarized_through"] = batch[-1]["sequence"] + 1
+            conversation["metadata"]["summary"] = state["summary"]
+            conversation["metadata"]["summarized_through"] = state["summarized_through"]
+
+    async def settle(self, conversation: Dict) -> None:
+        """Wait for the background summary update of a conversation, if one is running"""
+        task = self._state(conversation)["task"]
+        if task is not None:
+            await task
+
+    def build(self, conversation: Dict) -> List[Dict[str, str]]:
+        """Prompt messages for a conversation: the summary (if any), then the recent turns
+
+        Messages waiting to be summarized are left out; the summary catches up
+        in the background.
+        """
+        state = self._state(conversation)
+        messages = []
+        if state["summary"]:
+            messages.append({"role": "system", "content": f"Earlier in this conversation:\n{state['summary']}"})
+        messages.extend({"role": m["role"], "content": m["content"]} for m, _ in state["turns"])
+        return messages
+
+    def token_count(self, conversation: Dict) -> int:
+        """Estimated tokens of the context build() returns"""
+        state = self._state(conversation)
+        return state["tokens"] + (estimate_tokens(state["summary"]) + MESSAGE_OVERHEAD_TOKENS if state["summary"] else 0)
@@ -0,0 +1,349 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from .models import Base, Conversation, Message
+from .utils import generate_message_id
+
+# Rough per-message bookkeeping cost on top of the content itself, used for the memory cap
+MESSAGE_OVERHEAD_BYTES = 256
+
+
+def conversation_row(conversation: Dict) -> Dict:
+    """The persistent fields of a conversation"""
+    return {
+        "id": conversation["conversation_id"],
+        "user_id": conversation["user_id"],
+        "language": conversation["language"],
+        "conversation_metadata": dict(conversation["metadata"]),
+        "created_at": conversation["created_at"],
+        "updated_at": conversation["updated_at"]
+    }
+
+
+class SQLConversationArchive:
+    """Cold storage for conversation history in the Conversation/Message tables
+
+    The engine is created on first use so importing the service never touches
+    the database.
+    """
+
+    def __init__(self, database_url: str):
+        self.database_url = database_url
+        self._session_factory = None
+        self._lock = threading.Lock()
+
+    def _sessions(self):
+        with self._lock:
+            if self._session_factory is None:
+                connect_args = {"check_same_thread": False} if self.database_url.startswith("sqlite") else {}
+                engine = create_engine(self.database_url, connect_args=connect_args)
+                Base.metadata.create_all(engine, tables=[Conversation.__table__, Message.__table__])
+                self._session_factory = sessionmaker(bind=engine)
+        return self._session_factory()
+
+    def write(self, items: List[Tuple[Dict, Optional[Dict]]]) -> None:
+        """Upsert conversations and their messages in one transaction
+
+        Args:
+            items: (conversation row, message or None) pairs in the order they were evicted
+        """
+        with self._sessions() as session:
+            # Only the newest state of each conversation needs writing
+            conversations = {row["id"]: row for row, _ in items}
+            for row in conversations.values():
+                session.merge(Conversation(**row))
+            for row, message in items:
+                if message is not None:
+                    session.merge(Message(
+                        id=message["message_id"],
+                        conversation_id=row["id"],
+                        sequence=message["sequence"],
+                        role=message["role"],
+                        content=message["content"],
+                        message_type=message["message_type"],
+                        created_at=message["timestamp"]
+                    ))
+            session.commit()
+
+    def load_conversation(self, conversation_id: str) -> Optional[Dict]:
+        """Conversation row plus the sequence number its next message should get"""
+        with self._sessions() as session:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None:
+                return None
+            last_sequence = session.query(func.max(Message.sequence)).filter(
+                Message.conversation_id == conversation_id
+            ).scalar()
+            return {
+                "conversation_id": conversation.id,
+                "user_id": conversation.user_id,
+                "language": conversation.language,
+                "metadata": dict(conversation.conversation_metadata or {}),
+                "created_at": conversation.created_at,
+                "updated_at": conversation.updated_at,
+                "next_sequence": 0 if last_sequence is None else last_sequence + 1
+            }
+
+    def load_messages(self, conversation_id: str, limit: int, before: Optional[int] = None) -> List[Dict]:
+        """The newest `limit` messages (all if limit <= 0) with a sequence below `before`, oldest first"""
+        with self._sessions() as session:
+            query = session.query(Message).filter(Message.conversation_id == conversation_id)
+            if before is not None:
+                query = query.filter(Message.sequence < before)
+            query = query.order_by(Message.sequence.desc())
+            if limit > 0:
+                query = query.limit(limit)
+            messages = [
+                {
+                    "message_id": message.id,
+                    "sequence": message.sequence,
+                    "role": message.role,
+                    "content": message.content,
+                    "message_type": message.message_type,
+                    "timestamp": message.created_at
+                }
+                for message in query
+            ]
+        messages.reverse()
+        return messages
+
+
+class ConversationStore:
+    """Bounded in-memory conversation history backed by an archive
+
+    Each conversation keeps at most `max_messages` recent messages in memory;
+    older ones are written through to the archive as they fall out of the
+    ring buffer. Whole conversations are evicted in least-recently-used order
+    once they have been idle for `ttl_seconds` or the store exceeds
+    `max_bytes`, and are transparently restored when they are used again.
+
+    Archive writes happen on a single background thread so request handlers
+    never wait on the database to append a message. Reads flush pending
+    writes first, so history is never missing messages that were just evicted.
+    """
+
+    def __init__(
+        self,
+        archive: SQLConversationArchive,
+        max_messages: int = 50,
+        ttl_seconds: float = 30 * 60,
+        max_bytes: int = 64 * 1024 * 1024
+    ):
+        self.archive = archive
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+
+        # Least recently used first
+        self._conversations: "OrderedDict[str, Dict]" = OrderedDict()
+        # Conversation ID -> [lock, number of openers holding or waiting for it]
+        self._opening: Dict[str, list] = {}
+
+        self._outbox: List[Tuple[Dict, Optional[Dict]]] = []
+        self._outbox_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-archive")
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._conversations
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        """A conversation currently held in memory, or None"""
+        return self._conversations.get(conversation_id)
+
+    async def open(
+        self,
+        conversation_id: str,
+        user_id: Optional[str] = None,
+        language: str = "en"
+    ) -> Dict:
+        """Return a conversation, restoring it from the archive or creating it if needed
+
+        Concurrent opens of the same conversation share one restore, so they
+        all get the same conversation rather than each creating their own.
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            opening = self._opening.setdefault(conversation_id, [asyncio.Lock(), 0])
+            opening[1] += 1
+            try:
+                async with opening[0]:
+                    conversation = self._conversations.get(conversation_id)
+                    if conversation is None:
+                        conversation = await self._restore(conversation_id, user_id, language)
+            finally:
+                opening[1] -= 1
+                if not opening[1]:
+                    del self._opening[conversation_id]
+
+        self._touch(conversation_id)
+        self._evict()
+        return conversation
+
+    async def _restore(self, conversation_id: str, user_id: Optional[str], language: str) -> Dict:
+        stored = await asyncio.to_thread(self._read, self.archive.load_conversation, conversation_id)
+        conversation = stored or {
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "language": language,
+            "metadata": {},
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+            "next_sequence": 0
+        }
+        conversation["messages"] = deque()
+        conversation["size_bytes"] = 0
+        self._conversations[conversation_id] = conversation
+        return conversation
+
+    async def append(
+        self,
+        conversation_id: str,
+        role: str,
+        content: str,
+        message_type: str = "text",
+        message_id: Optional[str] = None
+    ) -> Dict:
+        """Append a message to a conversation and return it"""
+        conversation = self._conversations.get(conversation_id) or await self.open(conversation_id)
+
+        message = {
+            "message_id": message_id or generate_message_id(),
+            "sequence": conversation["next_sequence"],
+            "role": role,
+            "content": content,
+            "message_type": message_type,
+            "timestamp": datetime.utcnow()
+        }
+        conversation["next_sequence"] += 1
+        conversation["updated_at"] = message["timestamp"]
+
+        # Ring buffer: the oldest message moves to the archive to make room
+        messages = conversation["messages"]
+        if len(messages) >= self.max_messages:
+            self._spill(conversation, [messages.popleft()])
+        messages.append(message)
+        self._account(conversation, self._message_size(message))
+
+        self._touch(conversation_id)
+        self._evict()
+        return message
+
+    async def history(
+        self,
+        conversation_id: str,
+        limit: int = 10,
+        before: Optional[int] = None
+    ) -> Optional[Dict]:
+        """The newest `limit` messages (all if limit <= 0) with a sequence below `before`
+
+        The hot tail comes from memory; anything older is paged from the archive.
+        Returns None if the conversation does not exist.
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            conversation = await asyncio.to_thread(self._read, self.archive.load_conversation, conversation_id)
+            if conversation is None:
+                return None
+            hot = []
+        else:
+            self._touch(conversation_id)
+            hot = [m for m in conversation["messages"] if before is None or m["sequence"] < before]
+
+        messages = hot[-limit:] if limit > 0 else hot
+        if limit <= 0 or len(messages) < limit:
+            # Everything older than the hot tail lives in the archive
+            boundary = messages[0]["sequence"] if messages else before
+            if boundary is None or boundary > 0:
+                older = await asyncio.to_thread(
+                    self._read,
+                    self.archive.load_messages,
+                    conversation_id,
+                    limit - len(messages) if limit > 0 else 0,
+                    boundary
+                )
+                messages = older + messages
+
+        return {
+            "conversation_id": conversation_id,
+            "user_id": conversation["user_id"],
+            "messages": messages,
+            "created_at": conversation["created_at"],
+            "updated_at": conversation["updated_at"]
+        }
+
+    async def flush(self) -> None:
+        """Wait until every evicted message has been written to the archive"""
+        await asyncio.to_thread(self._flush)
+
+    def _touch(self, conversation_id: str) -> None:
+        self._conversations[conversation_id]["last_access"] = time.monotonic()
+        self._conversations.move_to_end(conversation_id)
+
+    @staticmethod
+    def _message_size(message: Dict) -> int:
+        return len(message["content"]) + MESSAGE_OVERHEAD_BYTES
+
+    def _account(self, conversation: Dict, delta: int) -> None:
+        conversation["size_bytes"] += delta
+        self.size_bytes += delta
+
+    def _evict(self) -> None:
+        """Evict idle conversations, then least recently used ones until under the memory cap"""
+        now = time.monotonic()
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            idle = now - conversation["last_access"] > self.ttl_seconds
+            # Never evict the conversation that is being used right now
+            if not idle and (self.size_bytes <= self.max_bytes or len(self._conversations) == 1):
+                break
+            del self._conversations[conversation_id]
+            self._spill(conversation, list(conversation["messages"]), evicted=True)
+
+    def _spill(self, conversation: Dict, messages: List[Dict], evicted: bool = False) -> None:
+        """Queue messages (and the conversation row) for the archive and release their memory"""
+        row = conversation_row(conversation)
+        with self._outbox_lock:
+            if messages:
+                self._outbox.extend((row, message) for message in messages)
+            elif evicted:
+                self._outbox.append((row, None))
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+
+        self._account(conversation, -sum(self._message_size(message) for message in messages))
+        if schedule:
+            self._writer.submit(self._flush)
+
+    def _flush(self) -> None:
+        with self._flush_lock:
+            with self._outbox_lock:
+                batch, self._outbox = self._outbox, []
+                self._flush_scheduled = False
+            if not batch:
+                return
+            try:
+                self.archive.write(batch)
+            except Exception:
+                # Keep the batch for the next flush rather than losing history
+                with self._outbox_lock:
+                    self._outbox[:0] = batch
+                raise
+
+    def _read(self, load, *args):
+        """Run an archive read after pending writes have landed"""
+        self._flush()
+        return load(*args)
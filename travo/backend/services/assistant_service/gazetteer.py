@@ -0,0 +1,178 @@
+import re
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .catalogs import load_catalog_records
+
+# (name, entity type, entity ID)
+GazetteerEntry = Tuple[str, str, str]
+
+
+def _fold(text: str) -> str:
+    """Lowercase text without changing its length
+
+    A few characters lowercase to two (e.g. "İ"); those are kept as-is so that
+    match offsets in the folded text line up with the original text.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+class Gazetteer:
+    """Case-insensitive dictionary matcher over entity names (Aho-Corasick)
+
+    All names are compiled into one automaton, so scanning a text costs time
+    proportional to its length plus the number of matches, however many names
+    the gazetteer holds. Matches must start and end on word boundaries.
+    """
+
+    def __init__(self, entries: Iterable[GazetteerEntry]):
+        # Trie transitions, failure links and, per state, the patterns ending there
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[int]] = [[]]
+        # Nearest state along the failure chain that has outputs (0 if none)
+        self._output_link: List[int] = [0]
+
+        self._lengths: List[int] = []
+        self._entities: List[List[Dict]] = []
+        patterns: Dict[str, int] = {}
+
+        for name, entity_type, entity_id in entries:
+            key = _fold(name.strip())
+            if not key:
+                continue
+            pattern = patterns.get(key)
+            if pattern is None:
+                pattern = patterns[key] = len(self._lengths)
+                self._lengths.append(len(key))
+                self._entities.append([])
+                self._insert(key, pattern)
+            entity = {"name": name.strip(), "type": entity_type, "id": entity_id}
+            if entity not in self._entities[pattern]:
+                self._entities[pattern].append(entity)
+
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def _insert(self, key: str, pattern: int) -> None:
+        state = 0
+        for char in key:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._output_link.append(0)
+            state = next_state
+        self._outputs[state].append(pattern)
+
+    def _link(self) -> None:
+        """Compute failure and output links breadth-first"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail_state = self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output_link[next_state] = fail_state if self._outputs[fail_state] else self._output_link[fail_state]
+
+    def find_all(self, text: str) -> List[Dict]:
+        """Every occurrence of every name in the text, including overlapping ones
+
+        Returns:
+            Dicts with "start", "end", "text" (as written), "name", "type" and "id",
+            one per entity, ordered by end position
+        """
+        goto, fail, outputs, output_link = self._goto, self._fail, self._outputs, self._output_link
+        matches = []
+        state = 0
+
+        for position, char in enumerate(_fold(text)):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            found = state if outputs[state] else output_link[state]
+            while found:
+                for pattern in outputs[found]:
+                    end = position + 1
+                    start = end - self._lengths[pattern]
+                    if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                        for entity in self._entities[pattern]:
+                            matches.append({"start": start, "end": end, "text": text[start:end], **entity})
+                found = output_link[found]
+
+        return matches
+
+    def extract(self, text: str) -> List[Dict]:
+        """Non-overlapping matches, preferring the leftmost and then the longest name
+
+        "Eiffel Tower Restaurant" is reported as the restaurant rather than
+        also as the tower. A name shared by several entities yields one match
+        per entity with the same span.
+        """
+        spans: Dict[Tuple[int, int], List[Dict]] = {}
+        for match in self.find_all(text):
+            spans.setdefault((match["start"], match["end"]), []).append(match)
+
+        selected = []
+        covered_until = 0
+        for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+            if start >= covered_until:
+                selected.extend(spans[(start, end)])
+                covered_until = end
+        return selected
+
+
+def load_catalog_entries() -> List[GazetteerEntry]:
+    """Entity names from the catalogs, plus the cities and countries they mention"""
+    entries: List[GazetteerEntry] = []
+    for record in load_catalog_records():
+        entries.append((record["name"], record["type"], record["id"]))
+        for field in ("city", "country"):
+            if record[field]:
+                entries.append((record[field], field, f"{field}:{_slug(record[field])}"))
+    return entries
+
+
+_gazetteer: Optional[Gazetteer] = None
+_build_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """The current gazetteer, built from the catalogs on first use"""
+    gazetteer = _gazetteer
+    if gazetteer is None:
+        with _build_lock:
+            if _gazetteer is None:
+                rebuild_gazetteer()
+        gazetteer = _gazetteer
+    return gazetteer
+
+
+def rebuild_gazetteer(entries: Optional[Iterable[GazetteerEntry]] = None) -> Gazetteer:
+    """Build a new gazetteer and swap it in
+
+    Call this when a catalog changes. The new automaton is built completely
+    before it replaces the old one, so concurrent lookups always see either
+    the old or the new gazetteer, never a partial one.
+    """
+    global _gazetteer
+    gazetteer = Gazetteer(load_catalog_entries() if entries is None else entries)
+    _gazetteer = gazetteer
+    return gazetteer
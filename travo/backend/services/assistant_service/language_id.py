@@ -0,0 +1,304 @@
+"""Character n-gram language identification
+
+Languages with a script of their own are recognized from the script alone.
+Latin-script languages are told apart by a naive Bayes model over character
+1- to 3-grams, with per-language profiles precomputed from the texts in
+language_corpus/:
+
+    python -m services.assistant_service.language_id --build
+"""
+import os
+import re
+import math
+import json
+import argparse
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+PROFILES_PATH = os.path.join(os.path.dirname(__file__), "language_profiles.json")
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "language_corpus")
+
+MAX_ORDER = 3
+# N-grams kept per order and language in the precomputed profiles
+PROFILE_SIZE = 400
+SMOOTHING = 0.5
+
+# Shorter Latin-script text (e.g. a bare place name) is too little evidence to go on.
+# Known place and business names are not counted
+MIN_LETTERS = 8
+# Confidence the best language needs over the runner-up; cognates ("hotels", "best",
+# "in") leave even the wrong language fairly sure of itself on a few words
+MIN_MARGIN = 0.8
+
+# Words whose n-gram scores are kept; the cache is simply cleared when it fills up
+WORD_CACHE_SIZE = 50000
+
+# Scales the per-n-gram log-likelihood into a confidence; naive Bayes on its own is far too sure of itself
+CONFIDENCE_TEMPERATURE = 4.0
+
+LANGUAGE_NAMES = {
+    "en": "English", "fr": "French", "es": "Spanish", "it": "Italian", "de": "German",
+    "pt": "Portuguese", "nl": "Dutch", "id": "Indonesian", "tr": "Turkish",
+    "el": "Greek", "ru": "Russian", "ar": "Arabic", "hi": "Hindi",
+    "ja": "Japanese", "zh": "Chinese", "ko": "Korean", "th": "Thai", "he": "Hebrew"
+}
+
+# (first code point, last code point, language) for scripts used by a single market language
+SCRIPT_RANGES = [
+    (0x0370, 0x03FF, "el"),
+    (0x0400, 0x04FF, "ru"),
+    (0x0590, 0x05FF, "he"),
+    (0x0600, 0x06FF, "ar"),
+    (0x0900, 0x097F, "hi"),
+    (0x0E00, 0x0E7F, "th"),
+    (0x3040, 0x30FF, "ja"),  # Hiragana and katakana
+    (0xAC00, 0xD7AF, "ko"),
+    (0x4E00, 0x9FFF, "zh"),  # Han; Japanese text mixes it with kana
+]
+
+NON_LETTERS = re.compile(r"[^\w]+|[\d_]+")
+WORDS = re.compile(r"[^\W\d_]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase with digits and punctuation collapsed to single spaces"""
+    return NON_LETTERS.sub(" ", unicodedata.normalize("NFC", text.lower())).strip()
+
+
+def word_ngrams(word: str) -> List[str]:
+    """Character n-grams of a word, padded with spaces so its start and end are features"""
+    padded = f" {word} "
+    grams = list(word)
+    for order in range(2, MAX_ORDER + 1):
+        grams.extend(padded[i:i + order] for i in range(len(padded) - order + 1))
+    return grams
+
+
+def extract_ngrams(text: str) -> List[str]:
+    """Character n-grams of every word of a text"""
+    return [gram for word in normalize(text).split() for gram in word_ngrams(word)]
+
+
+def _gram_order(gram: str) -> int:
+    return len(gram)
+
+
+def build_profiles(texts: Dict[str, str], profile_size: int = PROFILE_SIZE) -> Dict[str, Dict[str, int]]:
+    """Count the most frequent n-grams of each order in each language's text"""
+    profiles = {}
+    for language, text in texts.items():
+        counts = Counter(extract_ngrams(text))
+        profile = {}
+        for order in range(1, MAX_ORDER + 1):
+            grams = [(gram, count) for gram, count in counts.items() if _gram_order(gram) == order]
+            grams.sort(key=lambda item: (-item[1], item[0]))
+            profile.update(grams[:profile_size])
+        profiles[language] = profile
+    return profiles
+
+
+def script_language(text: str) -> Optional[Tuple[str, float]]:
+    """The language given away by the script of most of the letters, and the share of letters in it"""
+    if text.isascii():
+        return None
+    letters = 0
+    counts: Counter = Counter()
+    for char in text:
+        if not char.isalpha():
+            continue
+        letters += 1
+        code = ord(char)
+        if code < 0x0370:
+            continue
+        for first, last, language in SCRIPT_RANGES:
+            if first <= code <= last:
+                counts[language] += 1
+                break
+
+    if not counts:
+        return None
+    # Any kana means Japanese, even if Han characters are more frequent
+    if counts["ja"]:
+        counts["ja"] += counts.pop("zh", 0)
+    language, count = counts.most_common(1)[0]
+    if count * 2 < letters:
+        return None
+    return language, count / letters
+
+
+class NgramLanguageModel:
+    """Naive Bayes language scorer over character n-grams
+
+    The log-probabilities of all profile n-grams are held in one matrix with
+    a row per n-gram and a column per language. Words recur across queries,
+    so each word's summed scores are cached and scoring a text is mostly one
+    dictionary lookup and one vector addition per word.
+    """
+
+    def __init__(self, profiles: Dict[str, Dict[str, int]], smoothing: float = SMOOTHING):
+        self.languages = sorted(profiles)
+        vocabulary = sorted({gram for profile in profiles.values() for gram in profile})
+        self._rows = {gram: row for row, gram in enumerate(vocabulary)}
+        orders = np.array([_gram_order(gram) for gram in vocabulary])
+
+        counts = np.zeros((len(vocabulary), len(self.languages)), dtype=np.float64)
+        for column, language in enumerate(self.languages):
+            for gram, count in profiles[language].items():
+                counts[self._rows[gram], column] = count
+
+        # Each order is its own distribution, smoothed over that order's vocabulary plus one unseen bucket
+        self._log_probs = np.zeros_like(counts, dtype=np.float32)
+        self._unseen = np.zeros((MAX_ORDER + 1, len(self.languages)), dtype=np.float32)
+        for order in range(1, MAX_ORDER + 1):
+            mask = orders == order
+            totals = counts[mask].sum(axis=0) + smoothing * (mask.sum() + 1)
+            self._log_probs[mask] = np.log((counts[mask] + smoothing) / totals)
+            self._unseen[order] = np.log(smoothing / totals)
+
+        self._words: Dict[str, Tuple[np.ndarray, int]] = {}
+
+    def _word_scores(self, word: str) -> Tuple[np.ndarray, int]:
+        cached = self._words.get(word)
+        if cached is not None:
+            return cached
+
+        rows = []
+        unseen = [0] * (MAX_ORDER + 1)
+        grams = word_ngrams(word)
+        for gram in grams:
+            row = self._rows.get(gram)
+            if row is None:
+                unseen[len(gram)] += 1
+            else:
+                rows.append(row)
+        scores = self._log_probs[rows].sum(axis=0) + np.asarray(unseen, dtype=np.float32) @ self._unseen
+
+        if len(self._words) >= WORD_CACHE_SIZE:
+            self._words.clear()
+        self._words[word] = (scores, len(grams))
+        return scores, len(grams)
+
+    def scores(self, text: str) -> Tuple[np.ndarray, int]:
+        """Log-likelihood of the text under each language, and the number of n-grams scored"""
+        total = np.zeros(len(self.languages), dtype=np.float32)
+        count = 0
+        for word in normalize(text).split():
+            scores, grams = self._word_scores(word)
+            total += scores
+            count += grams
+        return total, count
+
+    def identify(self, text: str) -> List[Tuple[str, float]]:
+        """(language, confidence) pairs, most likely first; empty if the text has no letters"""
+        scores, count = self.scores(text)
+        if not count:
+            return []
+        # Average per-n-gram evidence, growing slowly with length, rather than the raw product
+        scale = CONFIDENCE_TEMPERATURE * math.log1p(count) / count
+        # A handful of languages: plain Python beats numpy's per-call overhead here
+        logits = [score * scale for score in scores.tolist()]
+        best = max(logits)
+        weights = [math.exp(logit - best) for logit in logits]
+        total = sum(weights)
+        ranked = sorted(zip(self.languages, weights), key=lambda item: -item[1])
+        return [(language, weight / total) for language, weight in ranked]
+
+
+def load_profiles(path: str = PROFILES_PATH) -> Dict[str, Dict[str, int]]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+_model: Optional[NgramLanguageModel] = None
+_load_lock = threading.Lock()
+
+
+def get_language_model() -> NgramLanguageModel:
+    """The n-gram model built from the precomputed profiles, loaded on first use"""
+    global _model
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                _model = NgramLanguageModel(load_profiles())
+    return _model
+
+
+def identify_language(text: str, limit: int = 3) -> List[Tuple[str, float]]:
+    """The most likely languages of a text with confidences between 0 and 1
+
+    Returns an empty list for text without letters.
+    """
+    by_script = script_language(text)
+    if by_script is not None:
+        return [by_script]
+    return get_language_model().identify(text)[:limit]
+
+
+def evidence_words(text: str) -> List[str]:
+    """The words of a text that say something about its language
+
+    Capitalized words that the gazetteer knows as a place or business name
+    ("Paris", "Eiffel Tower") are left out: names keep their spelling whatever
+    language surrounds them. Other capitalized words, such as German nouns,
+    are kept.
+    """
+    # Imported here: the gazetteer loads the catalogs, which language scoring alone doesn't need
+    from .gazetteer import get_gazetteer
+
+    names = [(match["start"], match["end"]) for match in get_gazetteer().extract(text)]
+    return [
+        match.group()
+        for match in WORDS.finditer(text)
+        if not (match.group()[0].isupper() and any(start <= match.start() and match.end() <= end for start, end in names))
+    ]
+
+
+def best_language(text: str, default: str = "en") -> str:
+    """The most likely language of a text, or `default` when the text is too short or ambiguous to tell"""
+    by_script = script_language(text)
+    if by_script is not None:
+        return by_script[0]
+    words = evidence_words(text)
+    if sum(len(word) for word in words) < MIN_LETTERS:
+        return default
+    model = get_language_model()
+    ranked = model.identify(" ".join(words))
+    language, confidence = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    if confidence - runner_up < MIN_MARGIN:
+        return default
+
+    # Capitalized words the gazetteer doesn't know may still be names ("Restaurants in
+    # Amsterdam"), so the call must not hinge on them
+    plain = [word for i, word in enumerate(words) if i == 0 or not word[0].isupper()]
+    if len(plain) < len(words) and sum(len(word) for word in plain) >= MIN_LETTERS:
+        if model.identify(" ".join(plain))[0][0] != language:
+            return default
+    return language
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Language identification profiles")
+    parser.add_argument("--build", action="store_true", help=f"Rebuild {os.path.basename(PROFILES_PATH)} from {CORPUS_DIR}")
+    parser.add_argument("text", nargs="*", help="Text to identify")
+    args = parser.parse_args()
+
+    if args.build:
+        texts = {}
+        for filename in sorted(os.listdir(CORPUS_DIR)):
+            language, extension = os.path.splitext(filename)
+            if extension == ".txt":
+                with open(os.path.join(CORPUS_DIR, filename), encoding="utf-8") as f:
+                    texts[language] = f.read()
+        with open(PROFILES_PATH, "w", encoding="utf-8") as f:
+            json.dump(build_profiles(texts), f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    if args.text:
+        print(identify_language(" ".join(args.text)))
+
+
+if __name__ == "__main__":
+    main()
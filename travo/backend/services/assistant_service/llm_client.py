@@ -0,0 +1,283 @@
+import json
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import itertools
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+# Lower numbers are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMClientError(Exception):
+    """Raised when the LLM backend cannot produce a completion"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+class TokenScheduler:
+    """Token bucket shared by all requests, handing out tokens in priority order
+
+    The bucket refills continuously at `tokens_per_minute` up to one minute's
+    worth. A request waits until the bucket can cover its estimated tokens
+    and no request with a higher priority (or the same priority, queued
+    earlier) is still waiting, so batch work never delays interactive chat.
+    """
+
+    def __init__(self, tokens_per_minute: float):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(tokens_per_minute)
+        self.available = self.capacity
+        self._updated = time.monotonic()
+        self._waiters: List = []
+        self._order = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait until `tokens` can be spent at the given priority"""
+        # A request larger than the bucket could never be served; let it drain the bucket instead
+        tokens = min(float(tokens), self.capacity)
+        self._refill()
+        if not self._waiters and self.available >= tokens:
+            self.available -= tokens
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), tokens, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def adjust(self, tokens: float) -> None:
+        """Charge (positive) or refund (negative) tokens once actual usage is known"""
+        self._refill()
+        self.available = min(self.capacity, self.available - tokens)
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            priority, order, tokens, future = self._waiters[0]
+            if future.done():
+                # The waiter was cancelled
+                heapq.heappop(self._waiters)
+                continue
+            self._refill()
+            if self.available >= tokens:
+                heapq.heappop(self._waiters)
+                self.available -= tokens
+                future.set_result(None)
+            else:
+                await asyncio.sleep((tokens - self.available) / self.rate)
+
+
+class LLMClient:
+    """Client for an OpenAI-compatible chat completions endpoint
+
+    Hosted APIs and local inference servers (vLLM, llama.cpp, TGI) speak the
+    same protocol. Requests share one keep-alive connection pool, are paced
+    by a priority token bucket, identical in-flight requests are coalesced
+    into a single upstream call, and transient failures are retried with
+    jittered exponential backoff. `stream` yields a completion's text as the
+    backend generates it.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        api_key: Optional[str] = None,
+        tokens_per_minute: int = 90000,
+        max_connections: int = 32,
+        max_retries: int = 4,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 20.0,
+        timeout_seconds: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout_seconds,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport
+        )
+        self.model = model
+        self.scheduler = TokenScheduler(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.upstream_calls = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> Dict:
+        """Generate a chat completion
+
+        Args:
+            messages: Chat messages ({"role", "content"}) making up the prompt
+            priority: PRIORITY_INTERACTIVE for user-facing chat, PRIORITY_BATCH for background work
+
+        Returns:
+            {"text": ..., "usage": {"prompt_tokens", "completion_tokens", "total_tokens"}}
+        """
+        payload = {"model": self.model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+        # Identical request already on its way upstream: share its result
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._request(payload, priority)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> AsyncIterator[str]:
+        """Generate a chat completion, yielding its text as the backend produces it
+
+        Failures before the first piece of text are retried like `complete`;
+        once text has been yielded a failure is raised as LLMClientError.
+        Streams are not coalesced.
+
+        Args:
+            messages: Chat messages ({"role", "content"}) making up the prompt
+            priority: PRIORITY_INTERACTIVE for user-facing chat, PRIORITY_BATCH for background work
+        """
+        payload = {
+            "model": self.model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature,
+            "stream": True, "stream_options": {"include_usage": True}
+        }
+        estimated = self._estimate(payload)
+        started = False
+
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(estimated, priority)
+            retry_after = None
+            try:
+                self.upstream_calls += 1
+                async with self._http.stream("POST", "/chat/completions", json=payload) as response:
+                    if response.status_code == 200:
+                        usage = {}
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            event = json.loads(data)
+                            usage = event.get("usage") or usage
+                            for choice in event.get("choices") or []:
+                                text = (choice.get("delta") or {}).get("content")
+                                if text:
+                                    started = True
+                                    yield text
+                        # Settle the estimate against what the backend actually counted
+                        if "total_tokens" in usage:
+                            self.scheduler.adjust(usage["total_tokens"] - estimated)
+                        return
+
+                    await response.aread()
+                    self.scheduler.adjust(-estimated)
+                    failure, retry_after = self._failure(response)
+            except httpx.TransportError as error:
+                self.scheduler.adjust(-estimated)
+                if started:
+                    # Retrying would repeat text the caller already has
+                    raise LLMClientError("LLM stream broke off") from error
+                failure = error
+
+            if attempt == self.max_retries:
+                raise LLMClientError(f"LLM request failed after {attempt + 1} attempts") from failure
+
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    def _estimate(self, payload: Dict) -> int:
+        return sum(estimate_tokens(m["content"]) for m in payload["messages"]) + payload["max_tokens"]
+
+    def _failure(self, response: httpx.Response):
+        """(error, Retry-After seconds) for an unsuccessful response; raises if it should not be retried"""
+        failure = LLMClientError(f"LLM backend returned {response.status_code}: {response.text[:200]}")
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            raise failure
+        retry_after = None
+        if "retry-after" in response.headers:
+            try:
+                retry_after = float(response.headers["retry-after"])
+            except ValueError:
+                retry_after = None
+        return failure, retry_after
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter keeps many clients from retrying in lockstep
+        backoff = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+        return max(backoff, retry_after or 0.0)
+
+    async def _request(self, payload: Dict, priority: int) -> Dict:
+        estimated = self._estimate(payload)
+
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(estimated, priority)
+            retry_after = None
+            try:
+                self.upstream_calls += 1
+                response = await self._http.post("/chat/completions", json=payload)
+            except httpx.TransportError as error:
+                self.scheduler.adjust(-estimated)
+                failure = error
+            else:
+                if response.status_code == 200:
+                    body = response.json()
+                    usage = body.get("usage") or {}
+                    # Settle the estimate against what the backend actually counted
+                    if "total_tokens" in usage:
+                        self.scheduler.adjust(usage["total_tokens"] - estimated)
+                    return {"text": body["choices"][0]["message"]["content"], "usage": usage}
+
+                self.scheduler.adjust(-estimated)
+                failure, retry_after = self._failure(response)
+
+            if attempt == self.max_retries:
+                raise LLMClientError(f"LLM request failed after {attempt + 1} attempts") from failure
+
+            await asyncio.sleep(self._backoff(attempt, retry_after))
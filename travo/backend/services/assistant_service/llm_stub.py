@@ -0,0 +1,114 @@
+"""Stand-in for an OpenAI-compatible LLM server, for tests and benchmarks
+
+Simulates generation latency, a tokens-per-minute limit (answered with 429
+and Retry-After) and random upstream failures. Requests with "stream": true
+are answered word by word as Server-Sent Events.
+
+    python -m services.assistant_service.llm_stub --port 8100 --tokens-per-minute 20000
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .llm_client import estimate_tokens
+
+
+def create_stub_app(
+    base_latency_seconds: float = 0.05,
+    seconds_per_token: float = 0.001,
+    tokens_per_minute: int = 100000,
+    failure_rate: float = 0.0
+) -> FastAPI:
+    app = FastAPI(title="LLM stub")
+    app.state.stats = {"requests": 0, "completed": 0, "rate_limited": 0, "failed": 0}
+    window = {"started": time.monotonic(), "used": 0}
+
+    @app.post("/chat/completions")
+    async def chat_completions(payload: Dict):
+        stats = app.state.stats
+        stats["requests"] += 1
+
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in payload["messages"])
+        last_message = payload["messages"][-1]["content"]
+        text = f"Stub reply to: {last_message[:200]}"
+        completion_tokens = min(payload.get("max_tokens", 256), estimate_tokens(text))
+        total_tokens = prompt_tokens + completion_tokens
+
+        # Fixed one-minute window, like most hosted rate limiters
+        now = time.monotonic()
+        if now - window["started"] >= 60:
+            window["started"], window["used"] = now, 0
+        if window["used"] + total_tokens > tokens_per_minute:
+            stats["rate_limited"] += 1
+            retry_after = max(0.0, 60 - (now - window["started"]))
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit exceeded"}},
+                headers={"Retry-After": f"{retry_after:.2f}"}
+            )
+        window["used"] += total_tokens
+
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total_tokens}
+        if payload.get("stream"):
+            if random.random() < failure_rate:
+                stats["failed"] += 1
+                return JSONResponse(status_code=503, content={"error": {"message": "Upstream overloaded"}})
+            await asyncio.sleep(base_latency_seconds)
+            return StreamingResponse(stream_events(text, usage, completion_tokens), media_type="text/event-stream")
+
+        await asyncio.sleep(base_latency_seconds + seconds_per_token * completion_tokens)
+
+        if random.random() < failure_rate:
+            stats["failed"] += 1
+            return JSONResponse(status_code=503, content={"error": {"message": "Upstream overloaded"}})
+
+        stats["completed"] += 1
+        return {
+            "id": f"stub-{stats['requests']}",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    async def stream_events(text: str, usage: Dict, completion_tokens: int):
+        # Spread the generation time over the words, as a real backend would
+        words = re.findall(r"\S+\s*", text)
+        for word in words:
+            await asyncio.sleep(seconds_per_token * completion_tokens / len(words))
+            yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': word}}]})}\n\n"
+        yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+        app.state.stats["completed"] += 1
+
+    @app.get("/stats")
+    async def get_stats():
+        return app.state.stats
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--base-latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--seconds-per-token", type=float, default=0.001)
+    parser.add_argument("--tokens-per-minute", type=int, default=100000)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args()
+
+    app = create_stub_app(args.base_latency, args.seconds_per_token, args.tokens_per_minute, args.failure_rate)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text, Enum, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -15,7 +15,8 @@ class Conversation(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     language = Column(String, default="en")
-    metadata = Column(JSON, default={})
+    # "metadata" is reserved on declarative classes, so the attribute is renamed
+    conversation_metadata = Column("metadata", JSON, default={})
     
     # Relationship with messages
     messages = relationship("Message", back_populates="conversation")
@@ -25,6 +26,7 @@ class Message(Base):
     
     id = Column(String, primary_key=True)
     conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)  # Position of the message within its conversation
     role = Column(String, nullable=False)  # user, assistant, system
     content = Column(Text, nullable=False)
     message_type = Column(String, default="text")  # text, voice
@@ -40,6 +42,11 @@ class Message(Base):
     
     # Relationship with sources
     sources = relationship("MessageSource", back_populates="message")
+    
+    __table_args__ = (
+        # History is always read as "the messages of one conversation before a position"
+        Index("ix_messages_conversation_sequence", "conversation_id", "sequence"),
+    )
 
 class MessageSource(Base):
     __tablename__ = "message_sources"
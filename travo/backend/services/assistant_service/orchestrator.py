@@ -0,0 +1,162 @@
+import re
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from .gazetteer import get_gazetteer
+from .search_index import get_search_index
+
+# Keywords that signal each intent (matched against lowercased words of the query)
+INTENT_KEYWORDS = {
+    "crowds": {"crowd", "crowds", "crowded", "busy", "queue", "queues", "line", "lines", "wait", "quiet", "packed"},
+    "businesses": {
+        "restaurant", "restaurants", "eat", "food", "dinner", "lunch", "breakfast", "cafe",
+        "hotel", "hotels", "stay", "sleep", "shop", "shops", "shopping", "souvenir", "souvenirs"
+    },
+    "recommendations": {"recommend", "recommendation", "recommendations", "suggest", "suggestion", "ideas", "trending", "destinations"},
+    "itinerary": {"itinerary", "itineraries", "trip", "trips", "schedule", "plans"}
+}
+
+BUSINESS_CATEGORY_KEYWORDS = {
+    "restaurant": {"restaurant", "restaurants", "eat", "food", "dinner", "lunch", "breakfast", "cafe"},
+    "hotel": {"hotel", "hotels", "stay", "sleep"},
+    "shopping": {"shop", "shops", "shopping", "souvenir", "souvenirs"}
+}
+
+# Entity types that have a crowd forecast
+CROWD_ENTITY_TYPES = ("attraction", "monument", "destination")
+
+MAX_CALLS_PER_INTENT = 3
+
+
+class ToolCall(NamedTuple):
+    """One service call planned for a query"""
+    tool: str
+    arguments: Dict[str, Any]
+    run: Callable[[], Awaitable[Any]]
+
+
+def _words(query: str) -> set:
+    return set(re.findall(r"[a-z]+", query.lower()))
+
+
+def detect_intents(query: str) -> List[str]:
+    """Intents of a query, in INTENT_KEYWORDS order"""
+    words = _words(query)
+    return [intent for intent, keywords in INTENT_KEYWORDS.items() if words & keywords]
+
+
+async def _items(page: Awaitable) -> List:
+    """Drop the total count from an (items, total) result"""
+    items, _ = await page
+    return items
+
+
+def plan_tool_calls(
+    query: str,
+    user_id: Optional[str] = None,
+    location: Optional[Dict] = None
+) -> List[ToolCall]:
+    """Decide which service calls answer a query
+
+    Intents come from keywords; places come from gazetteer matches, falling
+    back to the caller's location.
+    """
+    # Service modules are imported here so the assistant does not load them at import time
+    from services.crowd_service.service_logic import get_crowd_prediction
+    from services.business_service.service_logic import get_businesses
+    from services.recommendation_service.service_logic import get_trending_destinations, get_attraction_recommendations
+    from services.itinerary_service.service_logic import get_itineraries
+
+    intents = detect_intents(query)
+    if not intents:
+        return []
+
+    entities = get_gazetteer().extract(query)
+    records = get_search_index().documents
+    places = [
+        records[f"{entity['type']}:{entity['id']}"] for entity in entities
+        if f"{entity['type']}:{entity['id']}" in records
+    ]
+    words = _words(query)
+    calls: List[ToolCall] = []
+
+    if "crowds" in intents:
+        names = list(dict.fromkeys(p["name"] for p in places if p["type"] in CROWD_ENTITY_TYPES))
+        for name in names[:MAX_CALLS_PER_INTENT]:
+            calls.append(ToolCall("crowd_prediction", {"location": name}, lambda name=name: get_crowd_prediction(name)))
+
+    if "businesses" in intents:
+        point = next(((p["latitude"], p["longitude"]) for p in places if p["latitude"] is not None), None)
+        if point is None and location and location.get("latitude") is not None:
+            point = (location["latitude"], location["longitude"])
+        if point is not None:
+            category = next((c for c, keywords in BUSINESS_CATEGORY_KEYWORDS.items() if words & keywords), None)
+            arguments = {"latitude": point[0], "longitude": point[1], "category": category, "limit": 5}
+            calls.append(ToolCall("businesses", arguments, lambda arguments=arguments: get_businesses(**arguments)))
+
+    if "recommendations" in intents:
+        destinations = list(dict.fromkeys(p["id"] for p in places if p["type"] == "destination"))
+        for destination_id in destinations[:MAX_CALLS_PER_INTENT]:
+            calls.append(ToolCall(
+                "attraction_recommendations",
+                {"destination_id": destination_id},
+                lambda destination_id=destination_id: _items(get_attraction_recommendations(destination_id, limit=5))
+            ))
+        if not destinations:
+            calls.append(ToolCall("trending_destinations", {}, lambda: _items(get_trending_destinations(limit=5))))
+
+    if "itinerary" in intents and user_id:
+        calls.append(ToolCall("itineraries", {"user_id": user_id}, lambda: get_itineraries(user_id, limit=5)))
+
+    return calls
+
+
+async def run_tool_calls(calls: List[ToolCall], deadline_seconds: float) -> List[Dict]:
+    """Run planned calls concurrently, each cancelled on its own if it misses the deadline
+
+    Every call gets the same deadline, so the whole fan-out takes as long as
+    the slowest call that finishes in time, and never longer than the deadline.
+
+    Returns:
+        One entry per call with "tool", "arguments", "status" ("ok", "timeout"
+        or "error"), "result" and "elapsed_ms"
+    """
+    async def run(call: ToolCall) -> Dict:
+        started = time.perf_counter()
+        outcome = {"tool": call.tool, "arguments": call.arguments, "result": None}
+        try:
+            result = await asyncio.wait_for(call.run(), timeout=deadline_seconds)
+            outcome.update(status="ok", result=jsonable_encoder(result))
+        except asyncio.TimeoutError:
+            outcome["status"] = "timeout"
+        except Exception as error:
+            outcome.update(status="error", error=str(error))
+        outcome["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return outcome
+
+    return list(await asyncio.gather(*(run(call) for call in calls)))
+
+
+def summarize_tool_results(results: List[Dict]) -> List[str]:
+    """One sentence per successful tool result, for the response text"""
+    sentences = []
+    for outcome in results:
+        if outcome["status"] != "ok":
+            continue
+        result = outcome["result"]
+        if outcome["tool"] == "crowd_prediction":
+            level = str(result["overall_crowd_level"]).replace("_", " ")
+            sentences.append(f"Crowds at {result['location']} are expected to be {level} today.")
+        elif outcome["tool"] == "businesses" and result:
+            names = ", ".join(business["name"] for business in result[:3])
+            sentences.append(f"Nearby options include {names}.")
+        elif outcome["tool"] in ("attraction_recommendations", "trending_destinations") and result:
+            names = ", ".join(item["name"] for item in result[:3])
+            sentences.append(f"You might enjoy {names}.")
+        elif outcome["tool"] == "itineraries" and result:
+            titles = ", ".join(itinerary["title"] for itinerary in result[:3])
+            sentences.append(f"Your itineraries: {titles}.")
+    return sentences
@@ -0,0 +1,256 @@
+import re
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .gazetteer import get_gazetteer
+from .search_index import analyze
+
+EMBEDDING_DIMENSIONS = 256
+
+# Words that point back at earlier turns; with history, such a query's answer depends on context
+ANAPHORA = frozenset(["it", "its", "there", "that", "this", "they", "them", "those", "these", "he", "she", "his", "her"])
+
+
+def normalize_query(query: str, language: Optional[str] = None) -> List[str]:
+    """Reduce a query to a sorted list of canonical terms
+
+    Entity names become their catalog key (so "eiffel tower" and "Eiffel
+    Tower" are one term), the rest of the text is stemmed with stopwords
+    removed, and word order is ignored.
+    """
+    terms = set()
+    position = 0
+    for (start, end), entities in _group_spans(get_gazetteer().extract(query)).items():
+        terms.update(analyze(query[position:start], language))
+        # A name shared by several catalog entries canonicalizes to one of them consistently
+        terms.add(min(f"{entity['type']}:{entity['id']}" for entity in entities))
+        position = end
+    terms.update(analyze(query[position:], language))
+    return sorted(terms)
+
+
+def _group_spans(matches: List[Dict]) -> "OrderedDict":
+    spans = OrderedDict()
+    for match in matches:
+        spans.setdefault((match["start"], match["end"]), []).append(match)
+    return spans
+
+
+def is_context_free(query: str, conversation_id: Optional[str], location: Optional[Dict]) -> bool:
+    """Whether the answer to a query depends only on its text
+
+    Answers that use the caller's location, or that may refer back to
+    earlier turns of an existing conversation, must not be shared.
+    """
+    if location:
+        return False
+    if conversation_id and ANAPHORA.intersection(re.findall(r"[a-z']+", query.lower())):
+        return False
+    return True
+
+
+def hashed_embedding(terms: List[str]) -> np.ndarray:
+    """Embed normalized terms by feature hashing into a unit vector
+
+    A stand-in for a sentence embedding model: queries sharing most of their
+    terms end up close together.
+    """
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for term in terms:
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSIONS
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _Partition:
+    """Cache entries for one language: an LRU map plus an embedding matrix for neighbour search"""
+
+    def __init__(self, dimensions: int):
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.keys: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.embeddings = np.zeros((0, dimensions), dtype=np.float32)
+
+    def add_embedding(self, key: str, embedding: np.ndarray) -> None:
+        if len(self.keys) == len(self.embeddings):
+            grown = np.zeros((max(16, 2 * len(self.embeddings)), self.embeddings.shape[1]), dtype=np.float32)
+            grown[:len(self.keys)] = self.embeddings
+            self.embeddings = grown
+        self.rows[key] = len(self.keys)
+        self.embeddings[len(self.keys)] = embedding
+        self.keys.append(key)
+
+    def remove(self, key: str) -> None:
+        del self.entries[key]
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        # Move the last row into the hole so the matrix stays dense
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.keys[row] = moved
+            self.embeddings[row] = self.embeddings[last]
+            self.rows[moved] = row
+        self.keys.pop()
+
+    def nearest(self, embedding: np.ndarray):
+        if not self.keys:
+            return None, 0.0
+        similarities = self.embeddings[:len(self.keys)] @ embedding
+        row = int(np.argmax(similarities))
+        return self.keys[row], float(similarities[row])
+
+
+class ResponseCache:
+    """Cache of generated answers keyed by normalized query
+
+    Exact hits are found by hashing the normalized query; near-duplicates by
+    nearest-neighbour search over query embeddings within the same language,
+    accepted above `similarity_threshold`. Entries expire after `ttl_seconds`
+    and each language keeps at most `max_entries`, evicting the least
+    recently used. Concurrent misses for the same query share one generation.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 60 * 60,
+        max_entries: int = 10000,
+        similarity_threshold: float = 0.9,
+        embed: Optional[Callable[[List[str]], np.ndarray]] = hashed_embedding
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self.hits = 0
+        self.misses = 0
+        self._partitions: Dict[str, _Partition] = {}
+        self._in_flight: Dict[str, "asyncio.Future"] = {}
+
+    @staticmethod
+    def key(terms: List[str], language: str) -> str:
+        return hashlib.sha256(f"{language}\0{' '.join(terms)}".encode("utf-8")).hexdigest()
+
+    def _partition(self, language: str) -> _Partition:
+        partition = self._partitions.get(language)
+        if partition is None:
+            partition = self._partitions[language] = _Partition(EMBEDDING_DIMENSIONS)
+        return partition
+
+    def _live_entry(self, partition: _Partition, key: str) -> Optional[Dict]:
+        entry = partition.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["stored_at"] > self.ttl_seconds:
+            partition.remove(key)
+            return None
+        partition.entries.move_to_end(key)
+        return entry
+
+    def lookup(self, query: str, language: str = "en") -> Optional[Dict]:
+        """Return the cached answer for a query or a near-duplicate of it, if any"""
+        terms = normalize_query(query, language)
+        partition = self._partition(language)
+
+        entry = self._live_entry(partition, self.key(terms, language))
+        if entry is None and self.embed is not None and terms:
+            neighbour, similarity = partition.nearest(self.embed(terms))
+            if neighbour is not None and similarity >= self.similarity_threshold:
+                entry = self._live_entry(partition, neighbour)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["answer"]
+
+    def store(self, query: str, answer: Dict, language: str = "en") -> None:
+        """Cache the answer to a query"""
+        terms = normalize_query(query, language)
+        key = self.key(terms, language)
+        partition = self._partition(language)
+
+        if key in partition.entries:
+            partition.remove(key)
+        partition.entries[key] = {"answer": answer, "stored_at": time.monotonic()}
+        if self.embed is not None and terms:
+            partition.add_embedding(key, self.embed(terms))
+
+        # Entries are ordered by use, not by age, so only capacity is enforced here;
+        # expired entries are dropped when a lookup finds them
+        while len(partition.entries) > self.max_entries:
+            partition.remove(next(iter(partition.entries)))
+
+    def begin(self, query: str, language: str = "en") -> "asyncio.Future":
+        """Announce that the answer to a query is being generated
+
+        Identical queries wait for it (see wait_for_pending) instead of
+        generating their own. Complete the returned future with finish(), or
+        cancel it if generation is abandoned.
+        """
+        key = self.key(normalize_query(query, language), language)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        def unregister(_):
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+        future.add_done_callback(unregister)
+        return future
+
+    def finish(self, query: str, future: "asyncio.Future", answer: Dict, language: str = "en") -> None:
+        """Cache the answer begun with begin() and hand it to the queries waiting for it"""
+        self.store(query, answer, language)
+        future.set_result(answer)
+
+    async def wait_for_pending(self, query: str, language: str = "en") -> Optional[Dict]:
+        """The answer an identical query is generating, once it is ready
+
+        If that generation is abandoned, waits for the one that takes over.
+        Returns None once no identical query is being answered; the caller
+        then generates the answer itself.
+        """
+        key = self.key(normalize_query(query, language), language)
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                return None
+            # Unlike awaiting the future, this doesn't make its cancellation ours
+            await asyncio.wait([future])
+            if not future.cancelled():
+                return future.result()
+
+    async def get_or_create(self, query: str, create: Callable[[], Awaitable[Dict]], language: str = "en") -> Dict:
+        """Return the cached answer, or create, cache and return it
+
+        While one caller is creating the answer for a query, identical
+        queries wait for that answer instead of generating their own.
+        """
+        answer = self.lookup(query, language)
+        if answer is None:
+            answer = await self.wait_for_pending(query, language)
+        if answer is not None:
+            return answer
+
+        future = self.begin(query, language)
+        try:
+            answer = await create()
+        except Exception as error:
+            future.set_exception(error)
+            # Nobody else may be waiting; don't let an unretrieved exception warn
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        self.finish(query, future, answer, language)
+        return answer
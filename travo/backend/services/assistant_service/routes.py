@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException, status, BackgroundTasks, File, UploadFile
+import json
+import time
+from fastapi import APIRouter, HTTPException, status, BackgroundTasks, File, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, FileResponse
 from typing import Optional, List
 
 # Import schemas and service logic
 from .schemas import TextQueryRequest, TextQueryResponse, VoiceQueryResponse, ConversationHistory
-from .service_logic import process_text_query, process_voice_query, get_conversation_history
+from .service_logic import (
+    process_text_query, process_text_query_stream, process_voice_query, get_conversation_history,
+    create_voice_session, process_voice_query_stream, get_answer_audio_path, speech_cache, voice_latency
+)
+from .utils import format_sse_event
+from .voice import UnsupportedAudioError
 
 # Create router
 router = APIRouter()
@@ -27,6 +36,28 @@ async def text_query(request: TextQueryRequest):
     
     return response
 
+# Streaming text-based Q&A endpoint (Server-Sent Events)
+@router.post("/query/text/stream")
+async def text_query_stream(request: TextQueryRequest):
+    events = process_text_query_stream(
+        query=request.query,
+        user_id=request.user_id,
+        conversation_id=request.conversation_id,
+        location=request.location,
+        language=request.language
+    )
+    
+    async def event_stream():
+        async for event, data in events:
+            yield format_sse_event(event, data)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Voice-based Q&A endpoint
 @router.post("/query/voice", response_model=VoiceQueryResponse)
 async def voice_query(
@@ -48,23 +79,127 @@ async def voice_query(
     audio_content = await audio.read()
     
     # Process the voice query
-    response = await process_voice_query(
-        audio_content=audio_content,
-        user_id=user_id,
-        conversation_id=conversation_id,
-        language=language,
-        location={"latitude": latitude, "longitude": longitude} if latitude and longitude else None
-    )
+    try:
+        response = await process_voice_query(
+            audio_content=audio_content,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            language=language,
+            location={"latitude": latitude, "longitude": longitude} if latitude and longitude else None
+        )
+    except UnsupportedAudioError as e:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
     return response
 
+# Streaming voice conversation
+@router.websocket("/query/voice/stream")
+async def voice_query_stream(
+    websocket: WebSocket,
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    language: str = "en",
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    sample_rate: int = 16000
+):
+    """Binary messages carry 16-bit mono PCM at `sample_rate`. The server
+    detects the end of each utterance (or the client sends {"type": "end"}),
+    then answers with JSON messages ({"type": "partial_transcript"},
+    "transcript", the text query stream events, "audio_start", "audio_end"
+    and "done") and the spoken answer as binary PCM messages in between.
+    Text messages that are not JSON objects are answered with {"type": "error"}.
+    One connection can carry any number of utterances of a conversation.
+    """
+    await websocket.accept()
+    session = create_voice_session(sample_rate, language)
+    location = {"latitude": latitude, "longitude": longitude} if latitude and longitude else None
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                ended = session.feed(message["bytes"])
+            else:
+                try:
+                    control = json.loads(message.get("text") or "{}")
+                except ValueError:
+                    control = None
+                if not isinstance(control, dict):
+                    await websocket.send_json({"type": "error", "detail": "Text messages must be JSON objects"})
+                    continue
+                ended = control.get("type") == "end" and session.end()
+            
+            partial = session.partial_transcript()
+            if partial:
+                await websocket.send_json({"type": "partial_transcript", "text": partial})
+            if not ended:
+                continue
+            
+            ended_at = time.perf_counter()
+            transcript = await session.transcript()
+            await websocket.send_json({
+                "type": "transcript",
+                "text": transcript,
+                "latency_ms": round((time.perf_counter() - ended_at) * 1000, 1)
+            })
+            if not transcript:
+                continue
+            
+            events = process_voice_query_stream(transcript, ended_at, user_id, conversation_id, location, language)
+            async for event, data in events:
+                if event == "audio":
+                    await websocket.send_bytes(data)
+                else:
+                    await websocket.send_json(jsonable_encoder({"type": event, **data}))
+                if event == "done":
+                    # Later utterances continue the same conversation
+                    conversation_id = data["conversation_id"]
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.close()
+
+# Spoken answers referenced by audio_url
+@router.get("/audio/{digest}")
+async def get_answer_audio(digest: str):
+    path = get_answer_audio_path(digest)
+    
+    if not path:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Audio not found"
+        )
+    
+    # Audio is stored under a hash of its text, so it never changes
+    return FileResponse(path, media_type="audio/wav", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+# Voice pipeline latency and speech cache effectiveness
+@router.get("/voice/stats")
+async def get_voice_stats():
+    return {
+        "first_audio_latency": voice_latency.summary(),
+        "speech_cache": {"hits": speech_cache.hits, "misses": speech_cache.misses}
+    }
+
 # Get conversation history
 @router.get("/conversation/{conversation_id}", response_model=ConversationHistory)
 async def get_conversation(
     conversation_id: str,
-    limit: Optional[int] = 10
+    limit: Optional[int] = 10,
+    before: Optional[int] = None
 ):
-    history = await get_conversation_history(conversation_id, limit)
+    history = await get_conversation_history(conversation_id, limit, before)
     
     if not history:
         raise HTTPException(
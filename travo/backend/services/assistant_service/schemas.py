@@ -21,10 +21,12 @@ class TextQueryRequest(BaseModel):
     query: str
     user_id: Optional[str] = None
     conversation_id: Optional[str] = None
-    language: Optional[str] = "en"
+    language: Optional[str] = None  # Detected from the query when not given
     location: Optional[LocationInfo] = None
 
 class Message(BaseModel):
+    message_id: Optional[str] = None
+    sequence: Optional[int] = None  # Position in the conversation, usable as the "before" cursor
     role: MessageRole
     content: str
     message_type: MessageType
@@ -36,6 +38,8 @@ class TextQueryResponse(BaseModel):
     message_id: str
     sources: List[Dict[str, Any]] = Field(default=[])
     related_attractions: List[Dict[str, Any]] = Field(default=[])
+    tool_results: List[Dict[str, Any]] = Field(default=[])  # Live data from other services used in the answer
+    language: Optional[str] = None  # Language the query was answered in
     timestamp: datetime
 
 class VoiceQueryResponse(BaseModel):
@@ -0,0 +1,321 @@
+import re
+import math
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .catalogs import load_catalog_records
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a about an and are as at be by can do for from how i in is it me my of on or our
+should tell that the their there this to was we what when where which who why
+will with you your
+""".split())
+
+# Function words of other market languages, dropped from queries in those languages
+LANGUAGE_STOPWORDS = {
+    "fr": "a au aux avec ce ces dans de des du elle en est et il je la le les leur mais me mon ne nous on ou où par pas pour qu que qui sa se ses son sur ta te un une vous y",
+    "es": "a al con de del el en es esta este la las lo los me mi no o para por que se su sus un una y",
+    "it": "a al alla che ci con da dei del della di e gli i il in la le lo mi nel per si su un una",
+    "de": "am an auf das dem den der des die ein eine einen es für im in ist mit nach und von wie wo zu zum zur",
+    "pt": "a ao as com da das de do dos e em é na no nos o os para por que se um uma",
+    "nl": "aan de een en het in is ik je met naar of op te van voor wat waar",
+    "id": "ada apa dan dari di ini itu ke saya untuk yang",
+    "tr": "bir bu da de için ile mi mı ne ve"
+}
+# Share of deleted documents at which the postings are rebuilt without them
+COMPACTION_RATIO = 0.25
+
+
+def stem(word: str) -> str:
+    """Light suffix-stripping stemmer
+
+    Folds plurals and common verb endings ("temples", "temple" -> "templ",
+    "viewing" -> "view", "cities" -> "city"). It only has to map related
+    words to the same key consistently for documents and queries.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+
+    if word.endswith("e") and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+# Folded like the text they are matched against
+QUERY_STOPWORDS = {
+    language: STOPWORDS | frozenset(fold(words).split()) for language, words in LANGUAGE_STOPWORDS.items()
+}
+
+
+def analyze(text: str, language: Optional[str] = None) -> List[str]:
+    """Split text into stemmed, lowercased, accent-free terms without stopwords
+
+    Args:
+        language: Language of the text, whose function words are dropped as well as English ones
+    """
+    stopwords = QUERY_STOPWORDS.get(language, STOPWORDS)
+    return [stem(token) for token in TOKEN_PATTERN.findall(fold(text)) if token not in stopwords]
+
+
+class BM25Index:
+    """In-memory inverted index with BM25 ranking
+
+    Postings are compact arrays of (document number, term frequency) in
+    increasing document order; new documents are appended, deleted ones are
+    tombstoned until enough have accumulated to rebuild the postings.
+
+    Top-k search is term-at-a-time with MaxScore pruning: query terms are
+    processed from the highest to the lowest score upper bound, and once the
+    terms left cannot lift an unseen document into the top k, the remaining
+    (typically long, common) posting lists are only probed for the documents
+    that can still make it, instead of being scanned.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._df: Dict[str, int] = {}
+        # Per-term bounds for the score upper bound; they may go stale (too high) after deletes
+        self._max_tf: Dict[str, float] = {}
+        self._min_length: Dict[str, float] = {}
+
+        self._doc_ids: List[str] = []
+        self._doc_terms: List[Optional[Counter]] = []
+        self._doc_lengths = array("f")
+        self._doc_types = array("B")
+        self._alive = bytearray()
+        self._numbers: Dict[str, int] = {}
+        self._type_codes: Dict[Optional[str], int] = {}
+
+        self._total_length = 0.0
+        self._deleted = 0
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._numbers
+
+    def add_document(self, doc_id: str, text: str, doc_type: Optional[str] = None, document: Optional[Dict] = None) -> None:
+        """Index a document, replacing any previous version with the same ID"""
+        terms = Counter(analyze(text))
+        with self._lock:
+            if doc_id in self._numbers:
+                self._remove(doc_id)
+            self._append(doc_id, terms, doc_type)
+            self.documents[doc_id] = document if document is not None else {"text": text}
+            self._maybe_compact()
+
+    def remove_document(self, doc_id: str) -> bool:
+        """Remove a document; returns False if it was not indexed"""
+        with self._lock:
+            if doc_id not in self._numbers:
+                return False
+            self._remove(doc_id)
+            del self.documents[doc_id]
+            self._maybe_compact()
+            return True
+
+    def _append(self, doc_id: str, terms: Counter, doc_type: Optional[str]) -> None:
+        number = len(self._doc_ids)
+        length = float(sum(terms.values()))
+
+        self._doc_ids.append(doc_id)
+        self._doc_terms.append(terms)
+        self._doc_lengths.append(length)
+        self._doc_types.append(self._type_codes.setdefault(doc_type, len(self._type_codes)))
+        self._alive.append(1)
+        self._numbers[doc_id] = number
+        self._total_length += length
+
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("f"))
+                self._df[term] = 0
+                self._max_tf[term] = 0.0
+                self._min_length[term] = length
+            postings[0].append(number)
+            postings[1].append(tf)
+            self._df[term] += 1
+            self._max_tf[term] = max(self._max_tf[term], float(tf))
+            self._min_length[term] = min(self._min_length[term], length)
+
+    def _remove(self, doc_id: str) -> None:
+        number = self._numbers.pop(doc_id)
+        self._alive[number] = 0
+        self._total_length -= self._doc_lengths[number]
+        for term in self._doc_terms[number]:
+            self._df[term] -= 1
+        self._doc_terms[number] = None
+        self._deleted += 1
+
+    def _maybe_compact(self) -> None:
+        if self._deleted > 64 and self._deleted > COMPACTION_RATIO * len(self._doc_ids):
+            self.compact()
+
+    def compact(self) -> None:
+        """Rebuild the postings without deleted documents"""
+        with self._lock:
+            live = [
+                (doc_id, self._doc_terms[number], type_code)
+                for number, (doc_id, type_code) in enumerate(zip(self._doc_ids, self._doc_types))
+                if self._alive[number]
+            ]
+            type_names = {code: name for name, code in self._type_codes.items()}
+            self._reset()
+            for doc_id, terms, type_code in live:
+                self._append(doc_id, terms, type_names[type_code])
+
+    def _idf(self, term: str) -> float:
+        df = self._df[term]
+        return math.log(1.0 + (len(self._numbers) - df + 0.5) / (df + 0.5))
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        types: Optional[Iterable[str]] = None,
+        language: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """Return the k best (doc_id, score) pairs for a query, best first
+
+        Args:
+            types: Only return documents of these types
+            language: Language of the query
+        """
+        with self._lock:
+            terms = [term for term in dict.fromkeys(analyze(query, language)) if self._df.get(term)]
+            if not terms or not self._numbers or k <= 0:
+                return []
+
+            k1, b = self.k1, self.b
+            avg_length = self._total_length / len(self._numbers)
+            lengths = np.frombuffer(self._doc_lengths, dtype=np.float32)
+            allowed = np.frombuffer(self._alive, dtype=np.bool_)
+            if types is not None:
+                codes = [self._type_codes[t] for t in types if t in self._type_codes]
+                allowed = allowed & np.isin(np.frombuffer(self._doc_types, dtype=np.uint8), codes)
+
+            # Highest possible contribution of each term to any document's score
+            idf = {term: self._idf(term) for term in terms}
+            bound = {
+                term: idf[term] * self._max_tf[term] * (k1 + 1)
+                / (self._max_tf[term] + k1 * (1 - b + b * self._min_length[term] / avg_length))
+                for term in terms
+            }
+            terms.sort(key=bound.get, reverse=True)
+            remaining = sum(bound.values())
+
+            scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+            touched = np.zeros(len(self._doc_ids), dtype=np.bool_)
+            candidates: Optional[np.ndarray] = None
+            threshold = 0.0
+
+            for term in terms:
+                docs = np.frombuffer(self._postings[term][0], dtype=np.int32)
+                tfs = np.frombuffer(self._postings[term][1], dtype=np.float32)
+                remaining -= bound[term]
+
+                if candidates is not None:
+                    # Probe this posting list only for documents that can still reach the top k
+                    positions = np.searchsorted(docs, candidates)
+                    positions[positions == len(docs)] = 0
+                    found = docs[positions] == candidates
+                    docs, tfs = candidates[found], tfs[positions[found]]
+
+                scores[docs] += idf[term] * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths[docs] / avg_length))
+
+                if candidates is None:
+                    touched[docs] = True
+                    pool = np.flatnonzero(touched & allowed)
+                    threshold = self._kth_score(scores, pool, k)
+                    if remaining < threshold:
+                        # No document outside the pool can reach the top k any more
+                        candidates = pool
+                else:
+                    threshold = self._kth_score(scores, candidates, k)
+
+                if candidates is not None:
+                    candidates = candidates[scores[candidates] + remaining >= threshold]
+
+            if candidates is None:
+                candidates = pool
+
+            best = candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+            return [(self._doc_ids[number], float(scores[number])) for number in best]
+
+    @staticmethod
+    def _kth_score(scores: np.ndarray, docs: np.ndarray, k: int) -> float:
+        if len(docs) < k:
+            return 0.0
+        return float(np.partition(scores[docs], len(docs) - k)[len(docs) - k])
+
+
+def index_catalog_record(index: BM25Index, record: Dict) -> None:
+    """Add or replace one catalog record in the index"""
+    # The name is repeated so it outweighs a passing mention in a description
+    text = " ".join(filter(None, [
+        record["name"], record["name"], record["description"],
+        record["city"], record["country"], " ".join(record["tags"])
+    ]))
+    index.add_document(f"{record['type']}:{record['id']}", text, record["type"], record)
+
+
+_search_index: Optional[BM25Index] = None
+_build_lock = threading.Lock()
+
+
+def get_search_index() -> BM25Index:
+    """The catalog search index, built on first use
+
+    Catalog changes can be applied incrementally with index_catalog_record()
+    and BM25Index.remove_document().
+    """
+    search_index = _search_index
+    if search_index is None:
+        with _build_lock:
+            if _search_index is None:
+                rebuild_search_index()
+        search_index = _search_index
+    return search_index
+
+
+def rebuild_search_index(records: Optional[Iterable[Dict]] = None) -> BM25Index:
+    """Build a fresh index from the catalogs and swap it in"""
+    global _search_index
+    search_index = BM25Index()
+    for record in load_catalog_records() if records is None else records:
+        index_catalog_record(search_index, record)
+    _search_index = search_index
+    return search_index
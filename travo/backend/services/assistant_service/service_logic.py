@@ -1,7 +1,22 @@
-import uuid
-import random
+import os
+import asyncio
+import re
+import time
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+
+from config import settings
+from .conversation_store import ConversationStore, SQLConversationArchive
+from .search_index import get_search_index
+from .response_cache import ResponseCache, is_context_free
+from .orchestrator import plan_tool_calls, run_tool_calls, summarize_tool_results
+from .llm_client import LLMClient, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from .context_window import ContextWindow, extractive_summary
+from .language_id import LANGUAGE_NAMES
+from .utils import detect_language, generate_conversation_id, generate_message_id
+from .voice import (
+    SpeechWorkers, SpeechCache, SentenceBuffer, UtteranceDetector, VoiceSession, LatencyStats, read_wav
+)
 
 # Mock data for attractions to use as sources
 ATTRACTIONS = [
@@ -35,15 +50,88 @@ ATTRACTIONS = [
     }
 ]
 
-# Mock conversation data
-CONVERSATIONS = {}
+# Conversation history: a bounded hot set in memory, older history in the Conversation/Message tables
+conversation_store = ConversationStore(
+    SQLConversationArchive(settings.DATABASE_URL or "sqlite:///./travo.db"),
+    max_messages=int(os.getenv("ASSISTANT_MAX_HOT_MESSAGES", "50")),
+    ttl_seconds=float(os.getenv("ASSISTANT_CONVERSATION_TTL_SECONDS", str(30 * 60))),
+    max_bytes=int(os.getenv("ASSISTANT_MEMORY_CAP_BYTES", str(64 * 1024 * 1024)))
+)
+
+# Longest time an answer waits for crowd, business, recommendation and itinerary lookups
+TOOL_DEADLINE_SECONDS = float(os.getenv("ASSISTANT_TOOL_DEADLINE_SECONDS", "1.5"))
+
+# Language model backend (any OpenAI-compatible endpoint); mock responses are used when unset
+LLM_URL = os.getenv("ASSISTANT_LLM_URL")
+llm_client = LLMClient(
+    LLM_URL,
+    model=os.getenv("ASSISTANT_LLM_MODEL", "travo-assistant"),
+    api_key=os.getenv("ASSISTANT_LLM_API_KEY"),
+    tokens_per_minute=int(os.getenv("ASSISTANT_LLM_TOKENS_PER_MINUTE", "90000"))
+) if LLM_URL else None
+
+SYSTEM_PROMPT = (
+    "You are TRAVO, a travel assistant. Answer concisely using the provided sources "
+    "when they are relevant, and say so when you don't know."
+)
+
+async def summarize_turns(summary: str, messages: List[Dict], max_tokens: int) -> str:
+    """Fold older turns into the running conversation summary"""
+    if llm_client is None:
+        return await extractive_summary(summary, messages, max_tokens)
+    
+    turns = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+    prompt = [
+        {"role": "system", "content": (
+            "Update the summary of a travel conversation with the new turns. Keep places, dates, "
+            f"preferences and decisions; drop small talk. Reply with the summary only, under {max_tokens * 3 // 4} words."
+        )},
+        {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{turns}"}
+    ]
+    # Background work: yields to interactive requests when tokens are scarce
+    completion = await llm_client.complete(prompt, max_tokens=max_tokens, temperature=0.2, priority=PRIORITY_BATCH)
+    return completion["text"]
+
+# Prompt context: a token budget of recent turns plus a rolling summary of older ones
+context_window = ContextWindow(
+    budget_tokens=int(os.getenv("ASSISTANT_CONTEXT_TOKENS", "1500")),
+    summary_tokens=int(os.getenv("ASSISTANT_SUMMARY_TOKENS", "300")),
+    summarize=summarize_turns
+)
+
+# Messages loaded to rebuild the window of a conversation restored from the archive
+CONTEXT_RESTORE_MESSAGES = 20
+
+# Speech-to-text and text-to-speech backends ("module:function"), run in a process pool
+speech_workers = SpeechWorkers(
+    stt_backend=os.getenv("ASSISTANT_STT_BACKEND", "services.assistant_service.voice:placeholder_transcribe"),
+    tts_backend=os.getenv("ASSISTANT_TTS_BACKEND", "services.assistant_service.voice:placeholder_synthesize"),
+    max_workers=int(os.getenv("ASSISTANT_SPEECH_WORKERS", "2"))
+)
+
+# Synthesized sentences and answers, so popular answers are never synthesized twice
+speech_cache = SpeechCache(os.path.join(settings.UPLOAD_FOLDER, "speech"), voice=speech_workers.tts_backend)
+AUDIO_BASE_URL = os.getenv("ASSISTANT_AUDIO_BASE_URL", "https://api.travo.com/api/assistant/audio")
+
+# Bytes of PCM per streamed audio message
+AUDIO_CHUNK_BYTES = 8192
+
+# Time from the end of an utterance to the first byte of the spoken answer
+voice_latency = LatencyStats()
+
+# Answers to context-free queries, shared across users
+response_cache = ResponseCache(
+    ttl_seconds=float(os.getenv("ASSISTANT_CACHE_TTL_SECONDS", str(60 * 60))),
+    max_entries=int(os.getenv("ASSISTANT_CACHE_MAX_ENTRIES", "10000")),
+    similarity_threshold=float(os.getenv("ASSISTANT_CACHE_SIMILARITY", "0.9"))
+)
 
 async def process_text_query(
     query: str,
     user_id: Optional[str] = None,
     conversation_id: Optional[str] = None,
     location: Optional[Dict] = None,
-    language: str = "en"
+    language: Optional[str] = None
 ) -> Dict:
     """Process a text query and generate a response
     
@@ -51,50 +139,40 @@ async def process_text_query(
     1. Use an NLP model to understand the query
     2. Retrieve relevant information from a knowledge base
     3. Generate a natural language response
-    """
-    # Generate a new conversation ID if not provided
-    if not conversation_id:
-        conversation_id = str(uuid.uuid4())
     
-    # Generate a message ID
-    message_id = str(uuid.uuid4())
+    The language is detected from the query when not given.
+    """
+    language = resolve_language(query, language, conversation_id)
     
-    # Store the user message in the conversation history
-    if conversation_id not in CONVERSATIONS:
-        CONVERSATIONS[conversation_id] = {
-            "user_id": user_id,
-            "messages": [],
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
+    # Live data from other services the query needs
+    tool_calls = plan_tool_calls(query, user_id, location)
     
-    # Add user message to history
-    CONVERSATIONS[conversation_id]["messages"].append({
-        "role": "user",
-        "content": query,
-        "message_type": "text",
-        "timestamp": datetime.utcnow()
-    })
+    # Answers that don't depend on the conversation, location or live data can be shared
+    cacheable = not tool_calls and is_context_free(query, conversation_id, location)
     
-    # Update conversation timestamp
-    CONVERSATIONS[conversation_id]["updated_at"] = datetime.utcnow()
+    # Start the conversation and record the user's message
+    conversation_id = await start_exchange(conversation_id, user_id, query, language)
     
-    # Generate a mock response based on the query
-    response_text = generate_mock_response(query, location)
+    # Generate a message ID
+    message_id = generate_message_id()
+    
+    # Generate the response, related attractions and sources (or reuse a cached answer)
+    tool_results = []
+    if cacheable:
+        answer = await response_cache.get_or_create(query, lambda: build_answer(query, location, language=language), language)
+    elif tool_calls:
+        answer, tool_results = await asyncio.gather(
+            build_answer(query, location, conversation_context(conversation_id), language),
+            run_tool_calls(tool_calls, TOOL_DEADLINE_SECONDS)
+        )
+    else:
+        answer = await build_answer(query, location, conversation_context(conversation_id), language)
+    response_text = " ".join([answer["response_text"]] + summarize_tool_results(tool_results))
+    related_attractions = answer["related_attractions"]
+    sources = answer["sources"]
     
     # Add assistant message to history
-    CONVERSATIONS[conversation_id]["messages"].append({
-        "role": "assistant",
-        "content": response_text,
-        "message_type": "text",
-        "timestamp": datetime.utcnow()
-    })
-    
-    # Get related attractions based on the query
-    related_attractions = get_related_attractions(query)
-    
-    # Generate mock sources
-    sources = generate_mock_sources(query)
+    await record_reply(conversation_id, response_text, message_id)
     
     return {
         "response_text": response_text,
@@ -102,9 +180,223 @@ async def process_text_query(
         "message_id": message_id,
         "sources": sources,
         "related_attractions": related_attractions,
+        "tool_results": tool_results,
+        "language": language,
+        "timestamp": datetime.utcnow()
+    }
+
+def resolve_language(query: str, language: Optional[str], conversation_id: Optional[str]) -> str:
+    """The caller's language if given, else the query's, falling back to the conversation's for queries too short to tell"""
+    if language:
+        return language
+    conversation = conversation_store.get(conversation_id) if conversation_id else None
+    return detect_language(query, default=conversation["language"] if conversation else "en")
+
+async def build_answer(
+    query: str,
+    location: Optional[Dict] = None,
+    context: Optional[List[Dict]] = None,
+    language: str = "en"
+) -> Dict:
+    """Look up related attractions and sources, and generate the response grounded in them"""
+    related_attractions = get_related_attractions(query, language=language)
+    sources = get_sources(query, language=language)
+    return {
+        "response_text": await generate_response(query, location, sources, context, language),
+        "related_attractions": related_attractions,
+        "sources": sources
+    }
+
+async def generate_response(
+    query: str,
+    location: Optional[Dict] = None,
+    sources: Optional[List[Dict]] = None,
+    context: Optional[List[Dict]] = None,
+    language: str = "en"
+) -> str:
+    """Generate the response text with the language model, or the mock generator if none is configured
+    
+    Args:
+        context: Conversation summary and recent turns, ending with the query; without it the
+            query is answered on its own
+    """
+    if llm_client is None:
+        return generate_mock_response(query, location)
+    
+    completion = await llm_client.complete(response_prompt(query, sources, context, language), priority=PRIORITY_INTERACTIVE)
+    return completion["text"]
+
+def response_prompt(
+    query: str,
+    sources: Optional[List[Dict]] = None,
+    context: Optional[List[Dict]] = None,
+    language: str = "en"
+) -> List[Dict]:
+    """Chat messages asking for the response: instructions, grounding sources, then the conversation"""
+    grounding = "\n".join(f"- {source['title']}: {source['snippet']}" for source in sources or [])
+    messages = [{"role": "system", "content": f"{SYSTEM_PROMPT} Reply in {LANGUAGE_NAMES.get(language, 'English')}."}]
+    if grounding:
+        messages.append({"role": "system", "content": f"Sources:\n{grounding}"})
+    messages.extend(context or [{"role": "user", "content": query}])
+    return messages
+
+async def process_text_query_stream(
+    query: str,
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    location: Optional[Dict] = None,
+    language: Optional[str] = None
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """Process a text query, yielding (event, data) pairs as parts of the answer become available
+    
+    Events, in order:
+    - "start": conversation and message IDs, sent before any work is done
+    - "sources": the sources the response is grounded in, before any text
+    - "chunk": the next piece of response text
+    - "related_attractions" and "tool_results": as soon as each lookup resolves,
+      followed by "chunk" sentences summarizing the tool results
+    - "done": the complete response; the conversation is persisted just before it
+    
+    A cached answer is replayed with its "sources" and "related_attractions"
+    ahead of the text. Concurrent identical cacheable queries share one
+    generation, streaming or not: the others wait for it and replay it.
+    """
+    language = resolve_language(query, language, conversation_id)
+    tool_calls = plan_tool_calls(query, user_id, location)
+    cacheable = not tool_calls and is_context_free(query, conversation_id, location)
+    conversation_id = await start_exchange(conversation_id, user_id, query, language)
+    message_id = generate_message_id()
+    
+    yield "start", {"conversation_id": conversation_id, "message_id": message_id, "language": language}
+    
+    answer = None
+    if cacheable:
+        answer = response_cache.lookup(query, language) or await response_cache.wait_for_pending(query, language)
+    if answer is not None:
+        # Replay the cached answer in the same shape as a generated one
+        for name in ("sources", "related_attractions"):
+            yield name, {name: answer[name]}
+        for chunk in split_sentences(answer["response_text"]):
+            yield "chunk", {"text": chunk}
+        answer = {**answer, "tool_results": []}
+    else:
+        answer = {}
+        generation = response_cache.begin(query, language) if cacheable else None
+        # Resolve the supporting data concurrently with text generation
+        sources_lookup = asyncio.create_task(asyncio.to_thread(get_sources, query, 3, language))
+        lookups = {
+            asyncio.create_task(asyncio.to_thread(get_related_attractions, query, 3, language)): "related_attractions",
+            sources_lookup: "sources",
+            asyncio.create_task(run_tool_calls(tool_calls, TOOL_DEADLINE_SECONDS)): "tool_results"
+        }
+        
+        try:
+            # The response is grounded in the sources, so generation waits for them
+            answer["sources"] = await sources_lookup
+            yield "sources", {"sources": answer["sources"]}
+            
+            chunks = []
+            context = None if cacheable else conversation_context(conversation_id)
+            async for chunk in generate_response_chunks(query, location, answer["sources"], context, language):
+                chunks.append(chunk)
+                yield "chunk", {"text": chunk}
+            
+            pending = set(lookups) - {sources_lookup}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = lookups[task]
+                    answer[name] = task.result()
+                    yield name, {name: answer[name]}
+            
+            # Live data is summarized after the generated text
+            for sentence in summarize_tool_results(answer["tool_results"]):
+                chunks.append(" " + sentence)
+                yield "chunk", {"text": " " + sentence}
+            answer["response_text"] = "".join(chunks)
+        finally:
+            # Stop background lookups if the client went away mid-stream
+            for task in lookups:
+                task.cancel()
+            # Queries waiting on an answer that won't come generate their own
+            if generation is not None and "response_text" not in answer:
+                generation.cancel()
+        
+        if generation is not None:
+            response_cache.finish(query, generation, {k: v for k, v in answer.items() if k != "tool_results"}, language)
+    
+    await record_reply(conversation_id, answer["response_text"], message_id)
+    
+    yield "done", {
+        "response_text": answer["response_text"],
+        "conversation_id": conversation_id,
+        "message_id": message_id,
+        "sources": answer["sources"],
+        "related_attractions": answer["related_attractions"],
+        "tool_results": answer["tool_results"],
+        "language": language,
         "timestamp": datetime.utcnow()
     }
 
+async def generate_response_chunks(
+    query: str,
+    location: Optional[Dict] = None,
+    sources: Optional[List[Dict]] = None,
+    context: Optional[List[Dict]] = None,
+    language: str = "en"
+) -> AsyncIterator[str]:
+    """Generate the response text piece by piece
+    
+    Text from the language model is yielded as it is generated. The mock
+    generator's response is split into sentences, yielding control between them.
+    """
+    if llm_client is not None:
+        async for delta in llm_client.stream(response_prompt(query, sources, context, language), priority=PRIORITY_INTERACTIVE):
+            yield delta
+        return
+    
+    for sentence in split_sentences(generate_mock_response(query, location)):
+        yield sentence
+        await asyncio.sleep(0)
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, keeping their trailing punctuation and spacing"""
+    return re.findall(r'[^.!?]+[.!?]*\s*', text)
+
+async def start_exchange(
+    conversation_id: Optional[str],
+    user_id: Optional[str],
+    query: str,
+    language: str = "en"
+) -> str:
+    """Open (or create) the conversation and record the user's message
+    
+    Returns the conversation ID (a new one if none was provided).
+    """
+    # Generate a new conversation ID if not provided
+    if not conversation_id:
+        conversation_id = generate_conversation_id()
+    
+    # Store the user message in the conversation history
+    conversation = await conversation_store.open(conversation_id, user_id=user_id, language=language)
+    if not context_window.has_state(conversation) and conversation["next_sequence"] > 0:
+        # Restored from the archive: rebuild the window from its latest messages
+        recent = await conversation_store.history(conversation_id, limit=CONTEXT_RESTORE_MESSAGES)
+        context_window.restore(conversation, recent["messages"])
+    message = await conversation_store.append(conversation_id, "user", query)
+    context_window.add(conversation, message)
+    return conversation_id
+
+async def record_reply(conversation_id: str, response_text: str, message_id: str) -> None:
+    """Add the assistant's reply to the conversation history and its context window"""
+    message = await conversation_store.append(conversation_id, "assistant", response_text, message_id=message_id)
+    context_window.add(await conversation_store.open(conversation_id), message)
+
+def conversation_context(conversation_id: str) -> List[Dict]:
+    """Prompt context for the next reply: the conversation summary and recent turns"""
+    conversation = conversation_store.get(conversation_id)
+    return context_window.build(conversation) if conversation else []
+
 async def process_voice_query(
     audio_content: bytes,
     user_id: Optional[str] = None,
@@ -112,16 +404,13 @@ async def process_voice_query(
     language: str = "en",
     location: Optional[Dict] = None
 ) -> Dict:
-    """Process a voice query and generate a response
+    """Transcribe a recorded question, answer it and synthesize the spoken answer
     
-    In a real implementation, this would:
-    1. Use a speech-to-text model to transcribe the audio
-    2. Process the transcribed text using NLP
-    3. Generate a text response
-    4. Convert the text response to speech
+    Raises:
+        UnsupportedAudioError: If the audio is not PCM WAV
     """
-    # Mock transcription (in a real system, this would use a speech-to-text model)
-    transcription = "Tell me about the Eiffel Tower"
+    pcm, sample_rate = read_wav(audio_content)
+    transcription = await speech_workers.transcribe(pcm, sample_rate, language)
     
     # Process the transcribed text
     text_response = await process_text_query(
@@ -132,9 +421,10 @@ async def process_voice_query(
         language=language
     )
     
-    # In a real system, we would generate audio from the response text
-    # and store it at a URL. Here we'll just use a mock URL.
-    audio_url = f"https://api.travo.com/audio/{text_response['message_id']}.mp3"
+    # Sentences are synthesized (or found in the cache) in parallel
+    sentences = split_sentences(text_response["response_text"])
+    audio = await asyncio.gather(*(synthesize_speech(s.strip(), language) for s in sentences if s.strip()))
+    audio_url = await store_answer_audio(text_response["response_text"], language, audio)
     
     return {
         **text_response,
@@ -142,26 +432,109 @@ async def process_voice_query(
         "transcription": transcription
     }
 
+def create_voice_session(sample_rate: int = 16000, language: str = "en") -> VoiceSession:
+    """Create the per-connection state for transcribing a live audio stream"""
+    return VoiceSession(
+        lambda pcm: speech_workers.transcribe(pcm, sample_rate, language),
+        UtteranceDetector(sample_rate)
+    )
+
+async def process_voice_query_stream(
+    transcription: str,
+    ended_at: float,
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    location: Optional[Dict] = None,
+    language: str = "en"
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Answer a transcribed utterance, yielding the text events and the spoken answer as it is synthesized
+    
+    Yields the events of process_text_query_stream, plus "audio_start" (the PCM
+    format), "audio" (raw PCM bytes) and "audio_end". Each sentence is sent to
+    the synthesizer as soon as it is complete and its audio is streamed in
+    order. "done" comes last and carries the audio URL of the whole answer.
+    
+    Args:
+        ended_at: time.perf_counter() when the utterance ended, for the latency metrics
+    """
+    sentences = SentenceBuffer()
+    speech: List[asyncio.Task] = []
+    audio: List[Tuple[bytes, int]] = []
+    done = None
+    
+    def audio_events(pcm: bytes, sample_rate: int) -> List[Tuple[str, Any]]:
+        events = []
+        if not audio:
+            latency_ms = (time.perf_counter() - ended_at) * 1000
+            voice_latency.record(latency_ms)
+            events.append(("audio_start", {"encoding": "pcm_s16le", "sample_rate": sample_rate, "latency_ms": round(latency_ms, 1)}))
+        audio.append((pcm, sample_rate))
+        events.extend(("audio", pcm[i:i + AUDIO_CHUNK_BYTES]) for i in range(0, len(pcm), AUDIO_CHUNK_BYTES))
+        return events
+    
+    try:
+        async for event, data in process_text_query_stream(transcription, user_id, conversation_id, location, language):
+            if event == "done":
+                done = data
+                continue
+            yield event, data
+            
+            if event == "chunk":
+                for sentence in sentences.push(data["text"]):
+                    speech.append(asyncio.create_task(synthesize_speech(sentence, language)))
+            # Pass on whatever audio is ready without getting ahead of an earlier sentence
+            while len(audio) < len(speech) and speech[len(audio)].done():
+                for item in audio_events(*speech[len(audio)].result()):
+                    yield item
+        
+        tail = sentences.flush()
+        if tail:
+            speech.append(asyncio.create_task(synthesize_speech(tail, language)))
+        while len(audio) < len(speech):
+            for item in audio_events(*await speech[len(audio)]):
+                yield item
+    finally:
+        for task in speech:
+            task.cancel()
+    
+    if audio:
+        yield "audio_end", {}
+    yield "done", {
+        **done,
+        "transcription": transcription,
+        "audio_url": await store_answer_audio(done["response_text"], language, audio)
+    }
+
+async def synthesize_speech(text: str, language: str = "en") -> Tuple[bytes, int]:
+    """PCM and sample rate of a spoken sentence, from the cache if it was synthesized before"""
+    return await speech_cache.get_or_synthesize(text, language, lambda: speech_workers.synthesize(text, language))
+
+async def store_answer_audio(text: str, language: str, audio: List[Tuple[bytes, int]]) -> Optional[str]:
+    """Store the spoken answer (its sentences' audio joined) and return its URL"""
+    if not audio:
+        return None
+    digest = await speech_cache.store(text, language, b"".join(pcm for pcm, _ in audio), audio[0][1])
+    return f"{AUDIO_BASE_URL}/{digest}"
+
+def get_answer_audio_path(digest: str) -> Optional[str]:
+    """Path of a stored spoken answer, or None"""
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return None
+    path = speech_cache.path(digest)
+    return path if os.path.exists(path) else None
+
 async def get_conversation_history(
     conversation_id: str,
-    limit: int = 10
+    limit: int = 10,
+    before: Optional[int] = None
 ) -> Optional[Dict]:
-    """Get the conversation history for a specific conversation"""
-    if conversation_id not in CONVERSATIONS:
-        return None
-    
-    conversation = CONVERSATIONS[conversation_id]
+    """Get the conversation history for a specific conversation
     
-    # Limit the number of messages returned
-    messages = conversation["messages"][-limit:] if limit > 0 else conversation["messages"]
-    
-    return {
-        "conversation_id": conversation_id,
-        "user_id": conversation["user_id"],
-        "messages": messages,
-        "created_at": conversation["created_at"],
-        "updated_at": conversation["updated_at"]
-    }
+    Args:
+        limit: Number of messages to return (all if <= 0)
+        before: Only return messages whose sequence number is lower, to page back through long conversations
+    """
+    return await conversation_store.history(conversation_id, limit=limit, before=before)
 
 def generate_mock_response(query: str, location: Optional[Dict] = None) -> str:
     """Generate a mock response based on the query"""
@@ -186,69 +559,46 @@ def generate_mock_response(query: str, location: Optional[Dict] = None) -> str:
     else:
         return "I'm your TRAVO assistant, here to help with information about travel destinations, attractions, and local tips. How can I assist you with your travel plans today?"
 
-def get_related_attractions(query: str) -> List[Dict]:
-    """Get related attractions based on the query"""
-    query_lower = query.lower()
-    
-    # Simple keyword matching for demo purposes
-    if "paris" in query_lower or "france" in query_lower or "eiffel" in query_lower:
-        return [a for a in ATTRACTIONS if a["country"] == "France"]
-    
-    elif "rome" in query_lower or "italy" in query_lower or "colosseum" in query_lower:
-        return [a for a in ATTRACTIONS if a["country"] == "Italy"]
-    
-    elif "barcelona" in query_lower or "spain" in query_lower or "sagrada" in query_lower:
-        return [a for a in ATTRACTIONS if a["country"] == "Spain"]
-    
-    else:
-        # Return a random selection of attractions
-        return random.sample(ATTRACTIONS, min(2, len(ATTRACTIONS)))
+def get_related_attractions(query: str, limit: int = 3, language: Optional[str] = None) -> List[Dict]:
+    """Get attractions and monuments related to the query, best match first"""
+    attractions = []
+    for record in search_catalog(query, limit, types=("attraction", "monument"), language=language):
+        attractions.append({
+            "id": record["id"],
+            "name": record["name"],
+            "city": record["city"],
+            "country": record["country"],
+            "description": record["description"]
+        })
+    return attractions
 
-def generate_mock_sources(query: str) -> List[Dict]:
-    """Generate mock sources for the response"""
-    query_lower = query.lower()
-    
+def get_sources(query: str, limit: int = 3, language: Optional[str] = None) -> List[Dict]:
+    """Get the catalog entries that ground the response, best match first"""
     sources = []
-    
-    # Add Wikipedia as a source
-    if "eiffel" in query_lower or "tower" in query_lower:
+    for record in search_catalog(query, limit, language=language):
         sources.append({
-            "source_type": "website",
-            "title": "Eiffel Tower - Wikipedia",
-            "url": "https://en.wikipedia.org/wiki/Eiffel_Tower",
-            "snippet": "The Eiffel Tower is a wrought-iron lattice tower on the Champ de Mars in Paris, France."
+            "source_type": record["type"],
+            "source_id": record["id"],
+            "title": record["name"],
+            "url": record["url"] or f"https://travo.com/{record['type']}s/{record['id']}",
+            "snippet": record["description"] or record["name"]
         })
-    
-    elif "louvre" in query_lower or "museum" in query_lower:
-        sources.append({
-            "source_type": "website",
-            "title": "Louvre Museum - Wikipedia",
-            "url": "https://en.wikipedia.org/wiki/Louvre",
-            "snippet": "The Louvre, or the Louvre Museum, is the world's most-visited museum and a historic monument in Paris, France."
-        })
-    
-    elif "colosseum" in query_lower or "rome" in query_lower:
-        sources.append({
-            "source_type": "website",
-            "title": "Colosseum - Wikipedia",
-            "url": "https://en.wikipedia.org/wiki/Colosseum",
-            "snippet": "The Colosseum is an oval amphitheatre in the centre of the city of Rome, Italy."
-        })
-    
-    elif "sagrada" in query_lower or "familia" in query_lower or "barcelona" in query_lower:
-        sources.append({
-            "source_type": "website",
-            "title": "Sagrada Família - Wikipedia",
-            "url": "https://en.wikipedia.org/wiki/Sagrada_Fam%C3%ADlia",
-            "snippet": "The Basílica i Temple Expiatori de la Sagrada Família is a church in Barcelona, Spain, designed by Catalan architect Antoni Gaudí."
-        })
-    
-    # Add a travel guide as a source
-    sources.append({
-        "source_type": "article",
-        "title": "TRAVO Travel Guide",
-        "url": "https://travo.com/guides/europe",
-        "snippet": "Comprehensive travel guide to the most popular destinations in Europe."
-    })
-    
     return sources
+
+def search_catalog(
+    query: str,
+    limit: int,
+    types: Optional[Tuple[str, ...]] = None,
+    language: Optional[str] = None
+) -> List[Dict]:
+    """Search the catalog index, returning one record per name"""
+    search_index = get_search_index()
+    records = {}
+    # Catalogs overlap (the same landmark can be an attraction and a monument), so over-fetch
+    for doc_id, _ in search_index.search(query, limit * 2, types=types, language=language):
+        record = search_index.documents[doc_id]
+        name = record["name"].lower()
+        # Keep the best-ranked record for a name, unless only a later one has a description
+        if name not in records or (not records[name]["description"] and record["description"]):
+            records[name] = record
+    return list(records.values())[:limit]
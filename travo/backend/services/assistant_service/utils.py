@@ -1,60 +1,55 @@
-import uuid
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
 import json
 import re
 
+from utils.ids import generate_id
+
+from .gazetteer import get_gazetteer
+from .language_id import best_language
+
 def generate_conversation_id() -> str:
     """Generate a unique conversation ID"""
-    return str(uuid.uuid4())
+    return generate_id()
 
 def generate_message_id() -> str:
     """Generate a unique message ID"""
-    return str(uuid.uuid4())
+    return generate_id()
 
-def extract_entities(text: str) -> List[str]:
+def extract_entities(text: str) -> List[Dict]:
     """Extract named entities from text
     
-    In a real implementation, this would use an NLP model for named entity recognition.
-    Here we use a simple regex-based approach for demonstration.
-    """
-    # Simple pattern matching for common travel entities
-    patterns = {
-        "cities": ["Paris", "Rome", "Barcelona", "London", "New York", "Tokyo", "Sydney"],
-        "landmarks": ["Eiffel Tower", "Louvre", "Colosseum", "Sagrada Familia", "Big Ben", "Statue of Liberty"]
-    }
-    
-    found_entities = []
-    
-    # Check for each entity in the text
-    for category, entities in patterns.items():
-        for entity in entities:
-            if re.search(r'\b' + re.escape(entity) + r'\b', text, re.IGNORECASE):
-                found_entities.append(entity)
+    Looks up every destination, attraction, monument, business, city and country
+    name from the catalogs in a single pass over the text.
     
-    return found_entities
+    Returns:
+        Non-overlapping matches with "start", "end", "text", "name", "type" and "id"
+    """
+    return get_gazetteer().extract(text)
 
-def detect_language(text: str) -> str:
+def detect_language(text: str, default: str = "en") -> str:
     """Detect the language of the text
     
-    In a real implementation, this would use a language detection model.
-    Here we default to English for demonstration.
+    Scripts such as Greek, Arabic or kana give the language away; Latin-script
+    languages are scored with character n-gram profiles. Text too short or
+    ambiguous to call, such as a bare place name, gets `default`.
+    
+    Returns:
+        ISO 639-1 code, e.g. "en", "fr", "ja"
     """
-    # Default to English
-    return "en"
+    return best_language(text, default)
 
 def format_conversation_history(messages: List[Dict]) -> str:
-    """Format conversation history for context in AI prompts"""
-    formatted_history = ""
-    
-    for msg in messages:
-        role = msg.get("role", "")
-        content = msg.get("content", "")
-        
-        if role and content:
-            formatted_history += f"{role.capitalize()}: {content}\n\n"
+    """Format conversation history for context in AI prompts
     
-    return formatted_history
+    Pass the output of ContextWindow.build() rather than a whole conversation
+    to keep the prompt bounded.
+    """
+    return "".join(
+        f"{msg['role'].capitalize()}: {msg['content']}\n\n"
+        for msg in messages
+        if msg.get("role") and msg.get("content")
+    )
 
 def calculate_response_metrics(query: str, response: str) -> Dict:
     """Calculate metrics about the query and response"""
@@ -77,3 +72,7 @@ def sanitize_user_input(text: str) -> str:
         text = text[:max_length]
     
     return text.strip()
+
+def format_sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
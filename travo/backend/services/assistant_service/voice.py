@@ -0,0 +1,414 @@
+import io
+import os
+import re
+import wave
+import asyncio
+import hashlib
+import importlib
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Streamed audio is 16-bit little-endian mono PCM
+SAMPLE_WIDTH = 2
+DEFAULT_SAMPLE_RATE = 16000
+
+PLACEHOLDER_TRANSCRIPT = "Tell me about the Eiffel Tower"
+
+SENTENCE_END = re.compile(r"[.!?]+(\s+|$)")
+
+
+# Speech backends run in worker processes. A backend is named "module:function" so
+# it can be imported there; transcribers take (pcm, sample_rate, language) and
+# return text, synthesizers take (text, language) and return (pcm, sample_rate).
+
+def placeholder_transcribe(pcm: bytes, sample_rate: int, language: str) -> str:
+    """Stand-in transcriber that hears the same question in any audio"""
+    return PLACEHOLDER_TRANSCRIPT if pcm else ""
+
+
+def whisper_transcribe(pcm: bytes, sample_rate: int, language: str) -> str:
+    """Transcribe with faster-whisper (optional dependency; model from ASSISTANT_WHISPER_MODEL)"""
+    from faster_whisper import WhisperModel
+
+    model = _loaded.get("whisper")
+    if model is None:
+        model = _loaded["whisper"] = WhisperModel(os.getenv("ASSISTANT_WHISPER_MODEL", "base"), compute_type="int8")
+    audio = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+    if sample_rate != 16000:
+        # Whisper expects 16 kHz; linear resampling is enough for speech
+        positions = np.arange(0, len(audio), sample_rate / 16000.0)
+        audio = np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+    segments, _ = model.transcribe(audio, language=language, beam_size=1)
+    return " ".join(segment.text.strip() for segment in segments)
+
+
+def placeholder_synthesize(text: str, language: str) -> Tuple[bytes, int]:
+    """Stand-in synthesizer: a quiet tone lasting as long as the text would take to say"""
+    seconds = min(10.0, 0.25 * max(1, len(text.split())))
+    t = np.arange(int(seconds * DEFAULT_SAMPLE_RATE)) / DEFAULT_SAMPLE_RATE
+    tone = 0.1 * np.sin(2 * np.pi * 220.0 * t)
+    return (tone * 32767).astype("<i2").tobytes(), DEFAULT_SAMPLE_RATE
+
+
+# Backends (and whatever models they load) cached per worker process
+_loaded: Dict[str, object] = {}
+
+
+def _run_backend(path: str, *args):
+    backend = _loaded.get(path)
+    if backend is None:
+        module_name, function_name = path.split(":")
+        backend = _loaded[path] = getattr(importlib.import_module(module_name), function_name)
+    return backend(*args)
+
+
+class SpeechWorkers:
+    """Process pool running the speech-to-text and text-to-speech backends
+
+    Both are CPU-bound, so they run outside the event loop's process. The
+    pool is started on first use.
+    """
+
+    def __init__(self, stt_backend: str, tts_backend: str, max_workers: int = 2):
+        self.stt_backend = stt_backend
+        self.tts_backend = tts_backend
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    async def transcribe(self, pcm: bytes, sample_rate: int, language: str = "en") -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), _run_backend, self.stt_backend, pcm, sample_rate, language)
+
+    async def synthesize(self, text: str, language: str = "en") -> Tuple[bytes, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), _run_backend, self.tts_backend, text, language)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def wav_bytes(pcm: bytes, sample_rate: int) -> bytes:
+    """Wrap 16-bit mono PCM in a WAV container"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class UnsupportedAudioError(ValueError):
+    """Uploaded audio is in a format the speech pipeline cannot decode"""
+
+
+def read_wav(content: bytes) -> Tuple[bytes, int]:
+    """16-bit mono PCM and sample rate of a PCM WAV file
+
+    8-, 16-, 24- and 32-bit samples are converted to 16-bit, and multiple
+    channels are mixed down to mono.
+
+    Raises:
+        UnsupportedAudioError: If the content is not PCM WAV
+    """
+    try:
+        with wave.open(io.BytesIO(content), "rb") as wav:
+            width, channels = wav.getsampwidth(), wav.getnchannels()
+            frames, sample_rate = wav.readframes(wav.getnframes()), wav.getframerate()
+    except (wave.Error, EOFError):
+        raise UnsupportedAudioError("Audio must be PCM WAV")
+    if width == SAMPLE_WIDTH and channels == 1:
+        return frames, sample_rate
+    if width not in (1, 2, 3, 4):
+        raise UnsupportedAudioError(f"Unsupported WAV sample width: {width * 8} bits")
+
+    if width == 1:
+        # 8-bit WAV is unsigned
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int32) - 128) << 8
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 16)
+    else:
+        samples = np.frombuffer(frames, dtype=f"<i{width}").astype(np.int32) >> (8 * width - 16)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return np.clip(np.round(samples), -32768, 32767).astype("<i2").tobytes(), sample_rate
+
+
+class UtteranceDetector:
+    """Energy-based end-of-utterance detection over a stream of PCM chunks
+
+    Audio is analysed in `frame_ms` frames; a frame is speech when its RMS
+    energy is well above both a fixed floor and the running noise level.
+    A pause of `pause_ms` inside an utterance closes a segment, so
+    transcription can start while the user keeps talking, and `silence_ms`
+    of silence ends the utterance. Leading silence is dropped.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = DEFAULT_SAMPLE_RATE,
+        frame_ms: int = 20,
+        pause_ms: int = 240,
+        silence_ms: int = 700,
+        min_speech_ms: int = 100,
+        energy_floor: float = 300.0,
+        noise_ratio: float = 3.0
+    ):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.pause_frames = max(1, pause_ms // frame_ms)
+        self.silence_frames = max(self.pause_frames + 1, silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.energy_floor = energy_floor
+        self.noise_ratio = noise_ratio
+        self.noise_level = 0.0
+
+        self._buffer = bytearray()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._segment = bytearray()
+        self._segment_speech = 0
+        self._utterance_speech = 0
+        self._silent = 0
+
+    @property
+    def in_utterance(self) -> bool:
+        return self._utterance_speech > 0
+
+    def feed(self, pcm: bytes) -> List[Tuple[str, bytes]]:
+        """Consume a chunk of audio
+
+        Returns:
+            ("segment", audio) for each pause inside an utterance and ("end", audio)
+            when an utterance ends; the audio is what was heard since the previous event
+        """
+        self._buffer += pcm
+        count = len(self._buffer) // self.frame_bytes
+        if not count:
+            return []
+
+        # Copy, since a view would keep the buffer from being resized below
+        samples = np.frombuffer(bytes(self._buffer[:count * self.frame_bytes]), dtype="<i2")
+        energy = np.sqrt(np.mean(samples.reshape(count, -1).astype(np.float32) ** 2, axis=1))
+
+        events = []
+        for index in range(count):
+            frame = self._buffer[index * self.frame_bytes:(index + 1) * self.frame_bytes]
+            if energy[index] > max(self.energy_floor, self.noise_ratio * self.noise_level):
+                self._segment += frame
+                self._segment_speech += 1
+                self._utterance_speech += 1
+                self._silent = 0
+                continue
+
+            # Track background noise on non-speech frames only
+            self.noise_level = 0.95 * self.noise_level + 0.05 * float(energy[index])
+            if not self.in_utterance:
+                continue
+            self._segment += frame
+            self._silent += 1
+            if self._silent == self.pause_frames and self._segment_speech >= self.min_speech_frames:
+                events.append(("segment", bytes(self._segment)))
+                self._segment = bytearray()
+                self._segment_speech = 0
+            elif self._silent >= self.silence_frames:
+                events.append(self._end())
+
+        del self._buffer[:count * self.frame_bytes]
+        return [event for event in events if event is not None]
+
+    def end(self) -> Optional[Tuple[str, bytes]]:
+        """Force the end of the current utterance (e.g. the user released push-to-talk)"""
+        self._buffer.clear()
+        return self._end() if self.in_utterance else None
+
+    def _end(self) -> Optional[Tuple[str, bytes]]:
+        # Too little speech in the whole utterance is a noise blip, not a question
+        heard = self._utterance_speech >= self.min_speech_frames
+        audio = bytes(self._segment) if self._segment_speech else b""
+        self._reset()
+        return ("end", audio) if heard else None
+
+
+class VoiceSession:
+    """Incremental transcription of the utterances on one audio stream
+
+    Segments are sent to the transcriber as soon as the detector closes them,
+    so by the end of an utterance usually only its last segment is still
+    being transcribed.
+    """
+
+    def __init__(self, transcribe: Callable[[bytes], Awaitable[str]], detector: UtteranceDetector):
+        self.transcribe = transcribe
+        self.detector = detector
+        self._segments: List[asyncio.Task] = []
+        self._reported = 0
+
+    def _add(self, audio: bytes) -> None:
+        if audio:
+            self._segments.append(asyncio.create_task(self.transcribe(audio)))
+
+    def feed(self, pcm: bytes) -> bool:
+        """Consume audio; returns True when an utterance has ended"""
+        ended = False
+        for kind, audio in self.detector.feed(pcm):
+            self._add(audio)
+            ended = ended or kind == "end"
+        return ended
+
+    def end(self) -> bool:
+        """Force the end of the current utterance; returns True if there was one"""
+        event = self.detector.end()
+        if event is not None:
+            self._add(event[1])
+        return event is not None
+
+    def partial_transcript(self) -> Optional[str]:
+        """Transcript of the segments finished so far, if it grew since the last call"""
+        done = 0
+        while done < len(self._segments) and self._segments[done].done():
+            done += 1
+        if done == self._reported or any(task.cancelled() or task.exception() for task in self._segments[:done]):
+            return None
+        self._reported = done
+        return " ".join(filter(None, (task.result() for task in self._segments[:done])))
+
+    async def transcript(self) -> str:
+        """Wait for the ended utterance's transcript and start a new utterance"""
+        segments, self._segments, self._reported = self._segments, [], 0
+        texts = await asyncio.gather(*segments)
+        return " ".join(text.strip() for text in texts if text.strip())
+
+    def close(self) -> None:
+        for task in self._segments:
+            task.cancel()
+
+
+class SentenceBuffer:
+    """Collect streamed text and release it one complete sentence at a time"""
+
+    def __init__(self):
+        self._text = ""
+
+    def push(self, text: str) -> List[str]:
+        self._text += text
+        sentences = []
+        position = 0
+        for match in SENTENCE_END.finditer(self._text):
+            if match.end() == len(self._text) and not match.group(1):
+                # "3." may be followed by more digits; wait for the next chunk
+                break
+            sentences.append(self._text[position:match.end()].strip())
+            position = match.end()
+        self._text = self._text[position:]
+        return [sentence for sentence in sentences if sentence]
+
+    def flush(self) -> Optional[str]:
+        text, self._text = self._text.strip(), ""
+        return text or None
+
+
+class SpeechCache:
+    """Synthesized speech stored on disk under a hash of the voice, language and text
+
+    Files are written to a temporary name and renamed into place, like the
+    image store, and concurrent requests for the same text share one synthesis.
+    """
+
+    def __init__(self, root: str, voice: str):
+        self.root = root
+        self.voice = voice
+        self.hits = 0
+        self.misses = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def digest(self, text: str, language: str) -> str:
+        return hashlib.sha256(f"{self.voice}\0{language}\0{text}".encode("utf-8")).hexdigest()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + ".wav")
+
+    def _read(self, digest: str) -> Optional[Tuple[bytes, int]]:
+        try:
+            with open(self.path(digest), "rb") as f:
+                return read_wav(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _write(self, digest: str, pcm: bytes, sample_rate: int) -> None:
+        path = self.path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(wav_bytes(pcm, sample_rate))
+        os.replace(temp_path, path)
+
+    async def store(self, text: str, language: str, pcm: bytes, sample_rate: int) -> str:
+        """Store audio for a text (unless it is already stored) and return its digest"""
+        digest = self.digest(text, language)
+        await asyncio.to_thread(self._write, digest, pcm, sample_rate)
+        return digest
+
+    async def get_or_synthesize(
+        self,
+        text: str,
+        language: str,
+        synthesize: Callable[[], Awaitable[Tuple[bytes, int]]]
+    ) -> Tuple[bytes, int]:
+        """Cached audio for a text, synthesizing and storing it on a miss"""
+        digest = self.digest(text, language)
+        cached = await asyncio.to_thread(self._read, digest)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        in_flight = self._in_flight.get(digest)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[digest] = future
+        try:
+            pcm, sample_rate = await synthesize()
+            await asyncio.to_thread(self._write, digest, pcm, sample_rate)
+            future.set_result((pcm, sample_rate))
+            return pcm, sample_rate
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[digest]
+
+
+class LatencyStats:
+    """Percentiles over the most recent latency samples"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+
+    def record(self, milliseconds: float) -> None:
+        self.samples.append(milliseconds)
+
+    def summary(self) -> Dict:
+        if not self.samples:
+            return {"count": 0, "p50_ms": None, "p95_ms": None}
+        p50, p95 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 95])
+        return {"count": len(self.samples), "p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1)}
@@ -1,4 +1,3 @@
-import uuid
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import random
@@ -6,6 +5,7 @@ import math
 
 # Import schemas
 from .schemas import BusinessListingResponse, BusinessDetailResponse, ReviewResponse, ReviewCreate, BusinessCategory, PriceLevel, Location, BusinessHours
+from .utils import generate_review_id
 
 # Mock data for businesses
 MOCK_BUSINESSES = [
@@ -298,7 +298,7 @@ async def get_reviews(business_id: str, limit: int = 10, offset: int = 0) -> Lis
 
 async def create_review(business_id: str, review_data: ReviewCreate) -> ReviewResponse:
     # Generate a new review ID
-    review_id = f"r{len(MOCK_REVIEWS) + 1}"
+    review_id = generate_review_id()
     
     # Get a random user name for the mock data
     user_names = ["Alex Johnson", "Sarah Williams", "David Brown", "Lisa Davis", "Robert Wilson"]
@@ -1,18 +1,19 @@
-import uuid
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 import math
 import re
 
+from utils.ids import generate_id
+
 # Generate a unique business ID
 def generate_business_id() -> str:
     """Generate a unique business ID."""
-    return f"bus_{uuid.uuid4().hex[:8]}"
+    return generate_id("bus_")
 
 # Generate a unique review ID
 def generate_review_id() -> str:
     """Generate a unique review ID."""
-    return f"rev_{uuid.uuid4().hex[:8]}"
+    return generate_id("rev_")
 
 # Format business hours for display
 def format_business_hours(hours: Dict[str, str]) -> str:
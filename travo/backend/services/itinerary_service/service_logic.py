@@ -27,6 +27,7 @@ from .utils import (
     generate_activity_id,
     generate_share_id,
     calculate_itinerary_stats,
+    activity_costs_in,
     generate_share_url
 )
 
@@ -509,9 +510,7 @@ async def add_activity_to_itinerary(itinerary_id: str, activity: ItineraryActivi
     # Update itinerary stats
     itinerary["total_activities"] += 1
     if activity.cost:
-        if activity.currency == itinerary["currency"]:
-            itinerary["total_cost"] += activity.cost
-        # In a real implementation, we would convert currencies
+        itinerary["total_cost"] += activity_costs_in([new_activity], itinerary["currency"])[0]
     
     itinerary["updated_at"] = now
     MOCK_ITINERARIES[itinerary_index] = itinerary
@@ -568,19 +567,13 @@ async def update_activity(itinerary_id: str, activity_id: str, activity_update:
     MOCK_ACTIVITIES[activity_index] = activity
     
     # Update itinerary stats if cost changed
-    if "cost" in update_data:
+    if "cost" in update_data or "currency" in update_data:
         # Find the itinerary
         for i, itin in enumerate(MOCK_ITINERARIES):
             if itin["id"] == itinerary_id:
                 # Recalculate total cost
-                total_cost = 0.0
-                for act in MOCK_ACTIVITIES:
-                    if act["itinerary_id"] == itinerary_id and act["cost"]:
-                        if act["currency"] == itin["currency"]:
-                            total_cost += act["cost"]
-                        # In a real implementation, we would convert currencies
-                
-                itin["total_cost"] = total_cost
+                itinerary_activities = [act for act in MOCK_ACTIVITIES if act["itinerary_id"] == itinerary_id]
+                itin["total_cost"] = sum(activity_costs_in(itinerary_activities, itin["currency"]))
                 itin["updated_at"] = datetime.utcnow()
                 MOCK_ITINERARIES[i] = itin
                 break
@@ -620,8 +613,10 @@ async def delete_activity(itinerary_id: str, activity_id: str) -> bool:
             for j, itin in enumerate(MOCK_ITINERARIES):
                 if itin["id"] == itinerary_id:
                     itin["total_activities"] -= 1
-                    if activity["cost"] and activity["currency"] == itin["currency"]:
-                        itin["total_cost"] -= activity["cost"]
+                    if activity["cost"]:
+                        # Recomputed rather than subtracted: rates may have moved since the activity was added
+                        remaining = [act for act in MOCK_ACTIVITIES if act["itinerary_id"] == itinerary_id]
+                        itin["total_cost"] = sum(activity_costs_in(remaining, itin["currency"]))
                     
                     itin["updated_at"] = datetime.utcnow()
                     MOCK_ITINERARIES[j] = itin
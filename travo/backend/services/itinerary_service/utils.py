@@ -1,29 +1,61 @@
-import uuid
 import random
 from datetime import datetime, time
 from typing import List, Dict, Any, Optional
 import re
 from urllib.parse import quote
+import secrets
+
+from utils.ids import generate_id
+from utils.fx import convert_many, is_known_currency, round_amount
 
 # Constants
 SHARE_BASE_URL = "https://travo.app/share/"
 
 def generate_itinerary_id() -> str:
     """Generate a unique ID for an itinerary."""
-    return f"itin_{uuid.uuid4().hex[:8]}"
+    return generate_id("itin_")
 
 def generate_activity_id() -> str:
     """Generate a unique ID for an activity."""
-    return f"act_{uuid.uuid4().hex[:8]}"
+    return generate_id("act_")
 
 def generate_share_id() -> str:
     """Generate a unique ID for a share link."""
-    return f"share_{uuid.uuid4().hex[:8]}"
+    # Anyone holding a share link can open it, so its id must not be guessable from a neighbour's
+    return f"share_{secrets.token_urlsafe(12)}"
 
 def generate_share_url(share_id: str) -> str:
     """Generate a shareable URL for an itinerary."""
     return f"{SHARE_BASE_URL}{share_id}"
 
+def activity_costs_in(activities: List[Dict[str, Any]], currency: str) -> List[float]:
+    """The cost of each activity in `currency`, 0.0 for activities without a cost.
+    
+    Activities without a currency are taken to be in `currency`; costs in
+    currencies we have no exchange rate for are left out (0.0).
+    """
+    if not is_known_currency(currency):
+        return [
+            activity["cost"] if activity.get("cost") and (activity.get("currency") or currency) == currency else 0.0
+            for activity in activities
+        ]
+    
+    amounts = []
+    currencies = []
+    for activity in activities:
+        cost = activity.get("cost")
+        activity_currency = activity.get("currency") or currency
+        if cost and is_known_currency(activity_currency):
+            amounts.append(cost)
+            currencies.append(activity_currency)
+        else:
+            amounts.append(0.0)
+            currencies.append(currency)
+    
+    if not amounts:
+        return []
+    return convert_many(amounts, currencies, currency).tolist()
+
 def calculate_itinerary_stats(activities: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Calculate statistics for an itinerary based on its activities."""
     if not activities:
@@ -56,23 +88,22 @@ def calculate_itinerary_stats(activities: List[Dict[str, Any]]) -> Dict[str, Any
     if currency_counts:
         stats["currency"] = max(currency_counts.items(), key=lambda x: x[1])[0]
     
+    # Costs in other currencies are converted to the itinerary's currency in one pass
+    costs = activity_costs_in(activities, stats["currency"])
+    
     # Calculate stats
-    for activity in activities:
+    for activity, cost in zip(activities, costs):
         # Count activity types
         activity_type = activity.get("activity_type", "other")
         stats["activity_types"][activity_type] = stats["activity_types"].get(activity_type, 0) + 1
         
-        # Sum costs (assuming same currency for simplicity)
-        if "cost" in activity and activity["cost"]:
-            if activity.get("currency") == stats["currency"]:
-                stats["total_cost"] += activity["cost"]
-            # In a real implementation, we would convert currencies
-        
-        # Track daily costs
-        day_index = activity.get("day_index", 0)
-        if "cost" in activity and activity["cost"]:
-            if activity.get("currency") == stats["currency"]:
-                stats["daily_costs"][day_index] = stats["daily_costs"].get(day_index, 0.0) + activity["cost"]
+        # Sum costs and track daily costs
+        if cost:
+            stats["total_cost"] += cost
+            day_index = activity.get("day_index", 0)
+            stats["daily_costs"][day_index] = stats["daily_costs"].get(day_index, 0.0) + cost
+    
+    stats["total_cost"] = round_amount(stats["total_cost"], stats["currency"])
     
     # Calculate average cost per day
     if stats["daily_costs"]:
@@ -0,0 +1,4 @@
+# Media Service Package
+from .routes import router
+
+__all__ = ["router"]
@@ -0,0 +1,63 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException, Header, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+from typing import Optional
+
+from utils.image_store import ImageTooLargeError
+
+# Import schemas and service logic
+from .schemas import StoredImageResponse, ImageVariant
+from .service_logic import store_image, get_image_file
+
+# Create router
+router = APIRouter()
+
+# Test route
+@router.get("/test")
+async def test_media_service():
+    return {"status": "ok", "service": "media_service"}
+
+# Upload an image
+@router.post("/images", response_model=StoredImageResponse, status_code=status.HTTP_201_CREATED)
+async def upload_image(image: UploadFile = File(...)):
+    # Validate file type
+    if not image.content_type or not image.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be an image"
+        )
+    
+    try:
+        return await run_in_threadpool(store_image, image.file)
+    except ImageTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+
+# Serve a stored image or its thumbnail
+@router.get("/images/{digest}")
+async def get_image(
+    digest: str,
+    variant: ImageVariant = ImageVariant.ORIGINAL,
+    if_none_match: Optional[str] = Header(None)
+):
+    image_file = get_image_file(digest, variant)
+    
+    if not image_file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+    
+    path, media_type, cache_control, served_variant = image_file
+    # Tagged with what was actually sent: a thumbnail request answered with the
+    # original carries the original's ETag, so revalidating later fetches the thumbnail
+    etag = f'"{digest}-{served_variant.value}"'
+    headers = {"Cache-Control": cache_control, "ETag": etag}
+    
+    # The content behind an ETag never changes, so a matching ETag needs no body
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return FileResponse(path, media_type=media_type, headers=headers)
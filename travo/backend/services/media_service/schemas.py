@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from enum import Enum
+
+class ImageVariant(str, Enum):
+    ORIGINAL = "original"
+    THUMBNAIL = "thumbnail"
+
+class StoredImageResponse(BaseModel):
+    digest: str
+    size: int
+    media_type: str
+    url: str
+    thumbnail_url: str
+    deduplicated: bool
@@ -0,0 +1,42 @@
+import os
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from utils.image_store import image_store, image_url, sniff_media_type
+
+from .schemas import ImageVariant
+from .utils import is_valid_digest, IMMUTABLE_CACHE_CONTROL, SHORT_CACHE_CONTROL
+
+def store_image(fileobj: BinaryIO) -> Dict:
+    """Store an uploaded image, deduplicating identical content
+    
+    Runs blocking file I/O, so call it from a worker thread.
+    """
+    stored = image_store.save_fileobj(fileobj)
+    
+    return {
+        **stored,
+        "url": image_url(stored["digest"]),
+        "thumbnail_url": image_url(stored["digest"], ImageVariant.THUMBNAIL.value)
+    }
+
+def get_image_file(digest: str, variant: ImageVariant = ImageVariant.ORIGINAL) -> Optional[Tuple[str, str, str, ImageVariant]]:
+    """Locate a stored image
+    
+    Returns:
+        (path, media_type, cache_control, served_variant) or None if the
+        image does not exist. A thumbnail that has not been generated yet
+        falls back to the original with a short cache lifetime, and
+        served_variant is then ORIGINAL.
+    """
+    if not is_valid_digest(digest) or not image_store.exists(digest):
+        return None
+    
+    if variant == ImageVariant.THUMBNAIL:
+        thumbnail_path = image_store.thumbnail_path(digest)
+        if os.path.exists(thumbnail_path):
+            return thumbnail_path, "image/jpeg", IMMUTABLE_CACHE_CONTROL, ImageVariant.THUMBNAIL
+        
+        image_store.request_thumbnail(digest)
+        return image_store.original_path(digest), image_store.media_type(digest), SHORT_CACHE_CONTROL, ImageVariant.ORIGINAL
+    
+    return image_store.original_path(digest), image_store.media_type(digest), IMMUTABLE_CACHE_CONTROL, ImageVariant.ORIGINAL
@@ -0,0 +1,13 @@
+import re
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Content-addressed files never change, so clients and CDNs may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Used while a thumbnail is still being generated and the original is served instead
+SHORT_CACHE_CONTROL = "public, max-age=60"
+
+def is_valid_digest(digest: str) -> bool:
+    """Check that a string is a lowercase hex SHA-256 digest"""
+    return bool(DIGEST_PATTERN.match(digest))
@@ -0,0 +1,74 @@
+"""Streaming encoders for transaction history exports
+
+Rows arrive in batches and leave as bytes: one batch is encoded (CSV or
+NDJSON) and fed to the compressor before the next batch is read, so an
+export holds one batch in memory however long the history is.
+"""
+import io
+import csv
+import json
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, Iterable, List
+
+from .schemas import ExportFormat, TransactionResponse
+
+EXPORT_FIELDS = list(TransactionResponse.model_fields)
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv; charset=utf-8",
+    ExportFormat.NDJSON: "application/x-ndjson",
+}
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _cell(value: Any) -> Any:
+    value = _plain(value)
+    return "" if value is None else value
+
+
+def _csv_batches(batches: Iterable[List[Dict[str, Any]]]) -> Iterable[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in batches:
+        writer.writerows([[_cell(row.get(field)) for field in EXPORT_FIELDS] for row in batch])
+        yield buffer.getvalue()
+        # Reuse the buffer rather than letting it grow with the export
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _ndjson_batches(batches: Iterable[List[Dict[str, Any]]]) -> Iterable[str]:
+    for batch in batches:
+        yield "".join(
+            json.dumps({field: _plain(row.get(field)) for field in EXPORT_FIELDS}, separators=(",", ":")) + "\n"
+            for row in batch
+        )
+
+
+def encode_batches(batches: Iterable[List[Dict[str, Any]]], export_format: ExportFormat) -> Iterable[str]:
+    """Text of an export, one piece per batch of rows (CSV starts with its header)"""
+    if export_format == ExportFormat.CSV:
+        return _csv_batches(batches)
+    return _ndjson_batches(batches)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Compress a byte stream into one gzip member as it goes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,88 @@
+"""Local stand-in for the card processor
+
+Behaves like a real gateway from the caller's point of view: every call
+takes a while, some charges are declined, some need the customer to
+authenticate (3-D Secure) before they can complete, and now and then the
+gateway is briefly unavailable. Cards ending in the test numbers below
+always take the same path, so a flow can be exercised deterministically.
+"""
+import random
+import asyncio
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from .schemas import PaymentStatus
+
+DECLINE_LAST4 = "0002"
+ACTION_LAST4 = "3155"
+OUTAGE_LAST4 = "0119"
+
+
+class GatewayUnavailableError(Exception):
+    """The gateway could not be reached; the charge did not happen and may be retried"""
+
+
+class GatewayResult(NamedTuple):
+    status: PaymentStatus  # succeeded, failed or requires_action
+    error_message: Optional[str] = None
+    next_action: Optional[Dict[str, Any]] = None
+
+
+class StubGateway:
+    """Gateway simulator with configurable latency and outcome rates
+
+    Args:
+        latency_seconds: (shortest, longest) time a call takes
+        decline_rate: Share of charges declined
+        action_rate: Share of charges that need customer authentication
+        outage_rate: Share of calls that fail with GatewayUnavailableError
+        seed: Seed for reproducible outcomes
+    """
+
+    def __init__(
+        self,
+        latency_seconds: Tuple[float, float] = (0.5, 3.0),
+        decline_rate: float = 0.05,
+        action_rate: float = 0.05,
+        outage_rate: float = 0.02,
+        seed: Optional[int] = None
+    ):
+        self.latency_seconds = latency_seconds
+        self.decline_rate = decline_rate
+        self.action_rate = action_rate
+        self.outage_rate = outage_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    async def _call(self, last4: Optional[str]) -> None:
+        self.calls += 1
+        await asyncio.sleep(self._random.uniform(*self.latency_seconds))
+        if last4 == OUTAGE_LAST4 or self._random.random() < self.outage_rate:
+            raise GatewayUnavailableError("Payment gateway unavailable")
+
+    async def charge(self, intent: Dict[str, Any], payment_method: Dict[str, Any]) -> GatewayResult:
+        """Charge an intent's amount to a payment method"""
+        card = payment_method.get("card_details") or {}
+        last4 = card.get("last4")
+        await self._call(last4)
+
+        if last4 == DECLINE_LAST4 or (last4 != ACTION_LAST4 and self._random.random() < self.decline_rate):
+            return GatewayResult(PaymentStatus.FAILED, error_message="Card declined")
+        if last4 == ACTION_LAST4 or self._random.random() < self.action_rate:
+            return GatewayResult(
+                PaymentStatus.REQUIRES_ACTION,
+                next_action={"type": "authenticate", "reason": "Card issuer requires customer authentication"}
+            )
+        return GatewayResult(PaymentStatus.SUCCEEDED)
+
+    async def confirm(self, intent: Dict[str, Any]) -> GatewayResult:
+        """Complete a charge once the customer has authenticated"""
+        await self._call(None)
+        return GatewayResult(PaymentStatus.SUCCEEDED)
+
+    async def refund(self, intent: Dict[str, Any], amount: float) -> None:
+        """Return part or all of a captured charge to the customer
+
+        Raises:
+            GatewayUnavailableError: If the gateway could not be reached
+        """
+        await self._call(None)
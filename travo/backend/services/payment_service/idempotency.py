@@ -0,0 +1,136 @@
+"""Idempotency keys for payment endpoints
+
+A client that sends an Idempotency-Key header gets the same response for
+every retry of a request: the first one runs, its response is stored for
+a while, and later requests with the same key are answered from the store
+without reaching the processor. Retries that arrive while the first request
+is still running wait for its response instead of running again; if that
+request is cancelled, one of them runs it instead.
+"""
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+
+class IdempotencyKeyReusedError(Exception):
+    """An idempotency key was sent again with a different request"""
+
+
+class StoredResponse(NamedTuple):
+    status_code: int
+    body: Any  # JSON-compatible
+    headers: Dict[str, str]
+
+
+def request_fingerprint(method: str, path: str, query: Iterable[Tuple[str, str]], body: bytes) -> str:
+    """Digest of everything that makes two requests the same request
+
+    JSON bodies are compared by content, so key order and whitespace don't matter.
+    """
+    try:
+        body_text = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")) if body else ""
+    except ValueError:
+        body_text = body.decode("latin-1")
+    canonical = json.dumps([method.upper(), path, sorted(query), body_text], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Responses of completed requests by (user, idempotency key), kept for `ttl_seconds`
+
+    Only responses are stored: a request that raises stores nothing, so its
+    retry runs again. Entries are evicted oldest first once `max_entries` is
+    exceeded.
+    """
+
+    def __init__(self, ttl_seconds: float = 24 * 60 * 60, max_entries: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+        self.replays = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _stored(self, key: Tuple[str, str]) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry["stored_at"] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _store(self, key: Tuple[str, str], fingerprint: str, response: StoredResponse) -> None:
+        self._entries[key] = {"fingerprint": fingerprint, "response": response, "stored_at": time.monotonic()}
+        # Insertion order is expiry order, so evict from the front
+        now = time.monotonic()
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - oldest["stored_at"] <= self.ttl_seconds:
+                break
+            del self._entries[oldest_key]
+
+    async def run(
+        self,
+        user_id: str,
+        idempotency_key: str,
+        fingerprint: str,
+        execute: Callable[[], Awaitable[StoredResponse]]
+    ) -> Tuple[StoredResponse, bool]:
+        """Run a request once per (user, key)
+
+        Args:
+            user_id: Owner of the key; keys of different users never collide
+            idempotency_key: The client's Idempotency-Key
+            fingerprint: request_fingerprint of the request
+            execute: Runs the request
+
+        Returns:
+            The response and whether it was replayed rather than produced by this call
+
+        Raises:
+            IdempotencyKeyReusedError: If the key was used for a different request
+        """
+        key = (user_id, idempotency_key)
+        while True:
+            entry = self._stored(key)
+            if entry is not None:
+                if entry["fingerprint"] != fingerprint:
+                    raise IdempotencyKeyReusedError("Idempotency key was already used for a different request")
+                self.replays += 1
+                return entry["response"], True
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            in_flight_fingerprint, future = in_flight
+            if in_flight_fingerprint != fingerprint:
+                raise IdempotencyKeyReusedError("Idempotency key is in use by a different request")
+            # Unlike awaiting the future, this doesn't make its cancellation ours
+            await asyncio.wait([future])
+            if not future.cancelled():
+                self.replays += 1
+                return future.result(), True
+            # The request we waited for was cancelled before responding;
+            # the first retry to get here runs it instead
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (fingerprint, future)
+        try:
+            response = await execute()
+            self._store(key, fingerprint, response)
+            future.set_result(response)
+            return response, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Nobody else may be waiting; don't let an unretrieved exception warn
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
@@ -0,0 +1,234 @@
+"""Append-only transaction ledger
+
+Transactions are only ever appended. Each user's transactions are indexed
+by (created_at, id), both overall and per transaction type, so a page of
+history is a binary search for the cursor plus a slice, whatever the
+length of the user's history. Per-user stats and balances are updated as
+entries are appended instead of being recomputed from the history.
+"""
+import json
+import base64
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.fx import BASE_CURRENCY, total_in
+
+from .schemas import PaymentStatus, TransactionType
+from .utils import generate_transaction_id
+
+SortKey = Tuple[datetime, str]
+
+
+def encode_cursor(key: SortKey) -> str:
+    """Opaque cursor for the position just after the entry with `key`"""
+    created_at, transaction_id = key
+    raw = json.dumps([created_at.isoformat(), transaction_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> SortKey:
+    """Raises ValueError for a cursor that encode_cursor did not produce"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, transaction_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(transaction_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+class TransactionStats:
+    """Running totals over one user's transactions"""
+
+    def __init__(self):
+        self.total_count = 0
+        self.succeeded = 0
+        self.currency_breakdown: Dict[str, Dict[str, Any]] = {}
+        # Succeeded payments minus succeeded refunds, per currency
+        self.balances: Dict[str, float] = defaultdict(float)
+
+    def add(self, transaction: Dict[str, Any]) -> None:
+        amount = transaction["amount"]
+        currency = transaction["currency"]
+        self.total_count += 1
+        breakdown = self.currency_breakdown.setdefault(currency, {"count": 0, "total_amount": 0})
+        breakdown["count"] += 1
+        breakdown["total_amount"] += amount
+
+        if transaction["status"] == PaymentStatus.SUCCEEDED:
+            self.succeeded += 1
+            if transaction["type"] == TransactionType.PAYMENT:
+                self.balances[currency] += amount
+            elif transaction["type"] == TransactionType.REFUND:
+                self.balances[currency] -= amount
+
+    def as_dict(self, currency: str = BASE_CURRENCY) -> Dict[str, Any]:
+        """Same shape as utils.calculate_transaction_stats, plus balances
+
+        Totals are converted to `currency` at today's rates; the per-currency
+        breakdown and balances stay in their own currencies.
+        """
+        total_amount = total_in(
+            ((code, totals["total_amount"]) for code, totals in self.currency_breakdown.items()), currency
+        )
+        return {
+            "total_count": self.total_count,
+            "total_amount": total_amount,
+            "average_amount": total_amount / self.total_count if self.total_count else 0,
+            "success_rate": self.succeeded / self.total_count * 100 if self.total_count else 0,
+            "currency": currency,
+            "currency_breakdown": {currency: dict(totals) for currency, totals in self.currency_breakdown.items()},
+            "balances": {currency: round(balance, 2) for currency, balance in self.balances.items()}
+        }
+
+
+class TransactionLedger:
+    """In-memory append-only ledger with per-user indexes
+
+    Args:
+        transactions: Existing transactions to load, in any order
+    """
+
+    def __init__(self, transactions: Iterable[Dict[str, Any]] = ()):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._by_user: Dict[str, List[SortKey]] = defaultdict(list)
+        self._by_user_type: Dict[Tuple[str, TransactionType], List[SortKey]] = defaultdict(list)
+        self._stats: Dict[str, TransactionStats] = defaultdict(TransactionStats)
+        for transaction in sorted(transactions, key=lambda tx: tx["created_at"]):
+            self.append(transaction)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._entries.values())
+
+    def get(self, transaction_id: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(transaction_id)
+
+    @staticmethod
+    def _index(keys: List[SortKey], key: SortKey) -> None:
+        # Entries almost always arrive in time order, making this an append
+        if not keys or keys[-1] < key:
+            keys.append(key)
+        else:
+            insort(keys, key)
+
+    @staticmethod
+    def _prepare(transaction: Dict[str, Any]) -> Dict[str, Any]:
+        entry = dict(transaction)
+        entry.setdefault("created_at", datetime.utcnow())
+        if not entry.get("id"):
+            entry["id"] = generate_transaction_id()
+        return entry
+
+    def append(self, transaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Record a transaction, assigning its id and created_at if missing
+
+        Returns:
+            The stored entry
+        """
+        entry = self._prepare(transaction)
+        if entry["id"] in self._entries:
+            raise ValueError(f"Transaction {entry['id']} is already in the ledger")
+
+        key = (entry["created_at"], entry["id"])
+        self._entries[entry["id"]] = entry
+        self._index(self._by_user[entry["user_id"]], key)
+        self._index(self._by_user_type[(entry["user_id"], entry["type"])], key)
+        self._stats[entry["user_id"]].add(entry)
+        return entry
+
+    def extend(self, transactions: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Record many transactions at once
+
+        Each touched index is extended once with all its new keys instead of
+        once per transaction. Nothing is recorded if any id is a duplicate.
+
+        Returns:
+            The stored entries
+        """
+        entries = [self._prepare(transaction) for transaction in transactions]
+        ids = {entry["id"] for entry in entries}
+        if len(ids) != len(entries) or not ids.isdisjoint(self._entries):
+            raise ValueError("Transactions are already in the ledger")
+
+        new_keys: Dict[Any, List[SortKey]] = defaultdict(list)
+        for entry in entries:
+            key = (entry["created_at"], entry["id"])
+            self._entries[entry["id"]] = entry
+            new_keys[("user", entry["user_id"])].append(key)
+            new_keys[("type", entry["user_id"], entry["type"])].append(key)
+            self._stats[entry["user_id"]].add(entry)
+
+        for index_key, keys in new_keys.items():
+            if index_key[0] == "user":
+                index = self._by_user[index_key[1]]
+            else:
+                index = self._by_user_type[index_key[1:]]
+            keys.sort()
+            if index and keys[0] < index[-1]:
+                # Out of order: sort the combined runs, which timsort merges in linear time
+                index.extend(keys)
+                index.sort()
+            else:
+                index.extend(keys)
+        return entries
+
+    def page(
+        self,
+        user_id: str,
+        transaction_type: Optional[TransactionType] = None,
+        limit: int = 10,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """A page of a user's transactions, newest first
+
+        Args:
+            user_id: Whose transactions
+            transaction_type: Only transactions of this type
+            limit: Page size
+            cursor: The next_cursor of the previous page, or None for the first page
+
+        Returns:
+            The transactions and the cursor for the following page (None on the last page)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        if transaction_type is None:
+            keys = self._by_user.get(user_id, [])
+        else:
+            keys = self._by_user_type.get((user_id, transaction_type), [])
+
+        end = bisect_left(keys, decode_cursor(cursor)) if cursor else len(keys)
+        start = max(0, end - limit)
+        page = [self._entries[transaction_id] for _, transaction_id in reversed(keys[start:end])]
+        next_cursor = encode_cursor(keys[start]) if start > 0 and page else None
+        return page, next_cursor
+
+    def scan(
+        self,
+        user_id: str,
+        transaction_type: Optional[TransactionType] = None,
+        batch_size: int = 500
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """A user's whole history in batches, newest first
+
+        Walks the same cursors as page(), so transactions appended while
+        the scan is under way (always newer than its position) are not
+        picked up, and each batch costs a binary search plus a slice.
+        """
+        cursor = None
+        while True:
+            batch, cursor = self.page(user_id, transaction_type, batch_size, cursor)
+            if batch:
+                yield batch
+            if cursor is None:
+                return
+
+    def stats(self, user_id: str, currency: str = BASE_CURRENCY) -> Dict[str, Any]:
+        """Totals in `currency`, success rate, per-currency breakdown and balances of a user's transactions"""
+        stats = self._stats.get(user_id)
+        return (stats or TransactionStats()).as_dict(currency)
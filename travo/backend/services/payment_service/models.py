@@ -28,13 +28,19 @@ class PaymentIntent(Base):
     amount = Column(Float, nullable=False)
     currency = Column(String, nullable=False, default="USD")
     description = Column(Text, nullable=True)
-    metadata = Column(JSON, nullable=True)
-    status = Column(String, nullable=False)  # pending, processing, succeeded, failed, etc.
+    # "metadata" is reserved on declarative models, so the attribute gets another name
+    intent_metadata = Column("metadata", JSON, nullable=True)
+    status = Column(String, nullable=False)  # pending, processing, requires_action, succeeded, failed, etc.
     payment_method_id = Column(String, nullable=True)
     error_message = Column(Text, nullable=True)
+    amount_refunded = Column(Float, nullable=False, default=0)
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Updates are conditional on the version they read, so concurrent writers can't overwrite each other
+    __mapper_args__ = {"version_id_col": version}
+    
     # Relationships
     refunds = relationship("Refund", back_populates="payment_intent")
     transactions = relationship("Transaction", back_populates="payment_intent")
@@ -72,3 +78,18 @@ class Transaction(Base):
     # Relationships
     payment_intent = relationship("PaymentIntent", back_populates="transactions")
     refund = relationship("Refund", back_populates="transactions")
+
+class PaymentJob(Base):
+    __tablename__ = "payment_jobs"
+    
+    id = Column(String, primary_key=True)
+    intent_id = Column(String, nullable=False, index=True)
+    kind = Column(String, nullable=False)  # charge, confirm
+    payment_method_id = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="queued")  # queued, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    leased_until = Column(DateTime, nullable=True)  # Set while a worker holds the job
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
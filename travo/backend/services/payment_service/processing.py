@@ -0,0 +1,360 @@
+"""Asynchronous payment processing
+
+An intent moves through an explicit state machine:
+
+    pending ──> processing ──> succeeded ──> refunded / partially_refunded
+                  ^    │
+                  │    ├──> failed ──────────> processing (retry, e.g. with another method)
+                  │    │
+                  │    └──> requires_action ──> processing (customer authenticated)
+
+Submitting a payment only records the move to processing and a job in a
+durable queue. A pool of background workers claims jobs, calls the gateway
+and records the outcome, so no request waits on the gateway.
+
+Every transition bumps the intent's version. Request handlers that read
+an intent, await and then write it hold the intent's stripe of
+StripedLocks for the whole sequence; a worker, which must not hold a lock
+across a gateway call, instead records its outcome only if the version is
+still the one it started from.
+"""
+import zlib
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, func, or_, select, update
+from sqlalchemy.orm import sessionmaker
+
+from utils.ids import generate_id
+
+from .models import Base, PaymentJob
+from .schemas import PaymentStatus
+
+TRANSITIONS = {
+    PaymentStatus.PENDING: {PaymentStatus.PROCESSING},
+    PaymentStatus.PROCESSING: {PaymentStatus.SUCCEEDED, PaymentStatus.FAILED, PaymentStatus.REQUIRES_ACTION},
+    PaymentStatus.REQUIRES_ACTION: {PaymentStatus.PROCESSING},
+    PaymentStatus.FAILED: {PaymentStatus.PROCESSING},
+    PaymentStatus.SUCCEEDED: {PaymentStatus.REFUNDED, PaymentStatus.PARTIALLY_REFUNDED},
+    PaymentStatus.PARTIALLY_REFUNDED: {PaymentStatus.PARTIALLY_REFUNDED, PaymentStatus.REFUNDED},
+}
+
+JOB_CHARGE = "charge"
+JOB_CONFIRM = "confirm"
+
+
+class InvalidTransitionError(Exception):
+    """An intent was asked to move to a state its current state cannot reach"""
+
+    def __init__(self, current: PaymentStatus, target: PaymentStatus):
+        super().__init__(f"Cannot move a {current.value} payment to {target.value}")
+        self.current = current
+        self.target = target
+
+
+class ConcurrentUpdateError(Exception):
+    """An intent changed since the version an update was based on"""
+
+
+class RetryableJobError(Exception):
+    """A job failed for a transient reason and should run again later"""
+
+
+def check_transition(intent: Dict[str, Any], target: PaymentStatus) -> None:
+    """Raise InvalidTransitionError unless the intent may move to `target`"""
+    if target not in TRANSITIONS.get(intent["status"], ()):
+        raise InvalidTransitionError(intent["status"], target)
+
+
+def transition(
+    intent: Dict[str, Any],
+    target: PaymentStatus,
+    expected_version: Optional[int] = None,
+    **changes
+) -> Dict[str, Any]:
+    """Move an intent to `target`, applying `changes` to its other fields
+
+    Args:
+        intent: The intent, updated in place
+        target: The new status
+        expected_version: Refuse the update unless the intent is still at this version
+
+    Raises:
+        ConcurrentUpdateError: If the intent moved past `expected_version`
+        InvalidTransitionError: If the state machine has no such edge
+    """
+    if expected_version is not None and intent["version"] != expected_version:
+        raise ConcurrentUpdateError(f"Payment {intent['id']} changed since version {expected_version}")
+    check_transition(intent, target)
+    intent.update(changes)
+    intent["status"] = target
+    intent["version"] += 1
+    intent["updated_at"] = datetime.utcnow()
+    return intent
+
+
+def intent_etag(intent_id: str, version: int) -> str:
+    """Validator for an intent's current state; changes with every transition"""
+    return f'"{intent_id}-v{version}"'
+
+
+class StripedLocks:
+    """A fixed pool of asyncio locks shared out among keys by hash
+
+    Memory stays constant however many intents there are. Callers hold a
+    lock only for short read-modify-write sequences, never across a
+    gateway call, so intents that share a stripe barely wait on each
+    other. The pool is rebuilt if the event loop changes.
+
+    Args:
+        stripes: Number of locks
+    """
+
+    def __init__(self, stripes: int = 1024):
+        self.stripes = stripes
+        self._locks: List[asyncio.Lock] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def stripe(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.stripes
+
+    def __call__(self, key: str) -> asyncio.Lock:
+        """The lock guarding `key`"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._locks = [asyncio.Lock() for _ in range(self.stripes)]
+        return self._locks[self.stripe(key)]
+
+
+class PaymentJobQueue:
+    """Durable FIFO of payment jobs in the payment_jobs table
+
+    Claiming a job leases it instead of removing it. A job whose worker dies
+    mid-call is claimed again once the lease runs out, so a restart never
+    loses a submitted payment. The engine is created on first use so
+    importing the service never touches the database.
+    """
+
+    def __init__(self, database_url: str, lease_seconds: float = 60.0):
+        self.database_url = database_url
+        self.lease_seconds = lease_seconds
+        self._session_factory = None
+        self._lock = threading.Lock()
+
+    def _sessions(self):
+        with self._lock:
+            if self._session_factory is None:
+                connect_args = {"check_same_thread": False} if self.database_url.startswith("sqlite") else {}
+                engine = create_engine(self.database_url, connect_args=connect_args)
+                Base.metadata.create_all(engine, tables=[PaymentJob.__table__])
+                self._session_factory = sessionmaker(bind=engine)
+        return self._session_factory()
+
+    def put(self, intent_id: str, kind: str, payment_method_id: Optional[str] = None) -> str:
+        """Add a job and return its id"""
+        job_id = generate_id("job_")
+        now = datetime.utcnow()
+        with self._sessions() as session:
+            session.add(PaymentJob(
+                id=job_id,
+                intent_id=intent_id,
+                kind=kind,
+                payment_method_id=payment_method_id,
+                status="queued",
+                attempts=0,
+                available_at=now,
+                created_at=now,
+                updated_at=now
+            ))
+            session.commit()
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Lease the oldest runnable job, or None if there is none"""
+        with self._sessions() as session:
+            while True:
+                now = datetime.utcnow()
+                job = session.scalars(
+                    select(PaymentJob)
+                    .where(
+                        PaymentJob.status == "queued",
+                        PaymentJob.available_at <= now,
+                        or_(PaymentJob.leased_until.is_(None), PaymentJob.leased_until < now)
+                    )
+                    .order_by(PaymentJob.available_at, PaymentJob.created_at)
+                    .limit(1)
+                ).first()
+                if job is None:
+                    return None
+                claimed_job = {
+                    "id": job.id,
+                    "intent_id": job.intent_id,
+                    "kind": job.kind,
+                    "payment_method_id": job.payment_method_id,
+                    "attempts": job.attempts + 1
+                }
+
+                # Conditional update so two workers (or processes) never hold the same job
+                claimed = session.execute(
+                    update(PaymentJob)
+                    .where(
+                        PaymentJob.id == job.id,
+                        PaymentJob.attempts == job.attempts,
+                        or_(PaymentJob.leased_until.is_(None), PaymentJob.leased_until < now)
+                    )
+                    .values(
+                        attempts=claimed_job["attempts"],
+                        leased_until=now + timedelta(seconds=self.lease_seconds),
+                        updated_at=now
+                    )
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                session.commit()
+                if claimed:
+                    return claimed_job
+
+    def _finish(self, job_id: str, **values) -> None:
+        with self._sessions() as session:
+            session.execute(
+                update(PaymentJob)
+                .where(PaymentJob.id == job_id)
+                .values(leased_until=None, updated_at=datetime.utcnow(), **values)
+            )
+            session.commit()
+
+    def complete(self, job_id: str) -> None:
+        self._finish(job_id, status="done")
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Give up on a job for good"""
+        self._finish(job_id, status="failed", last_error=error)
+
+    def retry(self, job_id: str, delay_seconds: float, error: str) -> None:
+        """Release a job to run again after `delay_seconds`"""
+        self._finish(
+            job_id,
+            available_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+            last_error=error
+        )
+
+    def pending_count(self) -> int:
+        with self._sessions() as session:
+            return session.scalar(
+                select(func.count()).select_from(PaymentJob).where(PaymentJob.status == "queued")
+            )
+
+
+class PaymentWorkerPool:
+    """Background workers that drain a PaymentJobQueue
+
+    Workers start on the running event loop the first time a job is
+    submitted. They sleep until notified of new work, waking up every
+    `poll_interval` seconds anyway to pick up delayed retries, expired
+    leases and jobs left over from a previous run.
+
+    Args:
+        queue: Where jobs are claimed from
+        handler: Runs one job; raises RetryableJobError to have it retried
+        on_exhausted: Called with the job and error once retries run out
+        concurrency: Number of workers
+        max_attempts: Attempts per job before it is given up
+        backoff_base_seconds: Delay before the first retry, doubled on each further one
+        poll_interval: Longest a worker sleeps between queue checks
+    """
+
+    def __init__(
+        self,
+        queue: PaymentJobQueue,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        on_exhausted: Callable[[Dict[str, Any], Exception], Awaitable[None]],
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        backoff_base_seconds: float = 1.0,
+        poll_interval: float = 1.0
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.on_exhausted = on_exhausted
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.poll_interval = poll_interval
+        self.stats = {"completed": 0, "retried": 0, "failed": 0}
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._busy = 0
+
+    def ensure_started(self) -> None:
+        """Start the workers on the running loop unless they are already running there"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and all(not worker.done() for worker in self._workers):
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def notify(self) -> None:
+        """Wake the workers because a job was submitted"""
+        self.ensure_started()
+        self._wakeup.set()
+
+    async def submit(self, intent_id: str, kind: str, payment_method_id: Optional[str] = None) -> str:
+        """Queue a job and wake the workers; returns the job id"""
+        job_id = await asyncio.to_thread(self.queue.put, intent_id, kind, payment_method_id)
+        self.notify()
+        return job_id
+
+    async def _work(self) -> None:
+        while True:
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Another job may be waiting behind this one
+            self._wakeup.set()
+            self._busy += 1
+            try:
+                await self._run(job)
+            finally:
+                self._busy -= 1
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        try:
+            await self.handler(job)
+        except RetryableJobError as e:
+            if job["attempts"] >= self.max_attempts:
+                self.stats["failed"] += 1
+                await self.on_exhausted(job, e)
+                await asyncio.to_thread(self.queue.fail, job["id"], str(e))
+            else:
+                self.stats["retried"] += 1
+                delay = self.backoff_base_seconds * 2 ** (job["attempts"] - 1)
+                await asyncio.to_thread(self.queue.retry, job["id"], delay, str(e))
+            return
+        except Exception as e:
+            # A bug in the handler must not take the worker down with it
+            self.stats["failed"] += 1
+            await self.on_exhausted(job, e)
+            await asyncio.to_thread(self.queue.fail, job["id"], repr(e))
+            return
+        self.stats["completed"] += 1
+        await asyncio.to_thread(self.queue.complete, job["id"])
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        """Wait until no job is queued or running (for tests and shutdown)"""
+        self.ensure_started()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self._busy or await asyncio.to_thread(self.queue.pending_count):
+            if asyncio.get_running_loop().time() > deadline:
+                raise asyncio.TimeoutError("Payment jobs still pending")
+            self._wakeup.set()
+            await asyncio.sleep(0.01)
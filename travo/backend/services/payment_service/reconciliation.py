@@ -0,0 +1,430 @@
+"""Reconciliation of the transaction ledger against processor settlement files
+
+Both sides are reduced to records of (payment_intent_id, signed amount,
+currency): payments and charges count positive, refunds negative, and only
+succeeded ledger transactions take part. Records are netted per intent and
+the two sides compared; every intent that is missing on one side, or whose
+net amount or currency differs, is written to a mismatch CSV.
+
+Inputs are read in chunks and never held in memory whole. By default they
+are joined with a partitioned hash join: each side is split by a hash of
+the intent id into partition files on disk, then one partition at a time is
+loaded into a dict and joined, so memory is bounded by the largest
+partition rather than the input. Inputs already sorted by intent id can be
+joined with a streaming sort-merge instead, which needs no partition files.
+
+Progress is checkpointed after every chunk and every joined partition. A
+job run again over the same work directory after a crash picks up from the
+last checkpoint: partially written partition and mismatch files are cut
+back to their checkpointed size and the inputs are skipped past the records
+already consumed.
+
+Run nightly from the command line:
+
+    python -m services.payment_service.reconciliation ledger.csv settlement.csv work/
+"""
+import os
+import csv
+import json
+import zlib
+import random
+import argparse
+import tempfile
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+Record = Tuple[str, float, str]  # payment_intent_id, signed amount, currency
+RecordSource = Callable[[], Iterable[Record]]
+
+MISSING_IN_SETTLEMENT = "missing_in_settlement"
+MISSING_IN_LEDGER = "missing_in_ledger"
+AMOUNT_MISMATCH = "amount_mismatch"
+CURRENCY_MISMATCH = "currency_mismatch"
+
+MISMATCH_FIELDS = [
+    "payment_intent_id", "kind", "ledger_amount", "settled_amount", "ledger_currency", "settled_currency"
+]
+
+# Currency of an intent whose records are in more than one currency
+MIXED_CURRENCY = "MIXED"
+
+CREDIT_TYPES = {"payment", "charge", "capture"}
+DEBIT_TYPES = {"refund", "chargeback"}
+
+SIDES = ("ledger", "settlement")
+
+
+def _signed_amount(kind: str, amount: float) -> Optional[float]:
+    kind = kind.lower()
+    if kind in CREDIT_TYPES:
+        return amount
+    if kind in DEBIT_TYPES:
+        return -amount
+    return None
+
+
+def _value(field: Any) -> str:
+    """Plain string of an enum member or a string"""
+    return str(getattr(field, "value", field))
+
+
+def ledger_records(transactions: Iterable[Dict[str, Any]]) -> Iterator[Record]:
+    """Records of the succeeded payments and refunds among ledger transactions"""
+    for transaction in transactions:
+        if _value(transaction["status"]) != "succeeded" or not transaction.get("payment_intent_id"):
+            continue
+        amount = _signed_amount(_value(transaction["type"]), float(transaction["amount"]))
+        if amount is not None:
+            yield transaction["payment_intent_id"], amount, transaction["currency"]
+
+
+def read_ledger_csv(path: str) -> Iterator[Record]:
+    """Records from a ledger export with payment_intent_id, type, amount, currency and status columns"""
+    with open(path, newline="") as f:
+        yield from ledger_records(csv.DictReader(f))
+
+
+def read_settlement_csv(path: str) -> Iterator[Record]:
+    """Records from a processor settlement file with payment_intent_id, type, amount and currency columns"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            amount = _signed_amount(row["type"], float(row["amount"]))
+            if amount is not None and row["payment_intent_id"]:
+                yield row["payment_intent_id"], amount, row["currency"]
+
+
+def write_settlement_fixture(
+    records: Iterable[Record],
+    path: str,
+    drop_rate: float = 0.001,
+    amount_error_rate: float = 0.001,
+    extra_rate: float = 0.001,
+    seed: Optional[int] = None
+) -> None:
+    """Write a settlement file for ledger records, standing in for a processor's export
+
+    A share of records is dropped, settled for a different amount, or joined
+    by a settlement for an intent the ledger doesn't know, so a reconciliation
+    has something to find.
+    """
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["payment_intent_id", "type", "amount", "currency"])
+        for intent_id, amount, currency in records:
+            roll = rng.random()
+            if roll < drop_rate:
+                continue
+            if roll < drop_rate + amount_error_rate:
+                amount = round(amount * rng.uniform(0.5, 0.99), 2)
+            writer.writerow([intent_id, "charge" if amount >= 0 else "refund", repr(abs(amount)), currency])
+            if rng.random() < extra_rate:
+                writer.writerow([f"pi_unknown_{rng.getrandbits(48):012x}", "charge", "10.0", currency])
+
+
+class ReconciliationReport(NamedTuple):
+    stats: Dict[str, int]
+    mismatches_path: str
+
+
+def _empty_stats() -> Dict[str, int]:
+    return {
+        "ledger_records": 0,
+        "settlement_records": 0,
+        "ledger_intents": 0,
+        "settled_intents": 0,
+        "matched": 0,
+        MISSING_IN_SETTLEMENT: 0,
+        MISSING_IN_LEDGER: 0,
+        AMOUNT_MISMATCH: 0,
+        CURRENCY_MISMATCH: 0,
+    }
+
+
+class ReconciliationJob:
+    """Resumable reconciliation run, with its state kept in `work_dir`
+
+    Args:
+        work_dir: Directory for partition files, the checkpoint and mismatches.csv
+        partitions: Number of hash partitions; raise it until one partition of the larger input fits in memory
+        chunk_size: Records read between two checkpoints
+        amount_tolerance: Largest net amount difference still counted as a match
+    """
+
+    def __init__(self, work_dir: str, partitions: int = 64, chunk_size: int = 100000, amount_tolerance: float = 0.005):
+        self.work_dir = work_dir
+        self.partitions = partitions
+        self.chunk_size = chunk_size
+        self.amount_tolerance = amount_tolerance
+        self.checkpoint_path = os.path.join(work_dir, "checkpoint.json")
+        self.mismatches_path = os.path.join(work_dir, "mismatches.csv")
+
+    def _partition_path(self, side: str, partition: int) -> str:
+        return os.path.join(self.work_dir, f"{side}-{partition:04d}.csv")
+
+    def _load_state(self, mode: str) -> Dict[str, Any]:
+        try:
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {
+                "mode": mode,
+                "partitions": self.partitions,
+                "phase": "partition" if mode == "hash" else "merge",
+                "consumed": {side: 0 for side in SIDES},
+                "partition_sizes": {side: [0] * self.partitions for side in SIDES},
+                "joined": 0,
+                "mismatch_offset": 0,
+                "stats": _empty_stats(),
+            }
+        if state["mode"] != mode or state["partitions"] != self.partitions:
+            raise ValueError(f"{self.work_dir} holds a checkpoint of a different reconciliation; reset() it first")
+        return state
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=self.work_dir)
+        with os.fdopen(fd, "w") as temp_file:
+            json.dump(state, temp_file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def reset(self) -> None:
+        """Delete the checkpoint and every file of a previous run"""
+        if not os.path.isdir(self.work_dir):
+            return
+        for name in os.listdir(self.work_dir):
+            if name == "checkpoint.json" or name == "mismatches.csv" or name.startswith(SIDES):
+                os.remove(os.path.join(self.work_dir, name))
+
+    def run(self, ledger: RecordSource, settlement: RecordSource, presorted: bool = False) -> ReconciliationReport:
+        """Reconcile, resuming from the checkpoint in work_dir if there is one
+
+        Args:
+            ledger: Opens the ledger records from the start
+            settlement: Opens the settlement records from the start
+            presorted: Both inputs are sorted by payment_intent_id; join with a sort-merge
+
+        Raises:
+            ValueError: If presorted inputs are out of order, or work_dir holds a different run
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        state = self._load_state("merge" if presorted else "hash")
+        sources = {"ledger": ledger, "settlement": settlement}
+
+        if state["phase"] == "partition":
+            for side in SIDES:
+                self._partition(side, sources[side], state)
+            state["phase"] = "join"
+            self._save_state(state)
+        if state["phase"] == "join":
+            self._join_partitions(state)
+        elif state["phase"] == "merge":
+            self._merge(sources, state)
+
+        return ReconciliationReport(dict(state["stats"]), self.mismatches_path)
+
+    def _open_mismatches(self, state: Dict[str, Any]):
+        new = not os.path.exists(self.mismatches_path)
+        f = open(self.mismatches_path, "a", newline="")
+        # Anything past the checkpoint is from a run that crashed before recording it
+        f.truncate(state["mismatch_offset"])
+        f.seek(state["mismatch_offset"])
+        writer = csv.writer(f)
+        if new or state["mismatch_offset"] == 0:
+            writer.writerow(MISMATCH_FIELDS)
+        return f, writer
+
+    def _partition(self, side: str, source: RecordSource, state: Dict[str, Any]) -> None:
+        sizes = state["partition_sizes"][side]
+        files = []
+        try:
+            for partition in range(self.partitions):
+                f = open(self._partition_path(side, partition), "a", newline="")
+                f.truncate(sizes[partition])
+                f.seek(sizes[partition])
+                files.append(f)
+            writers = [csv.writer(f) for f in files]
+
+            records = islice(source(), state["consumed"][side], None)
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                for intent_id, amount, currency in chunk:
+                    writers[zlib.crc32(intent_id.encode("utf-8")) % self.partitions].writerow(
+                        (intent_id, repr(amount), currency)
+                    )
+                for partition, f in enumerate(files):
+                    f.flush()
+                    sizes[partition] = f.tell()
+                state["consumed"][side] += len(chunk)
+                state["stats"][f"{side}_records"] += len(chunk)
+                self._save_state(state)
+        finally:
+            for f in files:
+                f.close()
+
+    @staticmethod
+    def _aggregate(path: str) -> Dict[str, List]:
+        totals: Dict[str, List] = {}
+        with open(path, newline="") as f:
+            for intent_id, amount, currency in csv.reader(f):
+                total = totals.get(intent_id)
+                if total is None:
+                    totals[intent_id] = [float(amount), currency]
+                else:
+                    total[0] += float(amount)
+                    if total[1] != currency:
+                        total[1] = MIXED_CURRENCY
+        return totals
+
+    def _compare(
+        self,
+        intent_id: str,
+        ours: Optional[List],
+        theirs: Optional[List],
+        stats: Dict[str, int],
+        writer
+    ) -> None:
+        if ours is not None:
+            stats["ledger_intents"] += 1
+        if theirs is not None:
+            stats["settled_intents"] += 1
+
+        if theirs is None:
+            kind = MISSING_IN_SETTLEMENT
+        elif ours is None:
+            kind = MISSING_IN_LEDGER
+        elif ours[1] != theirs[1]:
+            kind = CURRENCY_MISMATCH
+        elif abs(ours[0] - theirs[0]) > self.amount_tolerance:
+            kind = AMOUNT_MISMATCH
+        else:
+            stats["matched"] += 1
+            return
+
+        stats[kind] += 1
+        writer.writerow([
+            intent_id,
+            kind,
+            round(ours[0], 2) if ours else "",
+            round(theirs[0], 2) if theirs else "",
+            ours[1] if ours else "",
+            theirs[1] if theirs else "",
+        ])
+
+    def _join_partitions(self, state: Dict[str, Any]) -> None:
+        f, writer = self._open_mismatches(state)
+        try:
+            for partition in range(state["joined"], self.partitions):
+                ours = self._aggregate(self._partition_path("ledger", partition))
+                theirs = self._aggregate(self._partition_path("settlement", partition))
+                for intent_id in sorted(ours.keys() | theirs.keys()):
+                    self._compare(intent_id, ours.get(intent_id), theirs.get(intent_id), state["stats"], writer)
+                f.flush()
+                state["joined"] = partition + 1
+                state["mismatch_offset"] = f.tell()
+                self._save_state(state)
+                for side in SIDES:
+                    os.remove(self._partition_path(side, partition))
+        finally:
+            f.close()
+        state["phase"] = "done"
+        self._save_state(state)
+
+    @staticmethod
+    def _groups(records: Iterable[Record]) -> Iterator[Tuple[str, int, List]]:
+        """(intent_id, record count, [net amount, currency]) per run of records of one intent"""
+        current = None
+        count = 0
+        total: List = []
+        for intent_id, amount, currency in records:
+            if intent_id != current:
+                if current is not None:
+                    if intent_id < current:
+                        raise ValueError(f"Input is not sorted by payment_intent_id: {intent_id} after {current}")
+                    yield current, count, total
+                current, count, total = intent_id, 0, [0.0, currency]
+            count += 1
+            total[0] += amount
+            if total[1] != currency:
+                total[1] = MIXED_CURRENCY
+        if current is not None:
+            yield current, count, total
+
+    def _merge(self, sources: Dict[str, RecordSource], state: Dict[str, Any]) -> None:
+        consumed = state["consumed"]
+        stats = state["stats"]
+        ours_groups = self._groups(islice(sources["ledger"](), consumed["ledger"], None))
+        theirs_groups = self._groups(islice(sources["settlement"](), consumed["settlement"], None))
+        ours = next(ours_groups, None)
+        theirs = next(theirs_groups, None)
+
+        f, writer = self._open_mismatches(state)
+        try:
+            since_checkpoint = 0
+            while ours is not None or theirs is not None:
+                if theirs is None or (ours is not None and ours[0] < theirs[0]):
+                    intent_id, ours_row, theirs_row = ours[0], ours, None
+                elif ours is None or theirs[0] < ours[0]:
+                    intent_id, ours_row, theirs_row = theirs[0], None, theirs
+                else:
+                    intent_id, ours_row, theirs_row = ours[0], ours, theirs
+
+                self._compare(
+                    intent_id,
+                    ours_row[2] if ours_row else None,
+                    theirs_row[2] if theirs_row else None,
+                    stats,
+                    writer
+                )
+                if ours_row:
+                    consumed["ledger"] += ours_row[1]
+                    stats["ledger_records"] += ours_row[1]
+                    since_checkpoint += ours_row[1]
+                    ours = next(ours_groups, None)
+                if theirs_row:
+                    consumed["settlement"] += theirs_row[1]
+                    stats["settlement_records"] += theirs_row[1]
+                    since_checkpoint += theirs_row[1]
+                    theirs = next(theirs_groups, None)
+
+                # Only whole intents are behind a checkpoint, so a resumed run starts on an intent boundary
+                if since_checkpoint >= self.chunk_size:
+                    f.flush()
+                    state["mismatch_offset"] = f.tell()
+                    self._save_state(state)
+                    since_checkpoint = 0
+            f.flush()
+            state["mismatch_offset"] = f.tell()
+        finally:
+            f.close()
+        state["phase"] = "done"
+        self._save_state(state)
+
+
+def main():
+    """Reconcile a ledger export against a settlement file from the command line."""
+    parser = argparse.ArgumentParser(description="Reconcile the TRAVO ledger against a processor settlement file")
+    parser.add_argument("ledger_csv", help="Ledger export with payment_intent_id, type, amount, currency and status columns")
+    parser.add_argument("settlement_csv", help="Settlement file with payment_intent_id, type, amount and currency columns")
+    parser.add_argument("work_dir", help="Directory for the checkpoint, partition files and mismatches.csv")
+    parser.add_argument("--presorted", action="store_true", help="Both files are sorted by payment_intent_id")
+    parser.add_argument("--partitions", type=int, default=64, help="Hash partitions for unsorted inputs")
+    parser.add_argument("--restart", action="store_true", help="Discard the checkpoint of a previous run")
+
+    args = parser.parse_args()
+    job = ReconciliationJob(args.work_dir, partitions=args.partitions)
+    if args.restart:
+        job.reset()
+    report = job.run(
+        lambda: read_ledger_csv(args.ledger_csv),
+        lambda: read_settlement_csv(args.settlement_csv),
+        presorted=args.presorted
+    )
+    for name, value in report.stats.items():
+        print(f"{name}: {value}")
+    print(f"Mismatches written to {report.mismatches_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""Velocity risk scoring for payment attempts
+
+Every charge attempt is counted against the paying user, the payment method
+and the card fingerprint, over sliding windows of one minute, one hour and
+one day. Each window is a ring of fixed-width buckets holding attempt counts
+and amounts, with running totals kept alongside, so recording an attempt or
+reading a window touches a few array slots rather than the attempt history.
+Rules compare the totals against thresholds and add up to a score that
+decides whether the attempt goes ahead, needs the customer to authenticate,
+or is blocked.
+
+Counter state is checkpointed to a file so a restart picks the windows up
+where they were. Buckets are numbered by absolute time, so anything that
+went stale while the process was down expires on the next read. A
+checkpoint copies the raw bucket arrays of only the counters changed since
+the previous one; compressing them, dropping idle counters and writing the
+file happen on a worker thread, so the cost on the event loop follows the
+traffic since the last checkpoint rather than the number of counters held.
+"""
+import os
+import time
+import zlib
+import struct
+import asyncio
+import tempfile
+import threading
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Window name -> (number of buckets, bucket width in seconds)
+WINDOWS: Dict[str, Tuple[int, int]] = {
+    "1m": (60, 1),
+    "1h": (60, 60),
+    "1d": (96, 900),
+}
+
+DIMENSIONS = ("user", "method", "card")
+
+DECISION_ALLOW = "allow"
+DECISION_REVIEW = "review"
+DECISION_BLOCK = "block"
+
+CHECKPOINT_MAGIC = b"RISKCKPT"
+CHECKPOINT_VERSION = 2
+# Magic, version and save time
+CHECKPOINT_HEADER = struct.Struct("<8sHd")
+# Per counter: compressed record length; the record starts with the dimension index and value length
+RECORD_LENGTH = struct.Struct("<I")
+RECORD_KEY = struct.Struct("<BH")
+# Per window: newest bucket number and bucket count, followed by the counts and amounts arrays
+WINDOW_HEADER = struct.Struct("<qI")
+
+CounterKey = Tuple[str, str]
+
+
+def heads_are_stale(heads: Tuple[int, ...], now: float) -> bool:
+    """Whether windows whose newest buckets are `heads` (in WINDOWS order) are all empty at `now`"""
+    return all(int(now // width) - head >= buckets for (buckets, width), head in zip(WINDOWS.values(), heads))
+
+
+class SlidingWindow:
+    """Attempt count and amount over the last `buckets * bucket_seconds` seconds
+
+    Totals are exact to within one bucket: an attempt leaves the window when
+    its bucket is reused, up to `bucket_seconds` early.
+    """
+
+    __slots__ = ("bucket_seconds", "counts", "amounts", "head", "count", "amount")
+
+    def __init__(self, buckets: int, bucket_seconds: int):
+        self.bucket_seconds = bucket_seconds
+        self.counts = array("I", bytes(4 * buckets))
+        self.amounts = array("d", bytes(8 * buckets))
+        # Absolute number of the newest bucket, -1 before the first attempt
+        self.head = -1
+        self.count = 0
+        self.amount = 0.0
+
+    def _advance(self, now: float) -> None:
+        bucket = int(now // self.bucket_seconds)
+        if bucket <= self.head:
+            # Same bucket, or the clock stepped back: keep counting into the newest bucket
+            return
+        size = len(self.counts)
+        if bucket - self.head >= size:
+            for i in range(size):
+                self.counts[i] = 0
+                self.amounts[i] = 0.0
+            self.count = 0
+            self.amount = 0.0
+        else:
+            for absolute in range(self.head + 1, bucket + 1):
+                i = absolute % size
+                self.count -= self.counts[i]
+                self.amount -= self.amounts[i]
+                self.counts[i] = 0
+                self.amounts[i] = 0.0
+            # Running float totals drift; an empty window is exactly zero
+            if self.count == 0:
+                self.amount = 0.0
+        self.head = bucket
+
+    def add(self, now: float, amount: float) -> None:
+        self._advance(now)
+        i = self.head % len(self.counts)
+        self.counts[i] += 1
+        self.amounts[i] += amount
+        self.count += 1
+        self.amount += amount
+
+    def totals(self, now: float) -> Tuple[int, float]:
+        """(attempts, amount) in the window ending at `now`"""
+        self._advance(now)
+        return self.count, self.amount
+
+    def dump(self) -> bytes:
+        return WINDOW_HEADER.pack(self.head, len(self.counts)) + self.counts.tobytes() + self.amounts.tobytes()
+
+    def load(self, data: memoryview) -> int:
+        """Restore from dump() output at the start of `data`; returns the number of bytes read"""
+        head, size = WINDOW_HEADER.unpack_from(data)
+        counts_end = WINDOW_HEADER.size + size * self.counts.itemsize
+        end = counts_end + size * self.amounts.itemsize
+        if size == len(self.counts):
+            self.head = head
+            self.counts = array("I")
+            self.counts.frombytes(data[WINDOW_HEADER.size:counts_end])
+            self.amounts = array("d")
+            self.amounts.frombytes(data[counts_end:end])
+            self.count = sum(self.counts)
+            self.amount = sum(self.amounts)
+        # Otherwise the window was resized since the checkpoint; start it empty
+        return end
+
+
+class VelocityCounters:
+    """One SlidingWindow per entry in WINDOWS"""
+
+    __slots__ = ("windows",)
+
+    def __init__(self):
+        self.windows = {name: SlidingWindow(buckets, width) for name, (buckets, width) in WINDOWS.items()}
+
+    def add(self, now: float, amount: float) -> None:
+        for window in self.windows.values():
+            window.add(now, amount)
+
+    def heads(self) -> Tuple[int, ...]:
+        return tuple(self.windows[name].head for name in WINDOWS)
+
+    def is_idle(self, now: float) -> bool:
+        """Whether every window has slid past its attempts, so the counters can be dropped"""
+        return heads_are_stale(self.heads(), now)
+
+    def dump(self, key: CounterKey) -> bytes:
+        dimension, value = key
+        encoded = value.encode("utf-8")
+        return b"".join(
+            [RECORD_KEY.pack(DIMENSIONS.index(dimension), len(encoded)), encoded]
+            + [self.windows[name].dump() for name in WINDOWS]
+        )
+
+    @classmethod
+    def load(cls, record: bytes) -> Tuple[CounterKey, "VelocityCounters"]:
+        """Inverse of dump()"""
+        data = memoryview(record)
+        dimension, length = RECORD_KEY.unpack_from(data)
+        offset = RECORD_KEY.size + length
+        key = (DIMENSIONS[dimension], bytes(data[RECORD_KEY.size:offset]).decode("utf-8"))
+        counters = cls()
+        for name in WINDOWS:
+            offset += counters.windows[name].load(data[offset:])
+        return key, counters
+
+
+class RiskRule(NamedTuple):
+    name: str
+    dimension: str  # user, method or card
+    window: str  # a key of WINDOWS
+    metric: str  # attempts or amount
+    threshold: float  # the rule fires when the metric is above this
+    score: int
+
+
+DEFAULT_RULES = [
+    RiskRule("user_attempts_1m", "user", "1m", "attempts", 5, 40),
+    RiskRule("user_attempts_1h", "user", "1h", "attempts", 20, 30),
+    RiskRule("user_amount_1d", "user", "1d", "amount", 5000, 30),
+    RiskRule("method_attempts_1m", "method", "1m", "attempts", 3, 30),
+    RiskRule("method_attempts_1d", "method", "1d", "attempts", 25, 20),
+    RiskRule("card_attempts_1h", "card", "1h", "attempts", 10, 40),
+    RiskRule("card_amount_1d", "card", "1d", "amount", 10000, 40),
+]
+
+
+class RiskAssessment(NamedTuple):
+    score: int
+    decision: str  # allow, review or block
+    reasons: List[str]  # names of the rules that fired
+
+
+class RiskScorer:
+    """Velocity counters and the rules evaluated against them
+
+    Args:
+        rules: Rules to evaluate; DEFAULT_RULES if None
+        review_score: Score from which an attempt needs customer authentication
+        block_score: Score from which an attempt is blocked
+        checkpoint_path: File the counters are saved to and restored from; no checkpoints if None
+        checkpoint_interval_seconds: Least time between two checkpoints
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Iterable[RiskRule]] = None,
+        review_score: int = 50,
+        block_score: int = 80,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval_seconds: float = 30.0
+    ):
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        for rule in self.rules:
+            if rule.dimension not in DIMENSIONS or rule.window not in WINDOWS or rule.metric not in ("attempts", "amount"):
+                raise ValueError(f"Invalid risk rule: {rule.name}")
+        self.review_score = review_score
+        self.block_score = block_score
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval_seconds = checkpoint_interval_seconds
+        self._counters: Dict[CounterKey, VelocityCounters] = {}
+        # Counters changed since their state was last handed to a checkpoint
+        self._dirty: Set[CounterKey] = set()
+        # Window heads and compressed record of every counter in the checkpoint,
+        # kept by whichever thread writes it
+        self._written: Dict[CounterKey, Tuple[Tuple[int, ...], bytes]] = {}
+        self._write_lock = threading.Lock()
+        self._write_failed = False
+        self._last_checkpoint = time.monotonic()
+        self._checkpointing: Optional[asyncio.Task] = None
+        self.stats = {"assessed": 0, "reviewed": 0, "blocked": 0, "checkpoints": 0}
+        if checkpoint_path:
+            self.restore()
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def _counters_for(self, dimension: str, value: str) -> VelocityCounters:
+        key = (dimension, value)
+        counters = self._counters.get(key)
+        if counters is None:
+            counters = self._counters[key] = VelocityCounters()
+        self._dirty.add(key)
+        return counters
+
+    def totals(self, dimension: str, value: str, window: str, now: Optional[float] = None) -> Tuple[int, float]:
+        """(attempts, amount) recorded for a user, method or card in a window"""
+        counters = self._counters.get((dimension, value))
+        if counters is None:
+            return 0, 0.0
+        return counters.windows[window].totals(time.time() if now is None else now)
+
+    def assess(
+        self,
+        user_id: str,
+        payment_method_id: str,
+        card_fingerprint: Optional[str],
+        amount: float,
+        now: Optional[float] = None
+    ) -> RiskAssessment:
+        """Record a payment attempt and score it against the windows that include it
+
+        Args:
+            user_id: Paying user
+            payment_method_id: Method being charged
+            card_fingerprint: Fingerprint of the card behind the method; None for non-card methods
+            amount: Amount being charged
+            now: Unix time of the attempt; the current time if None
+        """
+        now = time.time() if now is None else now
+        keyed = {"user": self._counters_for("user", user_id), "method": self._counters_for("method", payment_method_id)}
+        if card_fingerprint:
+            keyed["card"] = self._counters_for("card", card_fingerprint)
+        for counters in keyed.values():
+            counters.add(now, amount)
+
+        score = 0
+        reasons = []
+        for rule in self.rules:
+            counters = keyed.get(rule.dimension)
+            if counters is None:
+                continue
+            attempts, total = counters.windows[rule.window].totals(now)
+            if (attempts if rule.metric == "attempts" else total) > rule.threshold:
+                score += rule.score
+                reasons.append(rule.name)
+
+        self.stats["assessed"] += 1
+        if score >= self.block_score:
+            self.stats["blocked"] += 1
+            decision = DECISION_BLOCK
+        elif score >= self.review_score:
+            self.stats["reviewed"] += 1
+            decision = DECISION_REVIEW
+        else:
+            decision = DECISION_ALLOW
+        return RiskAssessment(score, decision, reasons)
+
+    def _changes(self, keys: Iterable[CounterKey]) -> Dict[CounterKey, Tuple[Tuple[int, ...], bytes]]:
+        """Window heads and raw state of the given counters"""
+        return {key: (self._counters[key].heads(), self._counters[key].dump(key)) for key in keys}
+
+    def _write(self, changes: Dict[CounterKey, Tuple[Tuple[int, ...], bytes]], replace: bool, now: float) -> List[CounterKey]:
+        """Fold changes into the checkpoint and write it out; runs on a worker thread
+
+        Returns:
+            Keys of the counters found idle and left out of the checkpoint
+        """
+        with self._write_lock:
+            if replace:
+                self._written = {}
+            for key, (heads, raw) in changes.items():
+                self._written[key] = (heads, zlib.compress(raw, 1))
+
+            idle = [key for key, (heads, _) in self._written.items() if heads_are_stale(heads, now)]
+            for key in idle:
+                del self._written[key]
+
+            directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as temp_file:
+                    temp_file.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, now))
+                    for _, record in self._written.values():
+                        temp_file.write(RECORD_LENGTH.pack(len(record)))
+                        temp_file.write(record)
+                os.replace(temp_path, self.checkpoint_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            return idle
+
+    def _drop_idle(self, keys: Iterable[CounterKey], now: float) -> None:
+        """Forget counters a checkpoint found idle, unless an attempt used them since"""
+        for key in keys:
+            counters = self._counters.get(key)
+            if counters is not None and key not in self._dirty and counters.is_idle(now):
+                del self._counters[key]
+
+    def checkpoint(self, now: Optional[float] = None) -> None:
+        """Write all counters to checkpoint_path, replacing the previous checkpoint atomically
+
+        Blocks until the file is written; checkpoint_soon is the variant for the event loop.
+        """
+        if not self.checkpoint_path:
+            return
+        now = time.time() if now is None else now
+        changes = self._changes(self._counters)
+        self._dirty.clear()
+        self._last_checkpoint = time.monotonic()
+        self._drop_idle(self._write(changes, True, now), now)
+        self._write_failed = False
+        self.stats["checkpoints"] += 1
+
+    def restore(self) -> bool:
+        """Load the counters from checkpoint_path
+
+        A missing or unreadable checkpoint leaves the counters empty.
+
+        Returns:
+            Whether a checkpoint was loaded
+        """
+        counters_by_key = {}
+        written = {}
+        try:
+            with open(self.checkpoint_path, "rb") as f:
+                magic, version, _ = CHECKPOINT_HEADER.unpack(f.read(CHECKPOINT_HEADER.size))
+                if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+                    return False
+                while True:
+                    length = f.read(RECORD_LENGTH.size)
+                    if not length:
+                        break
+                    record = f.read(RECORD_LENGTH.unpack(length)[0])
+                    key, counters = VelocityCounters.load(zlib.decompress(record))
+                    counters_by_key[key] = counters
+                    written[key] = (counters.heads(), record)
+        except (OSError, ValueError, IndexError, struct.error, zlib.error):
+            return False
+        self._counters = counters_by_key
+        self._written = written
+        self._dirty.clear()
+        return True
+
+    def checkpoint_soon(self) -> None:
+        """Write a checkpoint in the background if one is due
+
+        Only the bucket arrays of counters changed since the last checkpoint are
+        copied on the event loop; everything else happens on a worker thread.
+        """
+        if not self.checkpoint_path or not (self._dirty or self._write_failed):
+            return
+        if time.monotonic() - self._last_checkpoint < self.checkpoint_interval_seconds:
+            return
+        if self._checkpointing is not None and not self._checkpointing.done():
+            return
+        changes = self._changes(self._dirty)
+        self._dirty.clear()
+        self._last_checkpoint = time.monotonic()
+        self._checkpointing = asyncio.get_running_loop().create_task(self._write_in_background(changes))
+
+    async def _write_in_background(self, changes: Dict[CounterKey, Tuple[Tuple[int, ...], bytes]]) -> None:
+        now = time.time()
+        try:
+            idle = await asyncio.to_thread(self._write, changes, False, now)
+        except OSError:
+            # The changes are folded in already; write them with the next attempt
+            self._write_failed = True
+            return
+        self._write_failed = False
+        self._drop_idle(idle, now)
+        self.stats["checkpoints"] += 1
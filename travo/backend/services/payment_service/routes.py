@@ -1,5 +1,8 @@
-from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks
-from typing import List, Optional
+import json
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 # Import schemas and service logic
 from .schemas import (
@@ -10,7 +13,12 @@ from .schemas import (
     PaymentStatus,
     RefundRequest,
     RefundResponse,
-    TransactionResponse
+    TransactionType,
+    TransactionResponse,
+    TransactionStatsResponse,
+    ExportFormat,
+    BatchRefundRequest,
+    BatchRefundStatus
 )
 from .service_logic import (
     create_payment_method, 
@@ -18,10 +26,22 @@ from .service_logic import (
     delete_payment_method,
     create_payment_intent,
     get_payment_intent,
-    process_payment,
+    submit_payment,
+    confirm_payment,
     create_refund,
-    get_transactions
+    create_refund_batch,
+    get_transactions,
+    get_transaction_stats,
+    export_transactions,
+    idempotency_store
 )
+from .processing import InvalidTransitionError, intent_etag
+from .idempotency import IdempotencyKeyReusedError, StoredResponse, request_fingerprint
+from .gateway import GatewayUnavailableError
+from .export import MEDIA_TYPES
+
+# Seconds a client polling a processing intent should wait between requests
+POLL_INTERVAL_SECONDS = 1
 
 # Create router
 router = APIRouter()
@@ -57,28 +77,89 @@ async def remove_payment_method(method_id: str):
 # Create a payment intent
 @router.post("/intents", response_model=PaymentIntentResponse, status_code=status.HTTP_201_CREATED)
 async def create_intent(payment_intent: PaymentIntentCreate):
-    result = await create_payment_intent(payment_intent)
+    try:
+        result = await create_payment_intent(payment_intent)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     return result
 
-# Get a payment intent
+def _intent_headers(intent: PaymentIntentResponse) -> dict:
+    headers = {"ETag": intent_etag(intent.id, intent.version), "Cache-Control": "no-cache"}
+    if intent.status == PaymentStatus.PROCESSING:
+        headers["Retry-After"] = str(POLL_INTERVAL_SECONDS)
+    return headers
+
+# Get a payment intent; poll with If-None-Match while it is processing
 @router.get("/intents/{intent_id}", response_model=PaymentIntentResponse)
-async def get_intent(intent_id: str):
+async def get_intent(
+    intent_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None)
+):
     intent = await get_payment_intent(intent_id)
     if not intent:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Payment intent not found"
         )
+    
+    headers = _intent_headers(intent)
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    response.headers.update(headers)
     return intent
 
-# Process a payment
-@router.post("/intents/{intent_id}/process", response_model=PaymentIntentResponse)
+def _accepted_headers(request: Request, intent: PaymentIntentResponse) -> Dict[str, str]:
+    headers = _intent_headers(intent)
+    headers["Location"] = str(request.url_for("get_intent", intent_id=intent.id))
+    return headers
+
+async def _idempotent(
+    request: Request,
+    idempotency_key: Optional[str],
+    user_id: str,
+    status_code: int,
+    call: Callable[[], Awaitable[Tuple[object, Dict[str, str]]]]
+) -> Response:
+    """Run `call` once per Idempotency-Key and replay its response to retries
+    
+    `call` returns the response model and headers; errors it raises are not stored.
+    """
+    async def execute() -> StoredResponse:
+        result, headers = await call()
+        return StoredResponse(status_code, jsonable_encoder(result), headers)
+    
+    if not idempotency_key:
+        stored, replayed = await execute(), False
+    else:
+        fingerprint = request_fingerprint(
+            request.method, request.url.path, request.query_params.multi_items(), await request.body()
+        )
+        try:
+            stored, replayed = await idempotency_store.run(user_id, idempotency_key, fingerprint, execute)
+        except IdempotencyKeyReusedError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=str(e)
+            )
+    
+    headers = dict(stored.headers)
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    return JSONResponse(stored.body, status_code=stored.status_code, headers=headers)
+
+# Process a payment; the gateway is called in the background
+@router.post("/intents/{intent_id}/process", response_model=PaymentIntentResponse, status_code=status.HTTP_202_ACCEPTED)
 async def process_intent_payment(
     intent_id: str, 
     payment_method_id: str,
-    background_tasks: BackgroundTasks
+    request: Request,
+    idempotency_key: Optional[str] = Header(None)
 ):
-    # Get the payment intent
     intent = await get_payment_intent(intent_id)
     if not intent:
         raise HTTPException(
@@ -86,33 +167,138 @@ async def process_intent_payment(
             detail="Payment intent not found"
         )
     
-    # Check if already processed
-    if intent.status == PaymentStatus.SUCCEEDED:
+    async def process():
+        try:
+            processing = await submit_payment(intent_id, payment_method_id)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        except InvalidTransitionError as e:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=str(e)
+            )
+        return processing, _accepted_headers(request, processing)
+    
+    return await _idempotent(request, idempotency_key, intent.user_id, status.HTTP_202_ACCEPTED, process)
+
+# Resume a payment after the customer completed the requested action
+@router.post("/intents/{intent_id}/confirm", response_model=PaymentIntentResponse, status_code=status.HTTP_202_ACCEPTED)
+async def confirm_intent_payment(intent_id: str, request: Request, response: Response):
+    try:
+        intent = await confirm_payment(intent_id)
+    except InvalidTransitionError as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Payment has already been processed"
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
         )
     
-    # Process the payment (in background for async processing)
-    background_tasks.add_task(process_payment, intent_id, payment_method_id)
-    
-    # Return the updated intent (will be in processing state)
-    intent.status = PaymentStatus.PROCESSING
+    if not intent:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment intent not found"
+        )
+    response.headers.update(_accepted_headers(request, intent))
     return intent
 
 # Create a refund
 @router.post("/refunds", response_model=RefundResponse, status_code=status.HTTP_201_CREATED)
-async def request_refund(refund_request: RefundRequest):
-    refund = await create_refund(refund_request)
-    return refund
+async def request_refund(
+    refund_request: RefundRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None)
+):
+    intent = await get_payment_intent(refund_request.payment_intent_id)
+    if not intent:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment intent not found"
+        )
+    
+    async def refund():
+        try:
+            result = await create_refund(refund_request)
+        except GatewayUnavailableError as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+        if not result:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Payment cannot be refunded"
+            )
+        return result, {}
+    
+    return await _idempotent(request, idempotency_key, intent.user_id, status.HTTP_201_CREATED, refund)
+
+# Refund many payment intents at once (e.g. every booking of a cancelled event)
+@router.post("/refunds/batch")
+async def request_refund_batch(batch: BatchRefundRequest):
+    results = await create_refund_batch(batch.refunds)
+    
+    async def stream_results():
+        # One result per line as each refund completes, then a summary line
+        summary = {result_status.value: 0 for result_status in BatchRefundStatus}
+        async for result in results:
+            summary[result.status.value] += 1
+            yield result.model_dump_json() + "\n"
+        yield json.dumps({"summary": summary}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
-# Get transaction history
+# Get transaction history; the next page is linked from the Link header
 @router.get("/transactions", response_model=List[TransactionResponse])
 async def get_transaction_history(
     user_id: str,
-    transaction_type: Optional[str] = None,
-    limit: Optional[int] = 10,
-    offset: Optional[int] = 0
+    request: Request,
+    response: Response,
+    transaction_type: Optional[TransactionType] = None,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None
 ):
-    transactions = await get_transactions(user_id, transaction_type, limit, offset)
+    try:
+        transactions, next_cursor = await get_transactions(user_id, transaction_type, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    if next_cursor:
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
     return transactions
+
+# Export a user's whole transaction history as CSV or NDJSON, streamed and gzipped on the fly
+@router.get("/transactions/export")
+async def export_transaction_history(
+    user_id: str,
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+    transaction_type: Optional[TransactionType] = None,
+    accept_encoding: Optional[str] = Header(None)
+):
+    compress = "gzip" in (accept_encoding or "").lower()
+    headers = {
+        "Content-Disposition": f'attachment; filename="transactions-{user_id}.{export_format.value}"',
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding"
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    
+    chunks = await export_transactions(user_id, export_format, transaction_type, compress=compress)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[export_format], headers=headers)
+
+# Get transaction totals and balances for a user
+@router.get("/transactions/stats", response_model=TransactionStatsResponse)
+async def get_transaction_summary(user_id: str, currency: str = "USD"):
+    try:
+        return await get_transaction_stats(user_id, currency)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
@@ -14,6 +14,7 @@ class PaymentMethodType(str, Enum):
 class PaymentStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
+    REQUIRES_ACTION = "requires_action"
     SUCCEEDED = "succeeded"
     FAILED = "failed"
     REFUNDED = "refunded"
@@ -26,6 +27,10 @@ class TransactionType(str, Enum):
     PAYOUT = "payout"
     FEE = "fee"
 
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
 class CreditCardInfo(BaseModel):
     last4: str
     brand: str
@@ -107,6 +112,9 @@ class PaymentIntentResponse(BaseModel):
     status: PaymentStatus
     payment_method_id: Optional[str] = None
     error_message: Optional[str] = None
+    next_action: Optional[Dict[str, Any]] = None  # What the customer must do while status is requires_action
+    amount_refunded: float = 0
+    version: int = 1  # Incremented on every status change
     created_at: datetime
     updated_at: datetime
 
@@ -123,6 +131,21 @@ class RefundResponse(BaseModel):
     reason: Optional[str] = None
     created_at: datetime
 
+class BatchRefundRequest(BaseModel):
+    refunds: List[RefundRequest] = Field(..., min_length=1, max_length=1000)
+
+class BatchRefundStatus(str, Enum):
+    SUCCEEDED = "succeeded"
+    REJECTED = "rejected"  # Failed validation; nothing was sent to the processor
+    FAILED = "failed"  # The processor could not be reached; safe to retry
+
+class BatchRefundResult(BaseModel):
+    index: int  # Position of the item in the request
+    payment_intent_id: str
+    status: BatchRefundStatus
+    refund: Optional[RefundResponse] = None
+    error: Optional[str] = None
+
 class TransactionResponse(BaseModel):
     id: str
     user_id: str
@@ -135,3 +158,12 @@ class TransactionResponse(BaseModel):
     payment_intent_id: Optional[str] = None
     refund_id: Optional[str] = None
     created_at: datetime
+
+class TransactionStatsResponse(BaseModel):
+    total_count: int
+    total_amount: float  # Converted to `currency`
+    average_amount: float
+    success_rate: float  # Percentage of transactions that succeeded
+    currency: str
+    currency_breakdown: Dict[str, Dict[str, float]]
+    balances: Dict[str, float]  # Succeeded payments minus succeeded refunds, per currency
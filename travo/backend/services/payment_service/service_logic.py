@@ -1,8 +1,10 @@
-import uuid
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-import random
+import os
 import asyncio
+from typing import AsyncIterator, List, Optional, Dict, Any, Set, Tuple
+from datetime import datetime, timedelta
+
+from config import settings
+from utils.fx import BASE_CURRENCY, convert, is_known_currency
 
 # Import schemas
 from .schemas import (
@@ -16,7 +18,29 @@ from .schemas import (
     RefundRequest,
     RefundResponse,
     TransactionType,
-    TransactionResponse
+    TransactionResponse,
+    TransactionStatsResponse,
+    ExportFormat,
+    BatchRefundResult,
+    BatchRefundStatus
+)
+from .idempotency import IdempotencyStore
+from .export import encode_batches, gzip_chunks
+from .ledger import TransactionLedger
+from .utils import generate_payment_method_id, generate_payment_intent_id, generate_refund_id, card_fingerprint
+from .gateway import StubGateway, GatewayResult, GatewayUnavailableError
+from .risk import RiskScorer, DECISION_BLOCK, DECISION_REVIEW
+from .processing import (
+    PaymentJobQueue,
+    PaymentWorkerPool,
+    RetryableJobError,
+    JOB_CHARGE,
+    JOB_CONFIRM,
+    ConcurrentUpdateError,
+    InvalidTransitionError,
+    StripedLocks,
+    check_transition,
+    transition
 )
 
 # Mock data for payment methods
@@ -99,11 +123,13 @@ MOCK_PAYMENT_INTENTS = [
         "currency": "USD",
         "description": "Payment for booking #12345",
         "metadata": {"booking_id": "12345"},
-        "status": PaymentStatus.SUCCEEDED,
+        "status": PaymentStatus.REFUNDED,
         "payment_method_id": "pm_1",
         "error_message": None,
+        "amount_refunded": 100.0,
+        "version": 2,
         "created_at": datetime.utcnow() - timedelta(days=10),
-        "updated_at": datetime.utcnow() - timedelta(days=10)
+        "updated_at": datetime.utcnow() - timedelta(days=5)
     },
     {
         "id": "pi_2",
@@ -115,6 +141,8 @@ MOCK_PAYMENT_INTENTS = [
         "status": PaymentStatus.SUCCEEDED,
         "payment_method_id": "pm_3",
         "error_message": None,
+        "amount_refunded": 0.0,
+        "version": 1,
         "created_at": datetime.utcnow() - timedelta(days=5),
         "updated_at": datetime.utcnow() - timedelta(days=5)
     },
@@ -128,11 +156,16 @@ MOCK_PAYMENT_INTENTS = [
         "status": PaymentStatus.FAILED,
         "payment_method_id": "pm_2",
         "error_message": "Insufficient funds",
+        "amount_refunded": 0.0,
+        "version": 1,
         "created_at": datetime.utcnow() - timedelta(days=3),
         "updated_at": datetime.utcnow() - timedelta(days=3)
     }
 ]
 
+# Payment intents by ID, so lookups don't scan the list
+INTENTS_BY_ID: Dict[str, Dict[str, Any]] = {intent["id"]: intent for intent in MOCK_PAYMENT_INTENTS}
+
 # Mock data for refunds
 MOCK_REFUNDS = [
     {
@@ -201,11 +234,14 @@ MOCK_TRANSACTIONS = [
     }
 ]
 
+# Transactions are only ever appended; history pages and stats come from the ledger's per-user indexes
+transaction_ledger = TransactionLedger(MOCK_TRANSACTIONS)
+
 # Service functions
 async def create_payment_method(payment_method: PaymentMethodCreate) -> PaymentMethodResponse:
     """Create a new payment method for a user."""
     # Generate a new payment method ID
-    method_id = f"pm_{len(MOCK_PAYMENT_METHODS) + 1}"
+    method_id = generate_payment_method_id()
     
     # Create card details if it's a card payment method
     card_details = None
@@ -218,7 +254,11 @@ async def create_payment_method(payment_method: PaymentMethodCreate) -> PaymentM
             "exp_month": payment_method.card_exp_month,
             "exp_year": payment_method.card_exp_year
         }
+        fingerprint = card_fingerprint(payment_method.card_number, settings.SECRET_KEY)
     
+    else:
+        fingerprint = None
+
     # Check if this is the first payment method for the user
     is_default = True
     for method in MOCK_PAYMENT_METHODS:
@@ -233,6 +273,7 @@ async def create_payment_method(payment_method: PaymentMethodCreate) -> PaymentM
         "type": payment_method.type,
         "billing_details": payment_method.billing_details,
         "card_details": card_details,
+        "fingerprint": fingerprint,
         "is_default": is_default,
         "created_at": datetime.utcnow()
     }
@@ -284,9 +325,16 @@ async def delete_payment_method(method_id: str) -> bool:
     return False
 
 async def create_payment_intent(payment_intent: PaymentIntentCreate) -> PaymentIntentResponse:
-    """Create a new payment intent."""
+    """Create a new payment intent.
+
+    Raises:
+        ValueError: If the currency is not one we have exchange rates for
+    """
+    if not is_known_currency(payment_intent.currency):
+        raise ValueError(f"Unsupported currency: {payment_intent.currency}")
+
     # Generate a new payment intent ID
-    intent_id = f"pi_{len(MOCK_PAYMENT_INTENTS) + 1}"
+    intent_id = generate_payment_intent_id()
     
     # Create the new payment intent
     now = datetime.utcnow()
@@ -294,199 +342,518 @@ async def create_payment_intent(payment_intent: PaymentIntentCreate) -> PaymentI
         "id": intent_id,
         "user_id": payment_intent.user_id,
         "amount": payment_intent.amount,
-        "currency": payment_intent.currency,
+        "currency": payment_intent.currency.upper(),
         "description": payment_intent.description,
         "metadata": payment_intent.metadata,
         "status": PaymentStatus.PENDING,
         "payment_method_id": None,
         "error_message": None,
+        "next_action": None,
+        "amount_refunded": 0.0,
+        "version": 1,
         "created_at": now,
         "updated_at": now
     }
     
     # Add to mock data
     MOCK_PAYMENT_INTENTS.append(new_intent)
+    INTENTS_BY_ID[intent_id] = new_intent
     
     # Convert to response model
     return PaymentIntentResponse(**new_intent)
 
 async def get_payment_intent(intent_id: str) -> Optional[PaymentIntentResponse]:
     """Get a payment intent by ID."""
-    # Find the payment intent
-    for intent in MOCK_PAYMENT_INTENTS:
-        if intent["id"] == intent_id:
-            return PaymentIntentResponse(**intent)
+    intent = _find_intent(intent_id)
+    if not intent:
+        return None
     
+    # Jobs left queued by a previous run are picked up once someone waits on them
+    if intent["status"] == PaymentStatus.PROCESSING:
+        payment_workers.ensure_started()
+    return PaymentIntentResponse(**intent)
+
+def _find_intent(intent_id: str) -> Optional[Dict[str, Any]]:
+    return INTENTS_BY_ID.get(intent_id)
+
+def _find_payment_method(method_id: str) -> Optional[Dict[str, Any]]:
+    for method in MOCK_PAYMENT_METHODS:
+        if method["id"] == method_id:
+            return method
     return None
 
-async def process_payment(intent_id: str, payment_method_id: str) -> PaymentIntentResponse:
-    """Process a payment for a payment intent."""
-    # Find the payment intent
-    intent = None
-    for i, pi in enumerate(MOCK_PAYMENT_INTENTS):
-        if pi["id"] == intent_id:
-            intent = pi
-            intent_index = i
-            break
-    
-    if not intent:
+def _record_payment_transaction(intent: Dict[str, Any]) -> None:
+    """Append the transaction for an intent that has reached succeeded or failed"""
+    transaction_ledger.append({
+        "user_id": intent["user_id"],
+        "type": TransactionType.PAYMENT,
+        "amount": intent["amount"],
+        "currency": intent["currency"],
+        "description": intent["description"],
+        "status": intent["status"],
+        "payment_method_id": intent["payment_method_id"],
+        "payment_intent_id": intent["id"],
+        "refund_id": None
+    })
+
+def _apply_gateway_result(intent: Dict[str, Any], result: GatewayResult, expected_version: Optional[int] = None) -> None:
+    transition(
+        intent,
+        result.status,
+        expected_version=expected_version,
+        error_message=result.error_message,
+        next_action=result.next_action
+    )
+    if result.status in (PaymentStatus.SUCCEEDED, PaymentStatus.FAILED):
+        _record_payment_transaction(intent)
+
+def _method_fingerprint(payment_method: Dict[str, Any]) -> Optional[str]:
+    """The card fingerprint of a method, derived from its card details for methods stored without one"""
+    if payment_method.get("fingerprint"):
+        return payment_method["fingerprint"]
+    card = payment_method.get("card_details")
+    if not card:
         return None
-    
-    # Find the payment method
-    payment_method = None
-    for pm in MOCK_PAYMENT_METHODS:
-        if pm["id"] == payment_method_id:
-            payment_method = pm
-            break
-    
-    if not payment_method:
-        # Update intent with error
-        intent["status"] = PaymentStatus.FAILED
-        intent["error_message"] = "Payment method not found"
-        intent["updated_at"] = datetime.utcnow()
-        MOCK_PAYMENT_INTENTS[intent_index] = intent
+    return f"{card.get('brand')}:{card.get('last4')}:{card.get('exp_month')}/{card.get('exp_year')}"
+
+def _risk_check(intent: Dict[str, Any], payment_method: Dict[str, Any], version: int) -> Optional[GatewayResult]:
+    """Score a charge attempt; the result to record instead of charging, or None to go ahead
+
+    Each submission is counted once: retries of its job, which run at the same
+    intent version, reuse the decision recorded for that version.
+    """
+    risk = intent.get("risk")
+    if risk is None or risk["version"] != version:
+        # Amount rules are in US dollars, whatever the intent's currency
+        amount = convert(intent["amount"], intent["currency"], BASE_CURRENCY)
+        assessment = risk_scorer.assess(intent["user_id"], payment_method["id"], _method_fingerprint(payment_method), amount)
+        risk_scorer.checkpoint_soon()
+        risk = intent["risk"] = {**assessment._asdict(), "version": version}
+    if risk["decision"] == DECISION_BLOCK:
+        return GatewayResult(PaymentStatus.FAILED, error_message="Payment blocked by risk checks")
+    if risk["decision"] == DECISION_REVIEW:
+        return GatewayResult(
+            PaymentStatus.REQUIRES_ACTION,
+            next_action={"type": "authenticate", "reason": "Additional verification required"}
+        )
+    return None
+
+async def run_payment_job(job: Dict[str, Any]) -> None:
+    """Call the gateway for a queued job and record the outcome on its intent
+
+    Raises:
+        RetryableJobError: If the gateway was unavailable
+    """
+    intent = _find_intent(job["intent_id"])
+    # A job delivered again after its outcome was recorded has nothing left to do
+    if intent is None or intent["status"] != PaymentStatus.PROCESSING:
+        return
+    version = intent["version"]
+
+    try:
+        if job["kind"] == JOB_CONFIRM:
+            result = await gateway.confirm(intent)
+        else:
+            payment_method = _find_payment_method(job["payment_method_id"])
+            if payment_method is None:
+                result = GatewayResult(PaymentStatus.FAILED, error_message="Payment method not found")
+            else:
+                result = _risk_check(intent, payment_method, version) or await gateway.charge(intent, payment_method)
+    except GatewayUnavailableError as e:
+        raise RetryableJobError(str(e))
+
+    try:
+        _apply_gateway_result(intent, result, expected_version=version)
+    except ConcurrentUpdateError:
+        # Another delivery of this job recorded its outcome while we waited on the gateway
+        return
+
+async def abandon_payment_job(job: Dict[str, Any], error: Exception) -> None:
+    """Fail the intent of a job that could not be completed"""
+    intent = _find_intent(job["intent_id"])
+    if intent is not None and intent["status"] == PaymentStatus.PROCESSING:
+        _apply_gateway_result(intent, GatewayResult(PaymentStatus.FAILED, error_message="Payment processing failed"))
+
+# Stand-in for the card processor until a real gateway is integrated
+gateway = StubGateway(
+    latency_seconds=(
+        float(os.getenv("PAYMENT_GATEWAY_MIN_LATENCY_SECONDS", "0.5")),
+        float(os.getenv("PAYMENT_GATEWAY_MAX_LATENCY_SECONDS", "3.0"))
+    ),
+    decline_rate=float(os.getenv("PAYMENT_GATEWAY_DECLINE_RATE", "0.05")),
+    action_rate=float(os.getenv("PAYMENT_GATEWAY_ACTION_RATE", "0.05")),
+    outage_rate=float(os.getenv("PAYMENT_GATEWAY_OUTAGE_RATE", "0.02"))
+)
+
+# Velocity counters scored before every charge, checkpointed so restarts keep the windows
+risk_scorer = RiskScorer(
+    review_score=int(os.getenv("PAYMENT_RISK_REVIEW_SCORE", "50")),
+    block_score=int(os.getenv("PAYMENT_RISK_BLOCK_SCORE", "80")),
+    checkpoint_path=os.getenv(
+        "PAYMENT_RISK_CHECKPOINT", os.path.join(settings.UPLOAD_FOLDER, "risk", "velocity.bin")
+    ),
+    checkpoint_interval_seconds=float(os.getenv("PAYMENT_RISK_CHECKPOINT_INTERVAL_SECONDS", "30"))
+)
+
+# Gateway calls happen in background workers fed from the payment_jobs table
+payment_workers = PaymentWorkerPool(
+    PaymentJobQueue(settings.DATABASE_URL or "sqlite:///./travo.db"),
+    handler=run_payment_job,
+    on_exhausted=abandon_payment_job,
+    concurrency=int(os.getenv("PAYMENT_WORKERS", "4")),
+    max_attempts=int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+)
+
+# Serializes request handlers that read, await and write the same intent
+intent_locks = StripedLocks(int(os.getenv("PAYMENT_LOCK_STRIPES", "1024")))
+
+# Responses to requests sent with an Idempotency-Key, replayed to retries
+idempotency_store = IdempotencyStore(
+    ttl_seconds=float(os.getenv("PAYMENT_IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60))),
+    max_entries=int(os.getenv("PAYMENT_IDEMPOTENCY_MAX_ENTRIES", "100000"))
+)
+
+async def _submit(
+    intent: Dict[str, Any],
+    kind: str,
+    required_status: Optional[PaymentStatus] = None,
+    **changes
+) -> PaymentIntentResponse:
+    async with intent_locks(intent["id"]):
+        if required_status is not None and intent["status"] != required_status:
+            raise InvalidTransitionError(intent["status"], PaymentStatus.PROCESSING)
+        check_transition(intent, PaymentStatus.PROCESSING)
+        previous = dict(intent)
+        transition(intent, PaymentStatus.PROCESSING, error_message=None, next_action=None, **changes)
+        try:
+            await payment_workers.submit(intent["id"], kind, intent["payment_method_id"])
+        except Exception:
+            # Nothing was queued, so the intent must not look like it is being processed
+            version = intent["version"]
+            intent.update(previous)
+            intent["version"] = version + 1
+            raise
         return PaymentIntentResponse(**intent)
-    
-    # Simulate payment processing delay
-    await asyncio.sleep(1)
-    
-    # Simulate payment success/failure (90% success rate)
-    success = random.random() < 0.9
-    
-    # Update intent with result
-    intent["payment_method_id"] = payment_method_id
-    intent["updated_at"] = datetime.utcnow()
-    
-    if success:
-        intent["status"] = PaymentStatus.SUCCEEDED
-        
-        # Create a transaction record
-        transaction_id = f"tx_{len(MOCK_TRANSACTIONS) + 1}"
-        transaction = {
-            "id": transaction_id,
-            "user_id": intent["user_id"],
-            "type": TransactionType.PAYMENT,
-            "amount": intent["amount"],
-            "currency": intent["currency"],
-            "description": intent["description"],
-            "status": PaymentStatus.SUCCEEDED,
-            "payment_method_id": payment_method_id,
-            "payment_intent_id": intent_id,
-            "refund_id": None,
-            "created_at": datetime.utcnow()
-        }
-        MOCK_TRANSACTIONS.append(transaction)
-    else:
-        intent["status"] = PaymentStatus.FAILED
-        intent["error_message"] = "Payment processing failed"
-        
-        # Create a failed transaction record
-        transaction_id = f"tx_{len(MOCK_TRANSACTIONS) + 1}"
-        transaction = {
-            "id": transaction_id,
-            "user_id": intent["user_id"],
-            "type": TransactionType.PAYMENT,
-            "amount": intent["amount"],
-            "currency": intent["currency"],
-            "description": intent["description"],
-            "status": PaymentStatus.FAILED,
-            "payment_method_id": payment_method_id,
-            "payment_intent_id": intent_id,
-            "refund_id": None,
-            "created_at": datetime.utcnow()
-        }
-        MOCK_TRANSACTIONS.append(transaction)
-    
-    # Update the intent in the mock data
-    MOCK_PAYMENT_INTENTS[intent_index] = intent
-    
-    return PaymentIntentResponse(**intent)
 
-async def create_refund(refund_request: RefundRequest) -> RefundResponse:
-    """Create a refund for a payment intent."""
-    # Find the payment intent
-    intent = None
-    for i, pi in enumerate(MOCK_PAYMENT_INTENTS):
-        if pi["id"] == refund_request.payment_intent_id:
-            intent = pi
-            intent_index = i
-            break
-    
+async def submit_payment(intent_id: str, payment_method_id: str) -> Optional[PaymentIntentResponse]:
+    """Queue a payment intent for processing and return it in the processing state.
+
+    The outcome is recorded later by a background worker.
+
+    Raises:
+        ValueError: If the payment method does not exist or belongs to another user
+        InvalidTransitionError: If the intent cannot be processed in its current state
+    """
+    intent = _find_intent(intent_id)
     if not intent:
         return None
-    
-    # Check if the payment was successful
-    if intent["status"] != PaymentStatus.SUCCEEDED:
+
+    payment_method = _find_payment_method(payment_method_id)
+    if not payment_method or payment_method["user_id"] != intent["user_id"]:
+        raise ValueError("Payment method not found")
+
+    return await _submit(intent, JOB_CHARGE, payment_method_id=payment_method_id)
+
+async def confirm_payment(intent_id: str) -> Optional[PaymentIntentResponse]:
+    """Resume an intent waiting on customer authentication.
+
+    Raises:
+        InvalidTransitionError: If the intent is not in requires_action
+    """
+    intent = _find_intent(intent_id)
+    if not intent:
         return None
-    
-    # Determine refund amount
-    refund_amount = refund_request.amount if refund_request.amount else intent["amount"]
-    
-    # Create the refund
-    refund_id = f"rf_{len(MOCK_REFUNDS) + 1}"
+
+    return await _submit(intent, JOB_CONFIRM, required_status=PaymentStatus.REQUIRES_ACTION)
+
+# Refund amounts reserved by requests still waiting on the gateway, by intent ID
+REFUND_RESERVATIONS: Dict[str, float] = {}
+
+# Batch refunds: gateway calls in flight per batch, attempts per item, and refunds per bulk ledger write
+REFUND_BATCH_CONCURRENCY = int(os.getenv("PAYMENT_REFUND_BATCH_CONCURRENCY", "8"))
+REFUND_BATCH_ATTEMPTS = int(os.getenv("PAYMENT_REFUND_BATCH_ATTEMPTS", "3"))
+REFUND_BATCH_BACKOFF_SECONDS = float(os.getenv("PAYMENT_REFUND_BATCH_BACKOFF_SECONDS", "0.5"))
+REFUND_BATCH_LEDGER_WRITE_SIZE = 50
+
+REFUNDABLE_STATUSES = (PaymentStatus.SUCCEEDED, PaymentStatus.PARTIALLY_REFUNDED)
+
+def _refundable_amount(intent: Dict[str, Any]) -> float:
+    """What is left to refund on an intent, net of amounts reserved by refunds in progress"""
+    reserved = REFUND_RESERVATIONS.get(intent["id"], 0.0)
+    return round(intent["amount"] - intent["amount_refunded"] - reserved, 2)
+
+async def _reserve_refund(intent: Dict[str, Any], amount: Optional[float]) -> Optional[float]:
+    """Reserve a refund amount against an intent; the whole remainder if `amount` is None
+
+    Returns:
+        The reserved amount, or None if the intent has not been paid or has less than that left
+    """
+    async with intent_locks(intent["id"]):
+        if intent["status"] not in REFUNDABLE_STATUSES:
+            return None
+        refundable = _refundable_amount(intent)
+        refund_amount = amount if amount else refundable
+        if refund_amount <= 0 or refund_amount > refundable:
+            return None
+        REFUND_RESERVATIONS[intent["id"]] = REFUND_RESERVATIONS.get(intent["id"], 0.0) + refund_amount
+        return refund_amount
+
+def _release_refund(intent: Dict[str, Any], amount: float) -> None:
+    """Drop a reservation; call with the intent's lock held"""
+    remaining = round(REFUND_RESERVATIONS.pop(intent["id"]) - amount, 2)
+    if remaining > 0:
+        REFUND_RESERVATIONS[intent["id"]] = remaining
+
+async def _refund_reserved(
+    intent: Dict[str, Any],
+    amount: float,
+    reason: Optional[str]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Refund a reserved amount through the gateway and record it on the intent
+
+    Returns:
+        The refund and its ledger transaction, for the caller to store
+
+    Raises:
+        GatewayUnavailableError: If the gateway could not be reached; the reservation is released
+    """
+    lock = intent_locks(intent["id"])
+    # The lock is not held across the gateway call
+    try:
+        await gateway.refund(intent, amount)
+    except Exception:
+        async with lock:
+            _release_refund(intent, amount)
+        raise
+
+    async with lock:
+        _release_refund(intent, amount)
+        amount_refunded = round(intent["amount_refunded"] + amount, 2)
+        if amount_refunded >= intent["amount"]:
+            transition(intent, PaymentStatus.REFUNDED, amount_refunded=amount_refunded)
+        else:
+            transition(intent, PaymentStatus.PARTIALLY_REFUNDED, amount_refunded=amount_refunded)
+
     refund = {
-        "id": refund_id,
-        "payment_intent_id": refund_request.payment_intent_id,
-        "amount": refund_amount,
+        "id": generate_refund_id(),
+        "payment_intent_id": intent["id"],
+        "amount": amount,
         "status": PaymentStatus.SUCCEEDED,
-        "reason": refund_request.reason,
+        "reason": reason,
         "created_at": datetime.utcnow()
     }
-    
-    # Add to mock data
-    MOCK_REFUNDS.append(refund)
-    
-    # Update the payment intent status
-    if refund_amount == intent["amount"]:
-        intent["status"] = PaymentStatus.REFUNDED
-    else:
-        intent["status"] = PaymentStatus.PARTIALLY_REFUNDED
-    
-    intent["updated_at"] = datetime.utcnow()
-    MOCK_PAYMENT_INTENTS[intent_index] = intent
-    
-    # Create a transaction record for the refund
-    transaction_id = f"tx_{len(MOCK_TRANSACTIONS) + 1}"
     transaction = {
-        "id": transaction_id,
         "user_id": intent["user_id"],
         "type": TransactionType.REFUND,
-        "amount": refund_amount,
+        "amount": amount,
         "currency": intent["currency"],
         "description": f"Refund for {intent['description']}",
         "status": PaymentStatus.SUCCEEDED,
         "payment_method_id": intent["payment_method_id"],
         "payment_intent_id": intent["id"],
-        "refund_id": refund_id,
-        "created_at": datetime.utcnow()
+        "refund_id": refund["id"],
+        "created_at": refund["created_at"]
     }
-    MOCK_TRANSACTIONS.append(transaction)
+    return refund, transaction
+
+async def create_refund(refund_request: RefundRequest) -> Optional[RefundResponse]:
+    """Create a refund for a payment intent.
+
+    The amount is reserved against the intent before the gateway is called,
+    so concurrent refunds can never return more than was paid. Returns None
+    if the intent does not exist, has not been paid or has less than the
+    requested amount left to refund.
+
+    Raises:
+        GatewayUnavailableError: If the gateway could not be reached; nothing was refunded
+    """
+    # Find the payment intent
+    intent = _find_intent(refund_request.payment_intent_id)
+    if not intent:
+        return None
+    
+    refund_amount = await _reserve_refund(intent, refund_request.amount)
+    if refund_amount is None:
+        return None
+    
+    refund, transaction = await _refund_reserved(intent, refund_amount, refund_request.reason)
+    MOCK_REFUNDS.append(refund)
+    transaction_ledger.append(transaction)
     
     # Convert to response model
     return RefundResponse(**refund)
 
+def _validate_refund_batch(
+    refund_requests: List[RefundRequest]
+) -> Tuple[List[Tuple[int, Dict[str, Any], float, Optional[str]]], List[BatchRefundResult]]:
+    """Check every item of a batch in one pass over the intent index
+
+    Items for the same intent are checked against what the earlier items
+    already claim, so a batch can never ask for more than is left.
+
+    Returns:
+        (index, intent, amount, reason) of the accepted items, and results for the rejected ones
+    """
+    accepted = []
+    rejected = []
+    claimed: Dict[str, float] = {}
+    for index, item in enumerate(refund_requests):
+        intent = INTENTS_BY_ID.get(item.payment_intent_id)
+        if intent is None:
+            error = "Payment intent not found"
+        elif intent["status"] not in REFUNDABLE_STATUSES:
+            error = "Payment cannot be refunded"
+        else:
+            refundable = round(_refundable_amount(intent) - claimed.get(intent["id"], 0.0), 2)
+            amount = item.amount if item.amount else refundable
+            if refundable <= 0:
+                error = "Nothing left to refund"
+            elif amount <= 0 or amount > refundable:
+                error = "Refund amount exceeds the refundable amount"
+            else:
+                claimed[intent["id"]] = claimed.get(intent["id"], 0.0) + amount
+                accepted.append((index, intent, amount, item.reason))
+                continue
+        rejected.append(BatchRefundResult(
+            index=index, payment_intent_id=item.payment_intent_id, status=BatchRefundStatus.REJECTED, error=error
+        ))
+    return accepted, rejected
+
+async def _refund_batch_item(
+    index: int,
+    intent: Dict[str, Any],
+    amount: float,
+    reason: Optional[str]
+) -> Tuple[BatchRefundResult, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Refund one accepted batch item, retrying while the gateway is unavailable"""
+    result = BatchRefundResult(index=index, payment_intent_id=intent["id"], status=BatchRefundStatus.FAILED)
+    # Reserved again: the intent may have changed since the batch was validated
+    if await _reserve_refund(intent, amount) is None:
+        result.status = BatchRefundStatus.REJECTED
+        result.error = "Payment cannot be refunded"
+        return result, None, None
+
+    for attempt in range(REFUND_BATCH_ATTEMPTS):
+        try:
+            refund, transaction = await _refund_reserved(intent, amount, reason)
+        except GatewayUnavailableError as e:
+            result.error = str(e)
+            if attempt + 1 == REFUND_BATCH_ATTEMPTS or await _reserve_refund(intent, amount) is None:
+                return result, None, None
+            await asyncio.sleep(REFUND_BATCH_BACKOFF_SECONDS * 2 ** attempt)
+            continue
+        result.status = BatchRefundStatus.SUCCEEDED
+        result.error = None
+        result.refund = RefundResponse(**refund)
+        return result, refund, transaction
+    return result, None, None
+
+async def _run_refund_batch(
+    accepted: List[Tuple[int, Dict[str, Any], float, Optional[str]]],
+    results: "asyncio.Queue[BatchRefundResult]",
+    concurrency: int
+) -> None:
+    gate = asyncio.Semaphore(concurrency)
+    refunds: List[Dict[str, Any]] = []
+    transactions: List[Dict[str, Any]] = []
+
+    def flush() -> None:
+        # Refunds reach the ledger in bulk rather than one append per item
+        MOCK_REFUNDS.extend(refunds)
+        transaction_ledger.extend(transactions)
+        refunds.clear()
+        transactions.clear()
+
+    async def run(index: int, intent: Dict[str, Any], amount: float, reason: Optional[str]):
+        async with gate:
+            try:
+                return await _refund_batch_item(index, intent, amount, reason)
+            except Exception as e:
+                return BatchRefundResult(
+                    index=index, payment_intent_id=intent["id"], status=BatchRefundStatus.FAILED, error=str(e)
+                ), None, None
+
+    try:
+        for finished in asyncio.as_completed([run(*item) for item in accepted]):
+            result, refund, transaction = await finished
+            if refund is not None:
+                refunds.append(refund)
+                transactions.append(transaction)
+                if len(transactions) >= REFUND_BATCH_LEDGER_WRITE_SIZE:
+                    flush()
+            await results.put(result)
+    finally:
+        flush()
+
+# Batches still running; a client that stops reading doesn't stop its refunds
+REFUND_BATCHES: Set[asyncio.Task] = set()
+
+async def create_refund_batch(
+    refund_requests: List[RefundRequest],
+    concurrency: Optional[int] = None
+) -> AsyncIterator[BatchRefundResult]:
+    """Refund many intents at once, with results as each one completes.
+
+    Every item is validated before any is sent to the gateway; rejected
+    items are reported first. Accepted items are refunded with at most
+    `concurrency` gateway calls in flight, independently of whether the
+    caller keeps reading the results.
+    """
+    accepted, rejected = _validate_refund_batch(refund_requests)
+    results: "asyncio.Queue[BatchRefundResult]" = asyncio.Queue()
+    task = asyncio.create_task(_run_refund_batch(accepted, results, concurrency or REFUND_BATCH_CONCURRENCY))
+    REFUND_BATCHES.add(task)
+    task.add_done_callback(REFUND_BATCHES.discard)
+
+    async def stream() -> AsyncIterator[BatchRefundResult]:
+        for result in rejected:
+            yield result
+        for _ in accepted:
+            yield await results.get()
+
+    return stream()
+
 async def get_transactions(
     user_id: str,
-    transaction_type: Optional[str] = None,
+    transaction_type: Optional[TransactionType] = None,
     limit: int = 10,
-    offset: int = 0
-) -> List[TransactionResponse]:
-    """Get transaction history for a user."""
-    # Filter transactions by user ID and type
-    filtered_transactions = [tx for tx in MOCK_TRANSACTIONS if tx["user_id"] == user_id]
-    
-    if transaction_type:
-        filtered_transactions = [tx for tx in filtered_transactions if tx["type"].value == transaction_type]
-    
-    # Sort by date (newest first)
-    filtered_transactions.sort(key=lambda x: x["created_at"], reverse=True)
-    
-    # Apply pagination
-    paginated_transactions = filtered_transactions[offset:offset + limit]
-    
-    # Convert to response models
-    result = []
-    for tx in paginated_transactions:
-        result.append(TransactionResponse(**tx))
-    
-    return result
+    cursor: Optional[str] = None
+) -> Tuple[List[TransactionResponse], Optional[str]]:
+    """Get a page of a user's transaction history, newest first.
+
+    Returns:
+        The transactions and the cursor of the next page, None on the last page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    transactions, next_cursor = transaction_ledger.page(user_id, transaction_type, limit, cursor)
+    return [TransactionResponse(**tx) for tx in transactions], next_cursor
+
+async def export_transactions(
+    user_id: str,
+    export_format: ExportFormat,
+    transaction_type: Optional[TransactionType] = None,
+    compress: bool = False,
+    batch_size: int = 500
+) -> AsyncIterator[bytes]:
+    """Stream a user's whole transaction history, newest first, as CSV or NDJSON.
+
+    Rows are read from the ledger a batch at a time and encoded (and
+    gzip-compressed if `compress`) as they go.
+    """
+    async def encoded() -> AsyncIterator[bytes]:
+        for text in encode_batches(transaction_ledger.scan(user_id, transaction_type, batch_size), export_format):
+            yield text.encode("utf-8")
+            # A long export must not hold up the requests sharing the event loop
+            await asyncio.sleep(0)
+
+    return gzip_chunks(encoded()) if compress else encoded()
+
+async def get_transaction_stats(user_id: str, currency: str = BASE_CURRENCY) -> TransactionStatsResponse:
+    """Get totals in a currency, success rate and balances of a user's transactions.
+
+    Raises:
+        UnknownCurrencyError: If there is no exchange rate for the currency
+    """
+    return TransactionStatsResponse(**transaction_ledger.stats(user_id, currency.upper()))
@@ -1,10 +1,13 @@
-import uuid
 import re
+import hmac
 import hashlib
 from datetime import datetime, date
 from typing import Dict, Any, List, Optional, Tuple
 import random
 
+from utils.ids import generate_id
+from utils.fx import BASE_CURRENCY, UnknownCurrencyError, convert, minor_units, round_amount, total_in
+
 # Credit card validation patterns
 CARD_PATTERNS = {
     "visa": r"^4[0-9]{12}(?:[0-9]{3})?$",
@@ -15,19 +18,24 @@ CARD_PATTERNS = {
 
 def generate_payment_method_id() -> str:
     """Generate a unique ID for a payment method."""
-    return f"pm_{uuid.uuid4().hex[:8]}"
+    return generate_id("pm_")
 
 def generate_payment_intent_id() -> str:
     """Generate a unique ID for a payment intent."""
-    return f"pi_{uuid.uuid4().hex[:8]}"
+    return generate_id("pi_")
 
 def generate_refund_id() -> str:
     """Generate a unique ID for a refund."""
-    return f"rf_{uuid.uuid4().hex[:8]}"
+    return generate_id("rf_")
 
 def generate_transaction_id() -> str:
     """Generate a unique ID for a transaction."""
-    return f"tx_{uuid.uuid4().hex[:8]}"
+    return generate_id("tx_")
+
+def card_fingerprint(card_number: str, key: str) -> str:
+    """Keyed digest of a card number, the same for every payment method created from the card."""
+    digits = re.sub(r'\D', '', card_number)
+    return hmac.new(key.encode("utf-8"), digits.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
 
 def validate_credit_card(card_number: str) -> Tuple[bool, Optional[str]]:
     """Validate a credit card number and return its type."""
@@ -99,20 +107,19 @@ def validate_expiry_date(exp_month: int, exp_year: int) -> bool:
     
     return True
 
-def calculate_transaction_stats(transactions: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Calculate statistics for a list of transactions."""
+def calculate_transaction_stats(transactions: List[Dict[str, Any]], currency: str = BASE_CURRENCY) -> Dict[str, Any]:
+    """Calculate statistics for a list of transactions, with totals converted to `currency`."""
     if not transactions:
         return {
             "total_count": 0,
             "total_amount": 0,
             "average_amount": 0,
             "success_rate": 0,
+            "currency": currency,
             "currency_breakdown": {}
         }
     
     total_count = len(transactions)
-    total_amount = sum(tx["amount"] for tx in transactions)
-    average_amount = total_amount / total_count if total_count > 0 else 0
     
     # Count successful transactions
     successful = sum(1 for tx in transactions if tx["status"].value == "succeeded")
@@ -121,21 +128,28 @@ def calculate_transaction_stats(transactions: List[Dict[str, Any]]) -> Dict[str,
     # Group by currency
     currency_breakdown = {}
     for tx in transactions:
-        currency = tx["currency"]
-        if currency not in currency_breakdown:
-            currency_breakdown[currency] = {
+        tx_currency = tx["currency"]
+        if tx_currency not in currency_breakdown:
+            currency_breakdown[tx_currency] = {
                 "count": 0,
                 "total_amount": 0
             }
         
-        currency_breakdown[currency]["count"] += 1
-        currency_breakdown[currency]["total_amount"] += tx["amount"]
+        currency_breakdown[tx_currency]["count"] += 1
+        currency_breakdown[tx_currency]["total_amount"] += tx["amount"]
+    
+    # Amounts in different currencies only add up once converted
+    total_amount = total_in(
+        ((tx_currency, totals["total_amount"]) for tx_currency, totals in currency_breakdown.items()), currency
+    )
+    average_amount = total_amount / total_count if total_count > 0 else 0
     
     return {
         "total_count": total_count,
         "total_amount": total_amount,
         "average_amount": average_amount,
         "success_rate": success_rate,
+        "currency": currency,
         "currency_breakdown": currency_breakdown
     }
 
@@ -173,11 +187,8 @@ def format_currency(amount: float, currency: str = "USD") -> str:
     
     symbol = currency_symbols.get(currency, currency)
     
-    # Format with 2 decimal places, except for JPY
-    if currency == "JPY":
-        return f"{symbol}{int(amount):,}"
-    else:
-        return f"{symbol}{amount:,.2f}"
+    # As many decimals as the currency has minor units: none for JPY, three for KWD
+    return f"{symbol}{round_amount(amount, currency):,.{minor_units(currency)}f}"
 
 def calculate_refund_amount(original_amount: float, refund_percentage: float) -> float:
     """Calculate refund amount based on percentage."""
@@ -196,6 +207,12 @@ def is_valid_payment_amount(amount: float, currency: str) -> bool:
         "JPY": 50
     }
     
-    min_amount = min_amounts.get(currency, 0.50)
+    min_amount = min_amounts.get(currency)
+    if min_amount is None:
+        # Other currencies: the equivalent of the USD minimum
+        try:
+            min_amount = convert(min_amounts["USD"], "USD", currency)
+        except UnknownCurrencyError:
+            min_amount = 0.50
     
     return amount >= min_amount
@@ -1,10 +1,11 @@
-import uuid
 import random
 import math
 from typing import List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime, timedelta
 import re
 
+from utils.ids import generate_id
+
 from .schemas import (
     RecommendationCategory, Season, BudgetLevel, Location,
     TravelHistoryItem, UserPreference
@@ -13,22 +14,22 @@ from .schemas import (
 
 def generate_destination_id() -> str:
     """Generate a unique ID for a destination."""
-    return f"dest-{uuid.uuid4().hex[:8]}"
+    return generate_id("dest-")
 
 
 def generate_attraction_id() -> str:
     """Generate a unique ID for an attraction."""
-    return f"attr-{uuid.uuid4().hex[:8]}"
+    return generate_id("attr-")
 
 
 def generate_itinerary_id() -> str:
     """Generate a unique ID for an itinerary."""
-    return f"itin-{uuid.uuid4().hex[:8]}"
+    return generate_id("itin-")
 
 
 def generate_recommendation_log_id() -> str:
     """Generate a unique ID for a recommendation log."""
-    return f"reclog-{uuid.uuid4().hex[:8]}"
+    return generate_id("reclog-")
 
 
 def calculate_similarity(item1: Dict[str, Any], item2: Dict[str, Any], features: List[str]) -> float:
@@ -0,0 +1,105 @@
+import io
+import math
+from typing import Dict, List, Optional, Tuple, Iterable
+
+from PIL import Image
+
+from .utils import get_monument_distance
+
+# EXIF tag holding the GPS IFD, and the tags inside it
+GPS_IFD_TAG = 0x8825
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+KM_PER_DEGREE_LATITUDE = 111.32
+
+
+def _dms_to_degrees(dms, ref: str) -> float:
+    """Convert an EXIF (degrees, minutes, seconds) triple to signed decimal degrees"""
+    degrees, minutes, seconds = (float(value) for value in dms)
+    decimal = degrees + minutes / 60.0 + seconds / 3600.0
+    return -decimal if ref in ("S", "W") else decimal
+
+
+def extract_gps_location(image_content: bytes) -> Optional[Dict[str, float]]:
+    """Read the GPS position from an image's EXIF metadata
+
+    Returns:
+        {"latitude": ..., "longitude": ...} or None if the image has no usable GPS data
+    """
+    try:
+        with Image.open(io.BytesIO(image_content)) as image:
+            gps = image.getexif().get_ifd(GPS_IFD_TAG)
+    except Exception:
+        return None
+
+    if not gps or GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+        return None
+
+    try:
+        latitude = _dms_to_degrees(gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF, "N"))
+        longitude = _dms_to_degrees(gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF, "E"))
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+
+    return {"latitude": latitude, "longitude": longitude}
+
+
+class GeoIndex:
+    """Grid index over monument coordinates for radius queries
+
+    Monuments are bucketed into cells of cell_degrees x cell_degrees, so a
+    radius query only measures distances to monuments in the handful of cells
+    overlapping the query's bounding box.
+    """
+
+    def __init__(self, cell_degrees: float = 1.0):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], List[Tuple[str, float, float]]] = {}
+        self._lon_cells = int(math.ceil(360.0 / cell_degrees))
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (
+            int(math.floor(latitude / self.cell_degrees)),
+            int(math.floor((longitude + 180.0) / self.cell_degrees)) % self._lon_cells
+        )
+
+    def add(self, monument_id: str, latitude: float, longitude: float) -> None:
+        """Add a monument at the given coordinates"""
+        self._cells.setdefault(self._cell(latitude, longitude), []).append((monument_id, latitude, longitude))
+
+    def query(self, latitude: float, longitude: float, radius_km: float) -> List[Tuple[str, float]]:
+        """Return (monument_id, distance_km) for monuments within radius_km, nearest first"""
+        lat_span = radius_km / KM_PER_DEGREE_LATITUDE
+        lat_min = max(-90.0, latitude - lat_span)
+        lat_max = min(90.0, latitude + lat_span)
+
+        # Longitude degrees shrink towards the poles; near them scan every column
+        widest = max(abs(lat_min), abs(lat_max))
+        cos_lat = math.cos(math.radians(widest)) if widest < 90 else 0.0
+        if cos_lat * 180.0 * KM_PER_DEGREE_LATITUDE <= radius_km:
+            lon_columns: Iterable[int] = range(self._lon_cells)
+        else:
+            lon_span = radius_km / (KM_PER_DEGREE_LATITUDE * cos_lat)
+            first = int(math.floor((longitude - lon_span + 180.0) / self.cell_degrees))
+            last = int(math.floor((longitude + lon_span + 180.0) / self.cell_degrees))
+            lon_columns = {column % self._lon_cells for column in range(first, last + 1)}
+
+        first_row = int(math.floor(lat_min / self.cell_degrees))
+        last_row = int(math.floor(lat_max / self.cell_degrees))
+
+        matches = []
+        for row in range(first_row, last_row + 1):
+            for column in lon_columns:
+                for monument_id, lat, lon in self._cells.get((row, column), ()):
+                    distance = get_monument_distance(latitude, longitude, lat, lon)
+                    if distance <= radius_km:
+                        matches.append((monument_id, distance))
+
+        matches.sort(key=lambda match: match[1])
+        return matches
@@ -0,0 +1,360 @@
+import os
+import json
+import argparse
+from typing import List, Dict, Optional, Tuple, Iterable
+
+import cv2
+import numpy as np
+
+# Size of the global descriptor produced by extract_descriptor
+COLOR_BINS = (8, 4, 4)  # Hue, saturation, value
+GRADIENT_CELLS = 4  # The thumbnail is split into GRADIENT_CELLS x GRADIENT_CELLS cells
+GRADIENT_BINS = 8  # Orientation bins per cell
+DESCRIPTOR_DIM = int(np.prod(COLOR_BINS)) + GRADIENT_CELLS * GRADIENT_CELLS * GRADIENT_BINS
+
+# Above this many reference descriptors the index switches from an exhaustive
+# scan to an inverted-file (IVF) search over coarse clusters
+IVF_THRESHOLD = 100_000
+IVF_PROBES = 8
+
+# Files making up an index directory on disk
+VECTORS_FILE = "vectors.npy"
+LABELS_FILE = "labels.json"
+CENTROIDS_FILE = "centroids.npy"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def extract_descriptor(image: np.ndarray) -> np.ndarray:
+    """Compute an L2-normalized global descriptor for a BGR image
+
+    The descriptor concatenates an HSV color histogram with a coarse grid of
+    gradient orientation histograms, which is cheap to compute and stable
+    enough to rank reference photos of the same monument together.
+
+    Args:
+        image: BGR image as returned by cv2.imread / cv2.imdecode
+
+    Returns:
+        float32 vector of length DESCRIPTOR_DIM
+    """
+    image = cv2.resize(image, (224, 224))
+
+    # Color distribution
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    color_hist = cv2.calcHist([hsv], [0, 1, 2], None, list(COLOR_BINS), [0, 180, 0, 256, 0, 256])
+    color_hist = color_hist.ravel()
+    color_hist /= color_hist.sum() + 1e-6
+
+    # Shape: magnitude-weighted gradient orientations per grid cell
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude, angle = cv2.cartToPolar(gx, gy)
+    orientation_bin = (angle * (GRADIENT_BINS / (2 * np.pi))).astype(np.int32) % GRADIENT_BINS
+
+    cell = 224 // GRADIENT_CELLS
+    rows = np.arange(224) // cell
+    cell_index = rows[:, None] * GRADIENT_CELLS + rows[None, :]
+    flat_bins = (cell_index * GRADIENT_BINS + orientation_bin).ravel()
+    gradient_hist = np.bincount(
+        flat_bins,
+        weights=magnitude.ravel(),
+        minlength=GRADIENT_CELLS * GRADIENT_CELLS * GRADIENT_BINS
+    ).astype(np.float32)
+    gradient_hist /= gradient_hist.sum() + 1e-6
+
+    descriptor = np.concatenate([color_hist, gradient_hist]).astype(np.float32)
+    return normalize(descriptor)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector or each row of a matrix"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means used to train the coarse quantizer of the IVF index"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assignments == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = normalize(centroids)
+
+    return centroids
+
+
+class DescriptorIndex:
+    """Nearest-neighbour index over reference descriptors of known monuments
+
+    Descriptors live in a single contiguous float32 matrix (optionally
+    memory-mapped from disk) with one monument id per row. Small catalogs are
+    searched exhaustively with one matrix-vector product; once the catalog
+    grows past IVF_THRESHOLD rows the index clusters the descriptors and only
+    scans the IVF_PROBES clusters closest to the query.
+
+    Adding a monument only appends rows: new rows are assigned to their
+    nearest existing cluster, so the coarse quantizer never has to be retrained.
+    """
+
+    def __init__(self, dim: int = DESCRIPTOR_DIM):
+        self.dim = dim
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self.labels: List[str] = []
+        self._rows_by_label: Dict[str, List[int]] = {}
+
+        # Inverted file state (only populated once the index is large enough)
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._pending: List[List[int]] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self._size]
+
+    def add(self, vectors: np.ndarray, labels: List[str]) -> None:
+        """Append reference descriptors and their monument ids"""
+        vectors = normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected descriptors of dimension {self.dim}, got {vectors.shape[1]}")
+        if len(vectors) != len(labels):
+            raise ValueError("Each descriptor needs exactly one label")
+
+        start = self._size
+        end = start + len(vectors)
+
+        # Grow the backing buffer geometrically so repeated appends stay cheap.
+        # A memory-mapped buffer is read-only, so the first append copies it.
+        if end > len(self._vectors) or not self._vectors.flags.writeable:
+            capacity = max(end, 2 * len(self._vectors), 1024)
+            buffer = np.empty((capacity, self.dim), dtype=np.float32)
+            buffer[:start] = self._vectors[:start]
+            self._vectors = buffer
+
+        self._vectors[start:end] = vectors
+        self._size = end
+        self.labels.extend(labels)
+        for row, label in enumerate(labels, start):
+            self._rows_by_label.setdefault(label, []).append(row)
+
+        if self.centroids is not None:
+            assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+            for offset, c in enumerate(assignments):
+                self._pending[c].append(start + offset)
+        elif self._size > IVF_THRESHOLD:
+            self.build_ivf()
+
+    def build_ivf(self, nlist: Optional[int] = None, sample_size: int = 50_000) -> None:
+        """Cluster the reference descriptors into inverted lists"""
+        if nlist is None:
+            nlist = int(np.sqrt(self._size))
+        nlist = max(1, min(nlist, self._size))
+
+        vectors = self.vectors
+        if self._size > sample_size:
+            sample = vectors[np.random.default_rng(0).choice(self._size, size=sample_size, replace=False)]
+        else:
+            sample = np.asarray(vectors)
+
+        self.centroids = kmeans(sample, nlist)
+        self._assign_lists()
+
+    def _assign_lists(self) -> None:
+        # Assign in chunks to keep the score matrix small for large catalogs
+        assignments = np.empty(self._size, dtype=np.int32)
+        for start in range(0, self._size, 65_536):
+            chunk = self.vectors[start:start + 65_536]
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+
+        # Store each inverted list as a contiguous array of row ids
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        self._pending = [[] for _ in range(len(self.centroids))]
+
+    def _probe_rows(self, query: np.ndarray, probes: int) -> np.ndarray:
+        centroid_scores = self.centroids @ query
+        probes = min(probes, len(self.centroids))
+        nearest = np.argpartition(-centroid_scores, probes - 1)[:probes]
+
+        rows = []
+        for c in nearest:
+            rows.append(self._lists[c])
+            if self._pending[c]:
+                rows.append(np.asarray(self._pending[c], dtype=np.int64))
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def search(
+        self,
+        descriptor: np.ndarray,
+        k: int = 10,
+        probes: int = IVF_PROBES,
+        candidates: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Return up to k (monument_id, similarity) pairs, best first
+
+        Each monument appears at most once, scored by its closest reference.
+        When candidates is given, only references of those monuments are scored.
+        """
+        if self._size == 0:
+            return []
+
+        query = normalize(np.asarray(descriptor, dtype=np.float32))
+
+        if candidates is not None:
+            row_lists = [self._rows_by_label[label] for label in candidates if label in self._rows_by_label]
+            if not row_lists:
+                return []
+            rows = np.fromiter((row for row_list in row_lists for row in row_list), dtype=np.int64)
+            scores = self.vectors[rows] @ query
+        elif self.centroids is not None:
+            rows = self._probe_rows(query, probes)
+            scores = self.vectors[rows] @ query
+        else:
+            rows = None
+            scores = self.vectors @ query
+
+        return self._top_labels(scores, rows, k)
+
+    def search_batch(self, descriptors: np.ndarray, k: int = 10, probes: int = IVF_PROBES) -> List[List[Tuple[str, float]]]:
+        """Search several descriptors at once
+
+        Without an inverted file the whole batch is scored with a single
+        matrix product, which is much faster than one search per image.
+        """
+        queries = normalize(np.atleast_2d(np.asarray(descriptors, dtype=np.float32)))
+        if self._size == 0:
+            return [[] for _ in range(len(queries))]
+
+        if self.centroids is not None:
+            return [self.search(query, k=k, probes=probes) for query in queries]
+
+        scores = self.vectors @ queries.T
+        return [self._top_labels(scores[:, b], None, k) for b in range(len(queries))]
+
+    def _top_labels(self, scores: np.ndarray, rows: Optional[np.ndarray], k: int) -> List[Tuple[str, float]]:
+        # Take a few extra neighbours so duplicates of one monument do not crowd out others
+        top = min(len(scores), k * 4)
+        if top == 0:
+            return []
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        seen = set()
+        for i in best:
+            row = rows[i] if rows is not None else i
+            label = self.labels[row]
+            if label in seen:
+                continue
+            seen.add(label)
+            results.append((label, float(scores[i])))
+            if len(results) == k:
+                break
+
+        return results
+
+    def save(self, index_dir: str) -> None:
+        """Write the index to a directory"""
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, VECTORS_FILE), np.ascontiguousarray(self.vectors))
+        with open(os.path.join(index_dir, LABELS_FILE), "w") as f:
+            json.dump(self.labels, f)
+        centroids_path = os.path.join(index_dir, CENTROIDS_FILE)
+        if self.centroids is not None:
+            np.save(centroids_path, self.centroids)
+        elif os.path.exists(centroids_path):
+            os.unlink(centroids_path)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> "DescriptorIndex":
+        """Load an index written by save, memory-mapping the vectors by default"""
+        vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r" if mmap else None)
+        with open(os.path.join(index_dir, LABELS_FILE), "r") as f:
+            labels = json.load(f)
+
+        index = cls(dim=vectors.shape[1])
+        index._vectors = vectors
+        index._size = len(vectors)
+        index.labels = labels
+        for row, label in enumerate(labels):
+            index._rows_by_label.setdefault(label, []).append(row)
+
+        centroids_path = os.path.join(index_dir, CENTROIDS_FILE)
+        if os.path.exists(centroids_path):
+            index.centroids = np.load(centroids_path)
+            index._assign_lists()
+
+        return index
+
+
+def iter_reference_images(reference_dir: str):
+    """Yield (monument_id, image_path) for a directory of reference photos
+
+    The expected layout is one subdirectory per monument id:
+    reference_dir/<monument_id>/<photo>.jpg
+    """
+    for monument_id in sorted(os.listdir(reference_dir)):
+        monument_dir = os.path.join(reference_dir, monument_id)
+        if not os.path.isdir(monument_dir):
+            continue
+        for filename in sorted(os.listdir(monument_dir)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield monument_id, os.path.join(monument_dir, filename)
+
+
+def build_index(reference_dir: str, index_dir: str, append: bool = False) -> DescriptorIndex:
+    """Offline pipeline: extract descriptors from reference photos and save the index
+
+    With append=True, an existing index in index_dir is extended with the new
+    references instead of being rebuilt.
+    """
+    if append and os.path.exists(os.path.join(index_dir, VECTORS_FILE)):
+        index = DescriptorIndex.load(index_dir, mmap=False)
+    else:
+        index = DescriptorIndex()
+
+    batch_vectors = []
+    batch_labels = []
+    for monument_id, image_path in iter_reference_images(reference_dir):
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        batch_vectors.append(extract_descriptor(image))
+        batch_labels.append(monument_id)
+
+        if len(batch_vectors) == 1024:
+            index.add(np.stack(batch_vectors), batch_labels)
+            batch_vectors, batch_labels = [], []
+
+    if batch_vectors:
+        index.add(np.stack(batch_vectors), batch_labels)
+
+    index.save(index_dir)
+    return index
+
+
+def main():
+    """Build or extend a reference descriptor index from the command line."""
+    parser = argparse.ArgumentParser(description="Build the TRAVO monument descriptor index")
+    parser.add_argument("reference_dir", help="Directory with one subdirectory of photos per monument id")
+    parser.add_argument("index_dir", help="Directory to write the index to")
+    parser.add_argument("--append", action="store_true", help="Extend an existing index instead of rebuilding it")
+
+    args = parser.parse_args()
+    index = build_index(args.reference_dir, args.index_dir, append=args.append)
+    print(f"Indexed {len(index)} reference images of {len(set(index.labels))} monuments")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,29 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 import os
+import json
 import tempfile
-import shutil
+
+from utils.image_store import image_store, ImageTooLargeError
 
 # Import schemas and service logic
-from .schemas import MonumentDetectionResponse, MonumentInfo, MonumentIdentificationResponse
-from .service_logic import detect_monuments, get_monument_info, identify_monument
+from .schemas import MonumentDetectionResponse, MonumentInfo, MonumentIdentificationResponse, VideoIdentificationResponse
+from .service_logic import (
+    detect_monuments,
+    get_monument_info,
+    identify_monument,
+    identify_monuments_batch,
+    identify_monuments_in_video,
+    create_frame_stream_recognizer,
+    process_stream_frame,
+    MAX_BATCH_IMAGES,
+    MAX_BATCH_IMAGE_BYTES,
+    MAX_BATCH_TOTAL_BYTES,
+    MAX_VIDEO_BYTES
+)
+from .utils import build_location
 
 # Create router
 router = APIRouter()
@@ -20,7 +37,9 @@ async def test_vision_service():
 @router.post("/detect", response_model=MonumentDetectionResponse)
 async def detect_monuments_in_image(
     image: UploadFile = File(...),
-    confidence_threshold: Optional[float] = 0.5
+    confidence_threshold: Optional[float] = 0.5,
+    latitude: Optional[float] = Form(None),
+    longitude: Optional[float] = Form(None)
 ):
     # Validate file type
     if not image.content_type.startswith('image/'):
@@ -32,8 +51,22 @@ async def detect_monuments_in_image(
     # Read image content
     image_content = await image.read()
     
+    # Keep the upload in the content-addressed store; its digest identifies the image
+    try:
+        stored = await run_in_threadpool(image_store.save_bytes, image_content)
+    except ImageTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    
     # Call monument detection function
-    detection_result = await detect_monuments(image_content, confidence_threshold)
+    detection_result = await detect_monuments(
+        image_content,
+        confidence_threshold,
+        location=build_location(latitude, longitude),
+        image_id=stored["digest"]
+    )
     
     return detection_result
 
@@ -53,7 +86,11 @@ async def get_monument_details(monument_id: str):
 
 # Identify monument in an uploaded image
 @router.post("/identify", response_model=MonumentIdentificationResponse)
-async def identify_monument_in_image(image: UploadFile = File(...)):
+async def identify_monument_in_image(
+    image: UploadFile = File(...),
+    latitude: Optional[float] = Form(None),
+    longitude: Optional[float] = Form(None)
+):
     # Validate file type
     if not image.content_type.startswith('image/'):
         raise HTTPException(
@@ -61,22 +98,173 @@ async def identify_monument_in_image(image: UploadFile = File(...)):
             detail="File must be an image"
         )
     
-    # Create a temporary file to store the uploaded image
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-        # Copy the uploaded file to the temporary file
-        shutil.copyfileobj(image.file, temp_file)
-        temp_file_path = temp_file.name
+    # Stream the upload into the content-addressed store; identical photos are stored once
+    try:
+        stored = await run_in_threadpool(image_store.save_fileobj, image.file)
+    except ImageTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
     
     try:
-        # Call the identify_monument function
-        result = identify_monument(temp_file_path)
+        # Feature extraction and index search are CPU-bound; keep them off the event loop
+        result = await run_in_threadpool(
+            identify_monument,
+            image_store.original_path(stored["digest"]),
+            location=build_location(latitude, longitude)
+        )
         return result
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error identifying monument: {str(e)}"
         )
+
+
+def _batch_too_large(filename: Optional[str]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=(
+            f"File {filename} is too large: images may be at most {MAX_BATCH_IMAGE_BYTES} bytes "
+            f"and {MAX_BATCH_TOTAL_BYTES} bytes together"
+        )
+    )
+
+
+# Identify monuments in a batch of uploaded images (e.g. a whole album)
+@router.post("/identify/batch")
+async def identify_monuments_in_images(
+    images: List[UploadFile] = File(...),
+    latitude: Optional[float] = Form(None),
+    longitude: Optional[float] = Form(None)
+):
+    if len(images) > MAX_BATCH_IMAGES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BATCH_IMAGES} images can be identified in one request"
+        )
+    
+    # Validate file types and declared sizes before reading anything
+    total_size = 0
+    for image in images:
+        if not image.content_type or not image.content_type.startswith('image/'):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"File {image.filename} must be an image"
+            )
+        total_size += image.size or 0
+        if (image.size or 0) > MAX_BATCH_IMAGE_BYTES or total_size > MAX_BATCH_TOTAL_BYTES:
+            raise _batch_too_large(image.filename)
+    
+    # Read image contents, never more than the limits allow, whatever sizes were declared
+    contents = []
+    total_size = 0
+    for image in images:
+        content = await image.read(MAX_BATCH_IMAGE_BYTES + 1)
+        total_size += len(content)
+        if len(content) > MAX_BATCH_IMAGE_BYTES or total_size > MAX_BATCH_TOTAL_BYTES:
+            raise _batch_too_large(image.filename)
+        contents.append((image.filename, content))
+    
+    async def stream_results():
+        # One JSON object per line, sent as soon as each result is ready
+        async for result in identify_monuments_batch(contents, location=build_location(latitude, longitude)):
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+def _video_too_large(filename: Optional[str]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File {filename} is too large: videos may be at most {MAX_VIDEO_BYTES} bytes"
+    )
+
+
+def _copy_at_most(source, destination, limit: int) -> bool:
+    """Copy file `source` into `destination`, giving up once more than `limit` bytes were read
+
+    Returns whether the whole file was copied.
+    """
+    copied = 0
+    while True:
+        chunk = source.read(1024 * 1024)
+        if not chunk:
+            return True
+        copied += len(chunk)
+        if copied > limit:
+            return False
+        destination.write(chunk)
+
+
+# Identify the landmark in a short video clip
+@router.post("/identify/video", response_model=VideoIdentificationResponse)
+async def identify_monument_in_video(
+    video: UploadFile = File(...),
+    latitude: Optional[float] = Form(None),
+    longitude: Optional[float] = Form(None)
+):
+    # Validate file type
+    if not video.content_type or not video.content_type.startswith('video/'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be a video"
+        )
+    
+    if (video.size or 0) > MAX_VIDEO_BYTES:
+        raise _video_too_large(video.filename)
+    
+    # OpenCV reads videos from disk, so store the upload in a temporary file,
+    # never more of it than the limit allows, whatever size was declared
+    suffix = os.path.splitext(video.filename or "")[1] or '.mp4'
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_file_path = temp_file.name
+        complete = await run_in_threadpool(_copy_at_most, video.file, temp_file, MAX_VIDEO_BYTES)
+    
+    try:
+        if not complete:
+            raise _video_too_large(video.filename)
+        return await run_in_threadpool(
+            identify_monuments_in_video,
+            temp_file_path,
+            build_location(latitude, longitude)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     finally:
         # Clean up the temporary file
         if os.path.exists(temp_file_path):
             os.unlink(temp_file_path)
+
+# Identify landmarks in a live stream of camera frames
+@router.websocket("/stream")
+async def identify_monuments_in_stream(
+    websocket: WebSocket,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None
+):
+    """Each binary message is one encoded (e.g. JPEG) frame and is answered
+    with one JSON message holding the tracked identification. Clients should
+    send the next frame once the previous answer arrives so frames never
+    queue up behind the recognizer. Text messages are answered with
+    {"type": "error"}.
+    """
+    await websocket.accept()
+    recognizer = create_frame_stream_recognizer(build_location(latitude, longitude))
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is None:
+                await websocket.send_json({"type": "error", "detail": "Frames must be sent as binary messages"})
+                continue
+            result = await run_in_threadpool(process_stream_frame, recognizer, message["bytes"])
+            await websocket.send_json(result)
+    except WebSocketDisconnect:
+        pass
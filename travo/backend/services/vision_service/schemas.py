@@ -47,3 +47,20 @@ class MonumentInfo(BaseModel):
 class MonumentIdentificationResponse(BaseModel):
     identified_monument: str
     confidence: confloat(ge=0.0, le=1.0) = Field(..., description="Confidence score between 0 and 1")
+
+
+class VideoKeyframe(BaseModel):
+    frame: int
+    timestamp_seconds: float
+    identified_monument: str
+    confidence: float
+
+
+class VideoIdentificationResponse(BaseModel):
+    identified_monument: str
+    confidence: confloat(ge=0.0, le=1.0)
+    frames_read: int
+    frames_processed: int
+    keyframes_recognized: int
+    keyframes: List[VideoKeyframe] = Field(default=[])
+    processing_time_ms: float
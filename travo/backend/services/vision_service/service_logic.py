@@ -2,8 +2,10 @@ import uuid
 import random
 import json
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple, ByteString
+from typing import List, Dict, Any, Optional, Tuple, ByteString, AsyncIterator
 
 # In a real implementation, these would be imports for computer vision libraries
 import cv2
@@ -12,6 +14,10 @@ import numpy as np
 # from PIL import Image
 import io
 
+from .retrieval import DescriptorIndex, extract_descriptor, VECTORS_FILE
+from .geo import GeoIndex, extract_gps_location
+from .video import FrameStreamRecognizer, process_video_file
+
 # Mock database of monuments
 MONUMENTS_DB = [
     {
@@ -94,27 +100,133 @@ MONUMENTS_DB = [
     }
 ]
 
-async def detect_monuments(image_content: ByteString, confidence_threshold: float = 0.5) -> Dict:
+# Monument lookup by ID
+MONUMENTS_BY_ID = {monument["monument_id"]: monument for monument in MONUMENTS_DB}
+
+# Load the labels.json file once at import time
+LABELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'labels.json')
+with open(LABELS_PATH, 'r') as f:
+    LABELS = json.load(f).get('monuments', [])
+
+# Display names for every monument ID the descriptor index may return,
+# covering both the labels file and the detailed monument database
+MONUMENT_NAMES = {label["id"]: label["name"] for label in LABELS}
+MONUMENT_NAMES.update({monument_id: m["name"] for monument_id, m in MONUMENTS_BY_ID.items()})
+
+# Radius around the photo's location within which monuments are considered
+GEO_RADIUS_KM = float(os.getenv("VISION_GEO_RADIUS_KM", "50"))
+
+# Spatial index over every monument with known coordinates
+MONUMENT_GEO_INDEX = GeoIndex()
+for monument_id, monument in MONUMENTS_BY_ID.items():
+    MONUMENT_GEO_INDEX.add(monument_id, monument["location"]["latitude"], monument["location"]["longitude"])
+for label in LABELS:
+    if label.get("latitude") is not None and label.get("longitude") is not None:
+        MONUMENT_GEO_INDEX.add(label["id"], label["latitude"], label["longitude"])
+
+# Monuments without coordinates can never be ruled out by location
+UNLOCATED_MONUMENTS = [
+    label["id"] for label in LABELS
+    if label.get("latitude") is None or label.get("longitude") is None
+]
+
+# Directory holding the reference descriptor index built by retrieval.py
+VISION_INDEX_DIR = os.getenv(
+    "VISION_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index')
+)
+
+# Batch identification limits
+BATCH_SIZE = 16  # Images matched per batched index search
+MAX_BATCH_IMAGES = 100  # Images accepted in one batch request
+MAX_BATCH_IMAGE_BYTES = int(os.getenv("VISION_BATCH_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))  # Per image
+MAX_BATCH_TOTAL_BYTES = int(os.getenv("VISION_BATCH_MAX_TOTAL_BYTES", str(100 * 1024 * 1024)))  # Per request
+MAX_CONCURRENT_BATCHES = 2  # Batch requests processed at the same time
+
+# Video identification limits
+MAX_VIDEO_BYTES = int(os.getenv("VISION_MAX_VIDEO_BYTES", str(200 * 1024 * 1024)))  # Per uploaded clip
+
+# Batch requests get their own small worker pool so a large album cannot
+# occupy every thread needed by single-image requests
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2), thread_name_prefix="vision-batch")
+BATCH_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+
+# Loaded lazily on first use
+_descriptor_index: Optional[DescriptorIndex] = None
+
+def get_descriptor_index() -> DescriptorIndex:
+    """Get the reference descriptor index, loading it from disk on first use
+
+    Returns an empty index when no index has been built yet.
+    """
+    global _descriptor_index
+    
+    if _descriptor_index is None:
+        if os.path.exists(os.path.join(VISION_INDEX_DIR, VECTORS_FILE)):
+            _descriptor_index = DescriptorIndex.load(VISION_INDEX_DIR)
+        else:
+            _descriptor_index = DescriptorIndex()
+    
+    return _descriptor_index
+
+def get_candidate_monuments(
+    location: Optional[Dict[str, float]],
+    radius_km: float = GEO_RADIUS_KM
+) -> Optional[List[str]]:
+    """Get the IDs of monuments close enough to where a photo was taken
+    
+    Returns None when the location is unknown or no monument lies within
+    radius_km, meaning the caller should search the whole catalog.
+    """
+    if not location or location.get("latitude") is None or location.get("longitude") is None:
+        return None
+    
+    nearby = MONUMENT_GEO_INDEX.query(location["latitude"], location["longitude"], radius_km)
+    if not nearby:
+        return None
+    
+    return [monument_id for monument_id, _ in nearby] + UNLOCATED_MONUMENTS
+
+async def detect_monuments(
+    image_content: ByteString,
+    confidence_threshold: float = 0.5,
+    location: Optional[Dict[str, float]] = None,
+    radius_km: float = GEO_RADIUS_KM,
+    image_id: Optional[str] = None
+) -> Dict:
     """Placeholder function for monument detection in images
     
     In a real implementation, this would:
     1. Use a computer vision model to detect monuments in the image
     2. Identify the monuments and their locations in the image
     3. Return structured data about the detections
+    
+    Only monuments near the photo's location (explicit, or read from the
+    image's EXIF GPS data) are considered.
     """
     # Simulate processing time
     processing_time = random.uniform(200, 1500)  # Between 200ms and 1.5s
     
-    # Generate a unique ID for this image processing request
-    image_id = str(uuid.uuid4())
+    # Generate a unique ID for this image processing request unless the caller has one
+    if image_id is None:
+        image_id = str(uuid.uuid4())
+    
+    # Restrict the candidates to monuments near where the photo was taken
+    if location is None:
+        location = extract_gps_location(image_content)
+    candidate_ids = get_candidate_monuments(location, radius_km)
+    if candidate_ids is None:
+        candidates = MONUMENTS_DB
+    else:
+        candidates = [MONUMENTS_BY_ID[monument_id] for monument_id in candidate_ids if monument_id in MONUMENTS_BY_ID]
     
-    # Randomly select 0-2 monuments from our database to simulate detection
+    # Randomly select 0-2 monuments from the candidates to simulate detection
     num_detections = random.randint(0, 2)
     detected_monuments = []
     
-    if num_detections > 0:
+    if num_detections > 0 and candidates:
         # Randomly select monuments
-        selected_monuments = random.sample(MONUMENTS_DB, min(num_detections, len(MONUMENTS_DB)))
+        selected_monuments = random.sample(candidates, min(num_detections, len(candidates)))
         
         for monument in selected_monuments:
             # Generate a random bounding box
@@ -147,55 +259,121 @@ async def detect_monuments(image_content: ByteString, confidence_threshold: floa
 
 async def get_monument_info(monument_id: str) -> Optional[Dict]:
     """Get detailed information about a specific monument"""
-    # Search for the monument in our mock database
-    for monument in MONUMENTS_DB:
-        if monument["monument_id"] == monument_id:
-            return monument
-    
-    return None
+    return MONUMENTS_BY_ID.get(monument_id)
 
 
-def identify_monument(image_path: str) -> Dict:
-    """Identify a monument in an image using OpenCV for preprocessing
+def identify_monument(
+    image_path: str,
+    location: Optional[Dict[str, float]] = None,
+    radius_km: float = GEO_RADIUS_KM
+) -> Dict:
+    """Identify a monument in an image by nearest-neighbour search over reference photos
     
     Args:
         image_path: Path to the image file
+        location: Where the photo was taken; read from EXIF GPS data if not given
+        radius_km: Only monuments within this distance of the location are matched
         
     Returns:
         Dictionary with identified monument name and confidence score
     """
-    # Load the labels.json file
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    labels_path = os.path.join(current_dir, 'labels.json')
+    with open(image_path, 'rb') as f:
+        image_content = f.read()
     
-    with open(labels_path, 'r') as f:
-        labels_data = json.load(f)
+    descriptor, location = preprocess_image(image_content, location)
+    return match_monuments([descriptor], [location], radius_km)[0]
+
+
+def preprocess_image(
+    image_content: bytes,
+    location: Optional[Dict[str, float]] = None
+) -> Tuple[Optional[np.ndarray], Optional[Dict[str, float]]]:
+    """Decode an image and compute its descriptor and location
     
-    # In a real implementation, we would:
-    # 1. Load the image using OpenCV
-    image = cv2.imread(image_path)
+    This is the CPU-bound part of identification. OpenCV releases the GIL,
+    so it can run in worker threads in parallel.
     
-    # 2. Preprocess the image (resize, normalize, etc.)
-    if image is not None:
-        # Resize to a standard size
-        image = cv2.resize(image, (224, 224))
-        
-        # Convert to grayscale for simpler processing
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    Returns:
+        The image descriptor (None if the image cannot be decoded) and the
+        location, read from EXIF GPS data when not given
+    """
+    image = cv2.imdecode(np.frombuffer(image_content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    descriptor = extract_descriptor(image) if image is not None else None
+    
+    if location is None:
+        location = extract_gps_location(image_content)
+    
+    return descriptor, location
+
+
+def match_monuments(
+    descriptors: List[Optional[np.ndarray]],
+    locations: List[Optional[Dict[str, float]]],
+    radius_km: float = GEO_RADIUS_KM
+) -> List[Dict]:
+    """Identify the monuments for a batch of preprocessed images
+    
+    Images without a usable location are matched together with one batched
+    search; images with a location are matched against nearby monuments only.
+    """
+    index = get_descriptor_index()
+    candidate_ids = [get_candidate_monuments(location, radius_km) for location in locations]
+    results: List[Optional[Dict]] = [None] * len(descriptors)
+    
+    if len(index) > 0:
+        # Batched search over the whole catalog
+        global_rows = [
+            i for i, descriptor in enumerate(descriptors)
+            if descriptor is not None and candidate_ids[i] is None
+        ]
+        if global_rows:
+            batch_matches = index.search_batch(np.stack([descriptors[i] for i in global_rows]), k=1)
+            for i, matches in zip(global_rows, batch_matches):
+                if matches:
+                    results[i] = format_identification(*matches[0])
         
-        # Apply some basic preprocessing
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        edges = cv2.Canny(blurred, 50, 150)
-    
-    # 3. For now, just return a random monument from the labels.json file
-    monuments = labels_data.get('monuments', [])
-    if monuments:
-        selected_monument = random.choice(monuments)
+        # Location-restricted searches
+        for i, descriptor in enumerate(descriptors):
+            if descriptor is None or candidate_ids[i] is None:
+                continue
+            matches = index.search(descriptor, k=1, candidates=candidate_ids[i])
+            if not matches:
+                # No references for the nearby monuments, so search globally
+                matches = index.search(descriptor, k=1)
+            if matches:
+                results[i] = format_identification(*matches[0])
+    
+    return [
+        result if result is not None else fallback_identification(candidate_ids[i])
+        for i, result in enumerate(results)
+    ]
+
+
+def format_identification(monument_id: str, similarity: float) -> Dict:
+    """Convert an index match into an identification result"""
+    return {
+        "identified_monument": MONUMENT_NAMES.get(monument_id, monument_id),
+        "confidence": round(min(max(similarity, 0.0), 1.0), 2)
+    }
+
+
+def fallback_identification(candidate_ids: Optional[List[str]] = None) -> Dict:
+    """Identification used when there is no reference index to search
+    
+    Picks a random monument from labels.json, or from the nearby monuments
+    when the location is known.
+    """
+    if candidate_ids is not None:
+        names = [MONUMENT_NAMES[monument_id] for monument_id in candidate_ids if monument_id in MONUMENT_NAMES]
+    else:
+        names = [label["name"] for label in LABELS]
+    
+    if names:
         # Generate a random confidence score between 0.7 and 0.99
         confidence = round(random.uniform(0.7, 0.99), 2)
         
         return {
-            "identified_monument": selected_monument["name"],
+            "identified_monument": random.choice(names),
             "confidence": confidence
         }
     else:
@@ -203,3 +381,89 @@ def identify_monument(image_path: str) -> Dict:
             "identified_monument": "Unknown",
             "confidence": 0.0
         }
+
+
+async def identify_monuments_batch(
+    images: List[Tuple[str, bytes]],
+    location: Optional[Dict[str, float]] = None,
+    radius_km: float = GEO_RADIUS_KM
+) -> AsyncIterator[Dict]:
+    """Identify monuments in many images, yielding each result as soon as it is ready
+    
+    Images are decoded and preprocessed in parallel on BATCH_EXECUTOR, then
+    matched BATCH_SIZE at a time with a batched index search. Only
+    MAX_CONCURRENT_BATCHES batch requests run at once, and the dedicated
+    executor leaves the default thread pool free for single-image requests.
+    
+    Args:
+        images: (filename, content) pairs
+        location: Location shared by all images; otherwise read per image from EXIF
+        radius_km: Only monuments within this distance of the location are matched
+    """
+    loop = asyncio.get_running_loop()
+    
+    async with BATCH_SEMAPHORE:
+        for start in range(0, len(images), BATCH_SIZE):
+            chunk = images[start:start + BATCH_SIZE]
+            
+            # Decode and compute descriptors in parallel
+            preprocessed = await asyncio.gather(*[
+                loop.run_in_executor(BATCH_EXECUTOR, preprocess_image, content, location)
+                for _, content in chunk
+            ])
+            
+            descriptors = [descriptor for descriptor, _ in preprocessed]
+            locations = [image_location for _, image_location in preprocessed]
+            results = await loop.run_in_executor(BATCH_EXECUTOR, match_monuments, descriptors, locations, radius_km)
+            
+            for offset, ((filename, _), result, descriptor) in enumerate(zip(chunk, results, descriptors)):
+                item = {"index": start + offset, "filename": filename}
+                if descriptor is None:
+                    item["error"] = "Could not decode image"
+                else:
+                    item.update(result)
+                yield item
+
+
+def identify_monuments_in_video(
+    video_path: str,
+    location: Optional[Dict[str, float]] = None,
+    radius_km: float = GEO_RADIUS_KM
+) -> Dict:
+    """Identify the landmark shown in a short video clip
+    
+    Near-duplicate frames are skipped and only keyframes are matched against
+    the reference index; results are tracked across frames.
+    """
+    start_time = datetime.utcnow()
+    
+    summary = process_video_file(
+        video_path,
+        lambda descriptors, locations: match_monuments(descriptors, locations, radius_km),
+        location=location
+    )
+    
+    summary["processing_time_ms"] = round((datetime.utcnow() - start_time).total_seconds() * 1000, 2)
+    return summary
+
+
+def create_frame_stream_recognizer(
+    location: Optional[Dict[str, float]] = None,
+    radius_km: float = GEO_RADIUS_KM
+) -> FrameStreamRecognizer:
+    """Create the per-connection state for recognizing a live stream of camera frames"""
+    return FrameStreamRecognizer(
+        lambda descriptors, locations: match_monuments(descriptors, locations, radius_km),
+        location=location
+    )
+
+
+def process_stream_frame(recognizer: FrameStreamRecognizer, frame_content: bytes) -> Dict:
+    """Decode one encoded camera frame and run it through a stream recognizer"""
+    # Decoding at half resolution is noticeably faster and loses nothing,
+    # since descriptors are computed on a 224x224 thumbnail
+    frame = cv2.imdecode(np.frombuffer(frame_content, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+    if frame is None:
+        return {"frame": recognizer.frame_count, "error": "Could not decode frame"}
+    
+    return recognizer.process_frame(frame)
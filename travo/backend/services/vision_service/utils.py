@@ -1,5 +1,5 @@
 import hashlib
-from typing import Dict, List, ByteString, Tuple
+from typing import Dict, List, ByteString, Tuple, Optional
 from datetime import datetime
 import base64
 
@@ -16,6 +16,15 @@ def format_bounding_box(box: Dict[str, float], image_width: int, image_height: i
         "y_max": int(box["y_max"] * image_height)
     }
 
+def build_location(latitude: Optional[float], longitude: Optional[float]) -> Optional[Dict[str, float]]:
+    """Build a location from optional request fields
+
+    Returns None unless both coordinates are given, so the caller falls back to EXIF GPS data.
+    """
+    if latitude is None or longitude is None:
+        return None
+    return {"latitude": latitude, "longitude": longitude}
+
 def encode_image_base64(image_content: ByteString) -> str:
     """Encode image as base64 string for API responses"""
     return base64.b64encode(image_content).decode('utf-8')
@@ -0,0 +1,176 @@
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from .retrieval import extract_descriptor
+
+# A frame whose perceptual hash differs from the last keyframe's by more than
+# this many bits (out of 64) is treated as a new view and recognized again
+KEYFRAME_HASH_DISTANCE = 10
+
+# Recognize at least once every this many frames even if the view looks unchanged
+MAX_FRAMES_BETWEEN_KEYFRAMES = 30
+
+# Weight of the newest keyframe result in the smoothed per-monument confidence
+TRACKING_SMOOTHING = 0.5
+
+
+def difference_hash(frame: np.ndarray) -> int:
+    """Compute a 64-bit difference hash (dHash) of a BGR or grayscale frame
+
+    The frame is shrunk to 9x8 pixels and each bit records whether a pixel is
+    brighter than its right-hand neighbour, which is cheap to compute and
+    robust to small camera shake and compression noise.
+    """
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """Number of differing bits between two hashes"""
+    return bin(hash1 ^ hash2).count("1")
+
+
+class DetectionTracker:
+    """Smooth monument identifications across keyframes
+
+    Keeps an exponentially weighted confidence per monument so a single
+    noisy keyframe does not flip the result, and answers for the frames in
+    between keyframes without running the model.
+    """
+
+    def __init__(self, smoothing: float = TRACKING_SMOOTHING):
+        self.smoothing = smoothing
+        self.scores: Dict[str, float] = {}
+
+    def update(self, monument: str, confidence: float) -> None:
+        """Fold a new keyframe identification into the tracked scores"""
+        for name in list(self.scores):
+            self.scores[name] *= 1 - self.smoothing
+            if self.scores[name] < 0.01:
+                del self.scores[name]
+        self.scores[monument] = self.scores.get(monument, 0.0) + self.smoothing * confidence
+
+    def current(self) -> Dict:
+        """The monument currently tracked with the highest confidence"""
+        if not self.scores:
+            return {"identified_monument": "Unknown", "confidence": 0.0}
+        monument = max(self.scores, key=self.scores.get)
+        return {"identified_monument": monument, "confidence": round(min(self.scores[monument], 1.0), 2)}
+
+
+class FrameStreamRecognizer:
+    """Landmark recognition over a sequence of frames from one video or camera stream
+
+    Every frame is hashed, but only keyframes (frames that differ noticeably
+    from the last keyframe, or every MAX_FRAMES_BETWEEN_KEYFRAMES frames) are
+    passed to the recognizer. The tracked result is reported for every frame.
+    """
+
+    def __init__(
+        self,
+        match_fn,
+        location: Optional[Dict[str, float]] = None,
+        hash_distance: int = KEYFRAME_HASH_DISTANCE,
+        max_interval: int = MAX_FRAMES_BETWEEN_KEYFRAMES
+    ):
+        """
+        Args:
+            match_fn: Called as match_fn(descriptors, locations) and returns one
+                identification dict per descriptor (see service_logic.match_monuments)
+            location: Where the stream is being recorded, if known
+        """
+        self.match_fn = match_fn
+        self.location = location
+        self.hash_distance = hash_distance
+        self.max_interval = max_interval
+        self.tracker = DetectionTracker()
+        self.frame_count = 0
+        self.keyframe_count = 0
+        self._last_hash: Optional[int] = None
+        self._frames_since_keyframe = 0
+
+    def is_keyframe(self, frame: np.ndarray) -> bool:
+        """Decide whether a frame needs to be recognized"""
+        frame_hash = difference_hash(frame)
+        if (
+            self._last_hash is None
+            or self._frames_since_keyframe >= self.max_interval
+            or hamming_distance(frame_hash, self._last_hash) > self.hash_distance
+        ):
+            self._last_hash = frame_hash
+            self._frames_since_keyframe = 0
+            return True
+
+        self._frames_since_keyframe += 1
+        return False
+
+    def process_frame(self, frame: np.ndarray) -> Dict:
+        """Process one decoded BGR frame and return the tracked identification"""
+        keyframe = self.is_keyframe(frame)
+        if keyframe:
+            result = self.match_fn([extract_descriptor(frame)], [self.location])[0]
+            self.tracker.update(result["identified_monument"], result["confidence"])
+            self.keyframe_count += 1
+
+        frame_index = self.frame_count
+        self.frame_count += 1
+
+        return {"frame": frame_index, "keyframe": keyframe, **self.tracker.current()}
+
+
+def process_video_file(
+    video_path: str,
+    match_fn,
+    location: Optional[Dict[str, float]] = None,
+    max_fps: float = 15.0
+) -> Dict:
+    """Recognize landmarks in a video clip
+
+    Frames beyond max_fps are skipped without being decoded, and the remaining
+    frames go through a FrameStreamRecognizer.
+
+    Returns:
+        Summary with the overall identification and the result of each keyframe
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError("Could not open video")
+
+    source_fps = capture.get(cv2.CAP_PROP_FPS) or max_fps
+    step = max(1, int(round(source_fps / max_fps)))
+
+    recognizer = FrameStreamRecognizer(match_fn, location=location)
+    keyframes: List[Dict] = []
+    source_frame = 0
+
+    try:
+        while True:
+            # grab() only demuxes; retrieve() decodes, so skipped frames stay cheap
+            if not capture.grab():
+                break
+            if source_frame % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                result = recognizer.process_frame(frame)
+                if result["keyframe"]:
+                    keyframes.append({
+                        **result,
+                        "timestamp_seconds": round(source_frame / source_fps, 3)
+                    })
+            source_frame += 1
+    finally:
+        capture.release()
+
+    return {
+        **recognizer.tracker.current(),
+        "frames_read": source_frame,
+        "frames_processed": recognizer.frame_count,
+        "keyframes_recognized": recognizer.keyframe_count,
+        "keyframes": keyframes
+    }
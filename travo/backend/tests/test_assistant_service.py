@@ -0,0 +1,653 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import app
+from services.assistant_service.conversation_store import ConversationStore, SQLConversationArchive
+from services.assistant_service.gazetteer import Gazetteer
+from services.assistant_service.search_index import BM25Index
+from services.assistant_service.response_cache import ResponseCache, normalize_query, is_context_free
+from services.assistant_service.orchestrator import ToolCall, plan_tool_calls, run_tool_calls
+from services.assistant_service.llm_client import LLMClient, TokenScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from services.assistant_service.llm_stub import create_stub_app
+from services.assistant_service.context_window import ContextWindow
+from services.assistant_service.voice import UtteranceDetector, VoiceSession, SentenceBuffer, UnsupportedAudioError, read_wav, wav_bytes
+from services.assistant_service import service_logic
+from services.assistant_service.service_logic import conversation_store, get_related_attractions
+from services.assistant_service.utils import extract_entities, format_conversation_history, detect_language
+from services.assistant_service.language_id import identify_language
+
+client = TestClient(app)
+
+
+def parse_sse(body: str):
+    """Split a Server-Sent Events body into (event, data) pairs."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_text_query_stream():
+    """Test that the streaming endpoint emits chunks, then lookups, then the full response."""
+    response = client.post("/api/assistant/query/text/stream", json={"query": "Tell me about the Eiffel Tower in Paris"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_sse(response.text)
+    names = [event for event, _ in events]
+    assert names[0] == "start"
+    assert names[-1] == "done"
+    assert "chunk" in names
+    assert {"related_attractions", "sources"} <= set(names)
+
+    done = events[-1][1]
+    chunks = "".join(data["text"] for event, data in events if event == "chunk")
+    assert chunks == done["response_text"]
+
+    # The conversation is persisted with both sides of the exchange
+    messages = conversation_store.get(done["conversation_id"])["messages"]
+    assert [message["role"] for message in messages] == ["user", "assistant"]
+    assert messages[1]["content"] == done["response_text"]
+
+
+def test_text_query_stream_grounds_response_in_sources(monkeypatch):
+    """Test that the streamed response is generated with the same sources it reports."""
+    prompts = []
+
+    class RecordingClient:
+        async def stream(self, messages, **kwargs):
+            prompts.append(messages)
+            for delta in ("Grounded ", "reply."):
+                yield delta
+
+    monkeypatch.setattr(service_logic, "llm_client", RecordingClient())
+    response = client.post("/api/assistant/query/text/stream", json={"query": "Tell me about the Louvre museum"})
+    events = parse_sse(response.text)
+    names = [event for event, _ in events]
+    assert names.index("sources") < names.index("chunk")
+
+    sources = events[-1][1]["sources"]
+    assert sources
+    grounding = [message["content"] for message in prompts[0] if message["content"].startswith("Sources:")]
+    assert grounding and all(source["title"] in grounding[0] for source in sources)
+
+
+def test_conversation_store_evicts_and_pages_from_archive(tmp_path):
+    """Test that evicted history is written through and paged back in order."""
+    archive = SQLConversationArchive(f"sqlite:///{tmp_path / 'assistant.db'}")
+    store = ConversationStore(archive, max_messages=3, max_bytes=2048)
+
+    async def scenario():
+        await store.open("c1", user_id="u1")
+        for i in range(10):
+            await store.append("c1", "user", f"message {i}")
+
+        # Only the ring buffer stays in memory
+        assert len(store.get("c1")["messages"]) == 3
+
+        history = await store.history("c1", limit=6)
+        assert [m["content"] for m in history["messages"]] == [f"message {i}" for i in range(4, 10)]
+
+        older = await store.history("c1", limit=10, before=history["messages"][0]["sequence"])
+        assert [m["content"] for m in older["messages"]] == [f"message {i}" for i in range(4)]
+
+        # A second busy conversation pushes the first one out of memory entirely
+        await store.open("c2")
+        for i in range(10):
+            await store.append("c2", "user", "x" * 300)
+        assert "c1" not in store
+        assert store.size_bytes <= store.max_bytes
+
+        # ...and using it again restores it, continuing the sequence
+        message = await store.append("c1", "assistant", "welcome back")
+        assert message["sequence"] == 10
+        history = await store.history("c1", limit=0)
+        assert len(history["messages"]) == 11
+        assert history["user_id"] == "u1"
+
+    asyncio.run(scenario())
+
+
+
+def test_conversation_store_concurrent_opens_share_one_conversation(tmp_path):
+    """Test that opening the same conversation concurrently restores it once."""
+    archive = SQLConversationArchive(f"sqlite:///{tmp_path / 'assistant.db'}")
+    store = ConversationStore(archive)
+    loads = []
+    load_conversation = archive.load_conversation
+
+    def slow_load(conversation_id):
+        loads.append(conversation_id)
+        time.sleep(0.02)
+        return load_conversation(conversation_id)
+
+    archive.load_conversation = slow_load
+
+    async def scenario():
+        conversations = await asyncio.gather(*[store.open("c1", user_id="u1") for _ in range(5)])
+        await asyncio.gather(*[store.append("c1", "user", f"message {i}") for i in range(5)])
+        return conversations
+
+    conversations = asyncio.run(scenario())
+    assert all(conversation is conversations[0] for conversation in conversations)
+    assert loads == ["c1"]
+    assert len(store.get("c1")["messages"]) == 5
+    assert not store._opening
+
+
+def test_extract_entities_from_catalogs():
+    """Test that catalog names are found case-insensitively with spans and ids."""
+    text = "Dinner at the eiffel tower restaurant, then the Colosseum in ROME"
+    entities = extract_entities(text)
+
+    business = next(e for e in entities if e["type"] == "business")
+    assert business["id"] == "b1"
+    assert text[business["start"]:business["end"]] == "eiffel tower restaurant"
+    # The longer business name wins over the attraction it contains
+    assert not any(e["name"] == "Eiffel Tower" for e in entities)
+
+    assert any(e["type"] == "monument" and e["name"] == "Colosseum" for e in entities)
+    assert any(e["type"] == "city" and e["text"] == "ROME" for e in entities)
+
+
+def test_gazetteer_respects_word_boundaries():
+    """Test that names only match as whole words and overlapping names are all found."""
+    gazetteer = Gazetteer([("Rome", "city", "rome"), ("Roman Forum", "attraction", "forum"), ("Forum", "x", "f")])
+
+    assert gazetteer.find_all("Romeo and the romantic Romanesque") == []
+    matches = gazetteer.find_all("The Roman Forum, Rome.")
+    assert [(m["id"], m["start"], m["end"]) for m in matches] == [("forum", 4, 15), ("f", 10, 15), ("rome", 17, 21)]
+    assert [m["id"] for m in gazetteer.extract("The Roman Forum, Rome.")] == ["forum", "rome"]
+
+
+def test_bm25_index_ranks_and_updates_incrementally():
+    """Test BM25 ranking, stemming, type filters and in-place document updates."""
+    index = BM25Index()
+    index.add_document("a", "Ancient temple on the Nile", "monument")
+    index.add_document("b", "Temples and tombs of ancient Egypt, the temple city", "destination")
+    index.add_document("c", "Rooftop restaurant with a view", "business")
+    for i in range(50):
+        index.add_document(f"filler-{i}", "A city with a view", "destination")
+
+    ranked = [doc_id for doc_id, _ in index.search("ancient temples", k=2)]
+    assert sorted(ranked) == ["a", "b"]
+    assert [doc_id for doc_id, _ in index.search("temple", k=5, types=["monument"])] == ["a"]
+
+    # Re-indexing a document replaces it; removing one drops it from results
+    index.add_document("c", "Temple view restaurant", "business")
+    assert "c" in [doc_id for doc_id, _ in index.search("temple", k=5)]
+    assert index.remove_document("a")
+    assert "a" not in [doc_id for doc_id, _ in index.search("temple", k=5)]
+
+
+def test_related_attractions_come_from_catalogs():
+    """Test that related attractions are retrieved from the catalog index."""
+    attractions = get_related_attractions("What is the best time to visit the Louvre?")
+    assert attractions[0]["name"] == "Louvre Museum"
+
+
+def test_normalize_query_canonicalizes_entities():
+    """Test that wording, case and order differences normalize to the same terms."""
+    assert normalize_query("Tell me about the EIFFEL TOWER") == normalize_query("eiffel tower")
+    assert normalize_query("history of the Eiffel Tower") == normalize_query("eiffel tower history")
+    assert normalize_query("Eiffel Tower") != normalize_query("Colosseum")
+
+
+def test_follow_up_questions_bypass_the_cache():
+    """Test that words pointing back at earlier turns are found next to punctuation."""
+    for query in ["How tall is it?", "What can I eat there.", "Opening hours (for that)", "Is it open?!"]:
+        assert not is_context_free(query, "c1", None)
+    assert is_context_free("How tall is the Eiffel Tower?", "c1", None)
+    assert is_context_free("How tall is it?", None, None)
+    assert not is_context_free("Museums nearby", None, {"latitude": 48.86, "longitude": 2.35})
+
+
+def test_response_cache_generates_each_answer_once():
+    """Test exact and partitioned lookups, TTL expiry and sharing of in-flight generation."""
+    cache = ResponseCache(ttl_seconds=60)
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"response_text": "answer"}
+
+    async def scenario():
+        answers = await asyncio.gather(*[
+            cache.get_or_create(query, create)
+            for query in ["Tell me about the Eiffel Tower", "eiffel tower", "EIFFEL TOWER?"]
+        ])
+        assert answers == [{"response_text": "answer"}] * 3
+        assert len(calls) == 1
+
+        # Languages are cached separately
+        assert cache.lookup("eiffel tower", language="fr") is None
+
+        # Expired entries are regenerated
+        cache.ttl_seconds = 0
+        assert cache.lookup("eiffel tower") is None
+
+    asyncio.run(scenario())
+
+
+def test_response_cache_waiters_take_over_cancelled_generation():
+    """Test that when the caller generating an answer is cancelled, one waiter generates it instead."""
+    cache = ResponseCache(ttl_seconds=60)
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"response_text": "answer"}
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_create("eiffel tower", create))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_create("Eiffel Tower", create)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        assert await asyncio.gather(*waiters) == [{"response_text": "answer"}] * 2
+        assert first.cancelled()
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_text_query_stream_shares_and_replays_cached_answers(monkeypatch):
+    """Test that concurrent identical streamed queries generate once, and replays send sources before text."""
+    calls = []
+
+    class SlowClient:
+        async def stream(self, messages, **kwargs):
+            calls.append(messages)
+            await asyncio.sleep(0.05)
+            for delta in ("Shared ", "reply."):
+                yield delta
+
+    monkeypatch.setattr(service_logic, "llm_client", SlowClient())
+    monkeypatch.setattr(service_logic, "response_cache", ResponseCache(ttl_seconds=60))
+
+    async def ask():
+        return [event async for event in service_logic.process_text_query_stream("Tell me about the Colosseum")]
+
+    async def scenario():
+        return await asyncio.gather(ask(), ask())
+
+    for events in asyncio.run(scenario()):
+        assert events[-1][1]["response_text"] == "Shared reply."
+    assert len(calls) == 1
+
+    replayed = [event for event, _ in asyncio.run(ask())]
+    assert len(calls) == 1
+    first_chunk = replayed.index("chunk")
+    assert replayed.index("sources") < first_chunk and replayed.index("related_attractions") < first_chunk
+
+
+def test_plan_tool_calls_from_intents_and_entities():
+    """Test that intents and named places select the right service calls."""
+    calls = plan_tool_calls("Is the Colosseum crowded? Any hotels nearby?")
+    assert {call.tool for call in calls} == {"crowd_prediction", "businesses"}
+    businesses = next(call for call in calls if call.tool == "businesses")
+    assert businesses.arguments["category"] == "hotel"
+
+    assert plan_tool_calls("Tell me about the Colosseum") == []
+
+
+def test_run_tool_calls_returns_partial_results_at_deadline():
+    """Test that tools run concurrently and slow ones are cancelled individually."""
+    cancelled = []
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def broken():
+        raise RuntimeError("service unavailable")
+
+    calls = [ToolCall("fast", {}, fast), ToolCall("slow", {}, slow), ToolCall("broken", {}, broken)]
+    started = time.perf_counter()
+    results = asyncio.run(run_tool_calls(calls, deadline_seconds=0.2))
+    elapsed = time.perf_counter() - started
+
+    assert [r["status"] for r in results] == ["ok", "timeout", "error"]
+    assert results[0]["result"] == {"ok": True}
+    assert cancelled == [True]
+    assert elapsed < 1
+
+
+def test_llm_client_coalesces_identical_prompts():
+    """Test that concurrent identical prompts make a single upstream call."""
+    stub = create_stub_app(base_latency_seconds=0.05)
+
+    async def scenario():
+        client = LLMClient("http://stub", model="stub", transport=httpx.ASGITransport(app=stub))
+        messages = [{"role": "user", "content": "Tell me about the Eiffel Tower"}]
+        results = await asyncio.gather(*[client.complete(messages) for _ in range(5)])
+        other = await client.complete([{"role": "user", "content": "And the Louvre?"}])
+        await client.aclose()
+        return client, results, other
+
+    client, results, other = asyncio.run(scenario())
+    assert all(result == results[0] for result in results)
+    assert results[0]["text"] == "Stub reply to: Tell me about the Eiffel Tower"
+    assert other["text"] == "Stub reply to: And the Louvre?"
+    assert stub.state.stats["requests"] == 2
+    assert client.upstream_calls == 2
+
+
+def test_llm_client_streams_text_as_it_is_generated():
+    """Test that a streamed completion arrives in pieces and retries failures before the first one."""
+    stub = create_stub_app(base_latency_seconds=0.0)
+    failures = [httpx.Response(503)]
+    stub_transport = httpx.ASGITransport(app=stub)
+
+    class FlakyTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            if failures:
+                return failures.pop(0)
+            return await stub_transport.handle_async_request(request)
+
+    async def scenario():
+        client = LLMClient("http://stub", model="stub", transport=FlakyTransport(), backoff_base_seconds=0.01)
+        pieces = [piece async for piece in client.stream([{"role": "user", "content": "Tell me about Rome"}])]
+        await client.aclose()
+        return client, pieces
+
+    client, pieces = asyncio.run(scenario())
+    assert len(pieces) > 1
+    assert "".join(pieces) == "Stub reply to: Tell me about Rome"
+    assert client.upstream_calls == 2
+    assert stub.state.stats["completed"] == 1
+
+
+def test_llm_client_retries_transient_failures():
+    """Test that overloaded responses are retried with backoff."""
+    responses = [httpx.Response(503), httpx.Response(429, headers={"Retry-After": "0"})]
+
+    def handler(request):
+        if responses:
+            return responses.pop(0)
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "done"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+        })
+
+    async def scenario():
+        client = LLMClient("http://llm", model="m", transport=httpx.MockTransport(handler), backoff_base_seconds=0.01)
+        result = await client.complete([{"role": "user", "content": "hi"}])
+        await client.aclose()
+        return client, result
+
+    client, result = asyncio.run(scenario())
+    assert result["text"] == "done"
+    assert client.upstream_calls == 3
+
+
+def test_token_scheduler_serves_interactive_before_batch():
+    """Test that queued interactive requests overtake queued batch requests."""
+    async def scenario():
+        scheduler = TokenScheduler(tokens_per_minute=6000)  # 100 tokens per second
+        await scheduler.acquire(6000)  # Drain the bucket
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(5, priority)
+            order.append(name)
+
+        batch = [asyncio.create_task(request(f"batch-{i}", PRIORITY_BATCH)) for i in range(3)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request("chat", PRIORITY_INTERACTIVE))
+        await asyncio.gather(*batch, interactive)
+        return order
+
+    assert asyncio.run(scenario())[0] == "chat"
+
+
+def test_context_window_stays_bounded_with_rolling_summary():
+    """Test that old turns leave the window for the summary and the context stays within budget."""
+    window = ContextWindow(budget_tokens=200, summary_tokens=60)
+    conversation = {"metadata": {}}
+
+    async def scenario():
+        for sequence in range(200):
+            role = "user" if sequence % 2 == 0 else "assistant"
+            window.add(conversation, {"sequence": sequence, "role": role, "content": f"Turn {sequence} about Rome. " * 5})
+            await asyncio.sleep(0)
+        await window.settle(conversation)
+
+    asyncio.run(scenario())
+    context = window.build(conversation)
+    assert context[0]["role"] == "system" and "Turn" in context[0]["content"]
+    assert context[-1]["content"].startswith("Turn 199 ")
+    assert window.token_count(conversation) <= 200 + 60 + 4
+
+    # The summary is kept in the conversation metadata, so a restored conversation resumes from it
+    covered = conversation["metadata"]["summarized_through"]
+    assert covered == 200 - (len(context) - 1)
+    restored = {"metadata": dict(conversation["metadata"])}
+    window.restore(restored, [{"sequence": s, "role": "user", "content": f"Turn {s}"} for s in range(covered - 5, 200)])
+    assert len(window.build(restored)) == 1 + 200 - covered
+
+
+def test_format_conversation_history():
+    """Test that history formatting skips empty messages."""
+    formatted = format_conversation_history([
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": ""},
+        {"role": "assistant", "content": "Hello!"}
+    ])
+    assert formatted == "User: Hi\n\nAssistant: Hello!\n\n"
+
+
+def tone(seconds: float, sample_rate: int = 16000) -> bytes:
+    """Loud enough 16-bit PCM to count as speech."""
+    import numpy as np
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (0.3 * np.sin(2 * np.pi * 300 * t) * 32767).astype("<i2").tobytes()
+
+
+def test_utterance_detector_segments_at_pauses_and_ends_on_silence():
+    """Test that short pauses close segments and long silence ends the utterance."""
+    detector = UtteranceDetector()
+    silence = lambda seconds: bytes(int(seconds * 16000) * 2)
+    audio = silence(0.5) + tone(0.5) + silence(0.3) + tone(0.4) + silence(1.0)
+
+    events = []
+    for i in range(0, len(audio), 1000):  # Chunks that don't line up with frames
+        events.extend(detector.feed(audio[i:i + 1000]))
+
+    assert [kind for kind, _ in events] == ["segment", "segment", "end"]
+    # Leading silence is dropped; each segment holds its speech plus the pause that closed it
+    assert len(events[0][1]) == len(tone(0.5)) + 12 * 640
+    # Nothing was said after the last pause
+    assert events[2][1] == b""
+    assert not detector.in_utterance
+
+
+def test_voice_session_skips_partial_transcript_of_cancelled_segments():
+    """Test that a cancelled segment transcription leaves the partial transcript out instead of raising."""
+    async def transcribe(pcm):
+        await asyncio.sleep(10)
+        return "never"
+
+    async def scenario():
+        session = VoiceSession(transcribe, UtteranceDetector())
+        session.feed(tone(1.0))
+        assert session.end()
+        session.close()
+        await asyncio.sleep(0)
+        return session.partial_transcript()
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_sentence_buffer_releases_complete_sentences():
+    """Test that streamed text is released sentence by sentence."""
+    buffer = SentenceBuffer()
+    assert buffer.push("The tower is 330") == []
+    assert buffer.push(".5 m tall. It opened") == ["The tower is 330.5 m tall."]
+    assert buffer.push(" in 1889! Visit") == ["It opened in 1889!"]
+    assert buffer.flush() == "Visit"
+
+
+def test_voice_stream_answers_with_cached_speech(tmp_path, monkeypatch):
+    """Test the streaming voice path end to end, with the second answer's speech served from cache."""
+    monkeypatch.setattr(service_logic.speech_cache, "root", str(tmp_path))
+    audio = tone(0.6) + bytes(16000 * 2)
+
+    with client.websocket_connect("/api/assistant/query/voice/stream") as websocket:
+        for _ in range(2):
+            misses = service_logic.speech_cache.misses
+            for i in range(0, len(audio), 3200):
+                websocket.send_bytes(audio[i:i + 3200])
+            messages = []
+            while not messages or messages[-1].get("type") != "done":
+                message = websocket.receive()
+                messages.append(json.loads(message["text"]) if message.get("text") else {"type": "pcm"})
+
+            types = [message["type"] for message in messages]
+            assert types.index("transcript") < types.index("start") < types.index("audio_start")
+            assert types.index("audio_start") < types.index("pcm") < types.index("audio_end") < types.index("done")
+            done = messages[-1]
+            assert done["transcription"] == "Tell me about the Eiffel Tower"
+
+        # Every sentence of the repeated answer came from the cache
+        assert service_logic.speech_cache.misses == misses
+
+    response = client.get("/api/assistant/audio/" + done["audio_url"].rsplit("/", 1)[1])
+    assert response.status_code == 200
+    assert response.content[:4] == b"RIFF"
+
+
+def test_read_wav_converts_pcm_formats():
+    """Test that PCM WAV of any common sample width and channel count becomes 16-bit mono."""
+    import io
+    import wave
+    import numpy as np
+    pcm = tone(0.1)
+    samples = np.frombuffer(pcm, dtype="<i2").astype(np.int32)
+
+    def encode(width, channels, frames):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(width)
+            wav.setframerate(8000)
+            wav.writeframes(frames)
+        return buffer.getvalue()
+
+    assert read_wav(wav_bytes(pcm, 16000)) == (pcm, 16000)
+    stereo = np.repeat(samples, 2).astype("<i2").tobytes()
+    assert read_wav(encode(2, 2, stereo)) == (pcm, 8000)
+    wide = (samples << 16).astype("<i4").tobytes()
+    assert read_wav(encode(4, 1, wide)) == (pcm, 8000)
+    packed = b"".join(int(sample << 8).to_bytes(3, "little", signed=True) for sample in samples)
+    assert read_wav(encode(3, 1, packed)) == (pcm, 8000)
+    narrow = ((samples >> 8) + 128).astype(np.uint8).tobytes()
+    converted, _ = read_wav(encode(1, 1, narrow))
+    assert np.abs(np.frombuffer(converted, dtype="<i2").astype(np.int32) - samples).max() < 256
+
+    with pytest.raises(UnsupportedAudioError):
+        read_wav(b"ID3\x04\x00 not a wav file")
+
+
+def test_voice_query_rejects_unsupported_audio_with_415():
+    """Test that non-WAV uploads get a clear 415 rather than a generic error."""
+    response = client.post(
+        "/api/assistant/query/voice",
+        files={"audio": ("question.mp3", b"ID3\x04\x00 mp3 frames", "audio/mpeg")}
+    )
+    assert response.status_code == 415
+    assert "PCM WAV" in response.json()["detail"]
+
+
+def test_voice_stream_answers_bad_control_messages_with_an_error():
+    """Test that malformed text messages get an error frame and leave the connection usable."""
+    with client.websocket_connect("/api/assistant/query/voice/stream") as websocket:
+        for text in ["not json", "[1, 2]"]:
+            websocket.send_text(text)
+            assert websocket.receive_json()["type"] == "error"
+        websocket.send_bytes(tone(0.3))
+        websocket.send_text(json.dumps({"type": "end"}))
+        message = websocket.receive_json()
+        while message["type"] == "partial_transcript":
+            message = websocket.receive_json()
+        assert message["type"] == "transcript"
+
+
+def test_detect_language_of_short_queries():
+    """Test language detection on short travel queries in market languages."""
+    queries = {
+        "where is the nearest metro station": "en",
+        "où est le musée du louvre": "fr",
+        "dónde está la sagrada familia": "es",
+        "quanto costa il biglietto per il colosseo": "it",
+        "wie komme ich zum brandenburger tor": "de",
+        "qual é o melhor restaurante perto daqui": "pt",
+        "hoe laat gaat het rijksmuseum open": "nl",
+        "di mana candi borobudur": "id",
+        "ayasofya müzesi saat kaçta açılıyor": "tr",
+        "πού είναι η ακρόπολη": "el",
+        "東京タワーはどこですか": "ja",
+        "故宫在哪里": "zh",
+        "أين الأهرامات": "ar",
+    }
+    for query, language in queries.items():
+        assert detect_language(query) == language, query
+
+    # Too little to go on: the caller's default wins
+    assert detect_language("Paris", default="de") == "de"
+    assert detect_language("", default="fr") == "fr"
+
+    # Names and cognates are no evidence; these used to come out as Dutch or German
+    for query in ["Hotels in Paris", "Best beaches in Bali", "Restaurants in Amsterdam", "hotels in paris"]:
+        assert detect_language(query, default="fr") == "fr", query
+        assert detect_language(query) == "en", query
+
+    # Short queries are still called, and German nouns count as evidence
+    short_queries = {
+        "Wo ist der Bahnhof": "de",
+        "Wann öffnet das Museum": "de",
+        "Öffnungszeiten vom Kölner Dom": "de",
+        "Wie komme ich zum Brandenburger Tor": "de",
+        "Dov è il Colosseo": "it",
+        "Dove si mangia bene": "it",
+        "hotel murah di Bali": "id",
+        "tiket masuk Borobudur": "id",
+        "hôtel pas cher": "fr",
+        "Quels sont les horaires du musée du Louvre ?": "fr",
+    }
+    for query, language in short_queries.items():
+        assert detect_language(query, default="??") == language, query
+
+    candidates = identify_language("je cherche un hôtel pas cher")
+    assert candidates[0][0] == "fr" and candidates[0][1] > 0.9
+    assert abs(sum(confidence for _, confidence in identify_language("hello there", limit=20)) - 1.0) < 1e-6
+
+
+def test_text_query_detects_language():
+    """Test that the query's language is detected when the request doesn't give one."""
+    response = client.post("/api/assistant/query/text", json={"query": "Quels sont les horaires du musée du Louvre ?"})
+    assert response.status_code == 200
+    assert response.json()["language"] == "fr"
+
+    response = client.post("/api/assistant/query/text", json={"query": "Quels sont les horaires ?", "language": "en"})
+    assert response.json()["language"] == "en"
@@ -0,0 +1,100 @@
+import os
+import sys
+import pytest
+from io import BytesIO
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cv2
+import numpy as np
+
+from fastapi.testclient import TestClient
+
+from main import app
+from services.media_service import service_logic
+from utils.image_store import ImageStore, ImageTooLargeError
+
+
+@pytest.fixture
+def jpeg_content():
+    """Create a small JPEG image for testing."""
+    _, encoded = cv2.imencode(".jpg", np.full((400, 600, 3), 128, dtype=np.uint8))
+    return encoded.tobytes()
+
+
+def test_store_deduplicates_identical_content(tmp_path, jpeg_content):
+    """Test that identical uploads are stored once under their SHA-256."""
+    store = ImageStore(str(tmp_path))
+
+    first = store.save_fileobj(BytesIO(jpeg_content))
+    second = store.save_bytes(jpeg_content)
+
+    assert first["digest"] == second["digest"]
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True
+    assert first["media_type"] == "image/jpeg"
+
+    # Stored in a two-level fan-out with no temporary files left behind
+    path = store.original_path(first["digest"])
+    assert path.endswith(os.path.join(first["digest"][:2], first["digest"][2:4], first["digest"]))
+    with open(path, "rb") as f:
+        assert f.read() == jpeg_content
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_store_generates_thumbnails_in_background(tmp_path, jpeg_content):
+    """Test that the background worker writes a downscaled thumbnail."""
+    store = ImageStore(str(tmp_path), thumbnail_max_size=100)
+
+    stored = store.save_bytes(jpeg_content)
+    store.wait_for_thumbnails()
+
+    thumbnail = cv2.imread(store.thumbnail_path(stored["digest"]))
+    assert thumbnail is not None
+    assert max(thumbnail.shape[:2]) == 100
+
+
+def test_store_rejects_oversized_uploads(tmp_path):
+    """Test that uploads over the size limit are rejected without leaving files."""
+    store = ImageStore(str(tmp_path), max_size=1024)
+
+    with pytest.raises(ImageTooLargeError):
+        store.save_fileobj(BytesIO(b"\xff\xd8\xff" + b"0" * 4096))
+
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_image_route_etags_follow_the_served_variant(tmp_path, jpeg_content, monkeypatch):
+    """Test 304 revalidation, and that a thumbnail fallback never carries the thumbnail's ETag."""
+    store = ImageStore(str(tmp_path), thumbnail_max_size=100)
+    monkeypatch.setattr(service_logic, "image_store", store)
+    client = TestClient(app)
+
+    digest = client.post("/api/media/images", files={"image": ("photo.jpg", jpeg_content, "image/jpeg")}).json()["digest"]
+    store.wait_for_thumbnails()
+    os.remove(store.thumbnail_path(digest))
+
+    # Thumbnail not generated yet: the original is sent under the original's ETag
+    response = client.get(f"/api/media/images/{digest}", params={"variant": "thumbnail"})
+    assert response.status_code == 200
+    assert response.content == jpeg_content
+    assert response.headers["ETag"] == f'"{digest}-original"'
+    assert "immutable" not in response.headers["Cache-Control"]
+
+    # Once the thumbnail exists, revalidating with the fallback's ETag gets the thumbnail
+    store.wait_for_thumbnails()
+    response = client.get(f"/api/media/images/{digest}", params={"variant": "thumbnail"},
+                          headers={"If-None-Match": f'"{digest}-original"'})
+    assert response.status_code == 200
+    assert response.content != jpeg_content
+    assert response.headers["ETag"] == f'"{digest}-thumbnail"'
+
+    response = client.get(f"/api/media/images/{digest}", params={"variant": "thumbnail"},
+                          headers={"If-None-Match": f'"{digest}-thumbnail"'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(f"/api/media/images/{digest}", headers={"If-None-Match": f'"{digest}-original"'})
+    assert response.status_code == 304
+    assert client.get(f"/api/media/images/{'0' * 64}").status_code == 404
@@ -0,0 +1,782 @@
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import threading
+import pytest
+from datetime import datetime, timezone
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.testclient import TestClient
+
+from main import app
+from services.payment_service import service_logic
+from services.payment_service.gateway import StubGateway, GatewayUnavailableError, ACTION_LAST4, OUTAGE_LAST4
+from services.payment_service.processing import PaymentJobQueue, InvalidTransitionError, JOB_CHARGE
+from services.payment_service.idempotency import IdempotencyStore, StoredResponse
+from services.payment_service.ledger import TransactionLedger
+from services.payment_service.reconciliation import (
+    ReconciliationJob, ledger_records, read_ledger_csv, read_settlement_csv, write_settlement_fixture
+)
+from services.payment_service.risk import RiskRule, RiskScorer, DECISION_ALLOW, DECISION_BLOCK, DECISION_REVIEW
+from services.payment_service.schemas import PaymentIntentCreate, PaymentStatus, RefundRequest, TransactionType
+from services.payment_service.utils import calculate_transaction_stats, generate_transaction_id
+from services.payment_service.utils import format_currency, is_valid_payment_amount
+from services.itinerary_service.utils import calculate_itinerary_stats
+from utils.ids import CROCKFORD_ALPHABET, IdGenerator, id_timestamp
+from utils import fx
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A client on one event loop, with a fast gateway and a fresh job queue."""
+    monkeypatch.setattr(service_logic, "gateway", StubGateway(
+        latency_seconds=(0.05, 0.05), decline_rate=0, action_rate=0, outage_rate=0
+    ))
+    monkeypatch.setattr(service_logic.payment_workers, "queue", PaymentJobQueue(f"sqlite:///{tmp_path}/jobs.db"))
+    monkeypatch.setattr(service_logic.payment_workers, "backoff_base_seconds", 0.01)
+    monkeypatch.setattr(service_logic, "risk_scorer", RiskScorer(checkpoint_path=str(tmp_path / "velocity.bin")))
+    with TestClient(app) as client:
+        yield client
+
+
+def create_intent(client, card_number="4242424242424242"):
+    method = client.post("/api/payments/methods", json={
+        "user_id": "u9",
+        "type": "credit_card",
+        "billing_details": {"name": "Test User"},
+        "card_number": card_number,
+        "card_exp_month": 12,
+        "card_exp_year": 2030,
+        "card_cvc": "123"
+    }).json()
+    intent = client.post("/api/payments/intents", json={"user_id": "u9", "amount": 80.0}).json()
+    return intent["id"], method["id"]
+
+
+def poll(client, intent_id, timeout=5.0):
+    """Poll an intent with If-None-Match until it leaves processing."""
+    etag = None
+    not_modified = 0
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get(f"/api/payments/intents/{intent_id}", headers={"If-None-Match": etag} if etag else {})
+        if response.status_code == 304:
+            not_modified += 1
+        else:
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+            if response.json()["status"] != "processing":
+                return response.json(), not_modified
+        time.sleep(0.01)
+    raise AssertionError("Payment still processing")
+
+
+def test_process_payment_returns_202_and_completes_in_background(client):
+    """Test that processing is accepted immediately and its outcome polled with ETags."""
+    intent_id, method_id = create_intent(client)
+
+    response = client.post(f"/api/payments/intents/{intent_id}/process", params={"payment_method_id": method_id})
+    # The gateway has not answered yet
+    assert response.status_code == 202
+    assert response.json()["status"] == "processing"
+    assert response.headers["Location"].endswith(f"/api/payments/intents/{intent_id}")
+    assert response.headers["Retry-After"] == "1"
+
+    intent, not_modified = poll(client, intent_id)
+    assert intent["status"] == "succeeded"
+    assert not_modified > 0
+
+    # Processing twice is not a valid transition
+    response = client.post(f"/api/payments/intents/{intent_id}/process", params={"payment_method_id": method_id})
+    assert response.status_code == 409
+
+    transactions = client.get("/api/payments/transactions", params={"user_id": "u9"}).json()
+    assert [tx["payment_intent_id"] for tx in transactions].count(intent_id) == 1
+
+
+def test_payment_requiring_action_completes_after_confirm(client):
+    """Test the requires_action branch of the state machine."""
+    intent_id, method_id = create_intent(client, card_number="400000000000" + ACTION_LAST4)
+    client.post(f"/api/payments/intents/{intent_id}/process", params={"payment_method_id": method_id})
+
+    intent, _ = poll(client, intent_id)
+    assert intent["status"] == "requires_action"
+    assert intent["next_action"]["type"] == "authenticate"
+
+    response = client.post(f"/api/payments/intents/{intent_id}/confirm")
+    assert response.status_code == 202
+    intent, _ = poll(client, intent_id)
+    assert intent["status"] == "succeeded"
+    assert intent["next_action"] is None
+
+    assert client.post(f"/api/payments/intents/{intent_id}/confirm").status_code == 409
+
+
+def test_gateway_outage_is_retried_then_fails_the_payment(client, monkeypatch):
+    """Test that an unreachable gateway is retried with backoff before the payment fails."""
+    monkeypatch.setattr(service_logic.payment_workers, "max_attempts", 3)
+    intent_id, method_id = create_intent(client, card_number="400000000000" + OUTAGE_LAST4)
+    calls = service_logic.gateway.calls
+
+    client.post(f"/api/payments/intents/{intent_id}/process", params={"payment_method_id": method_id})
+    intent, _ = poll(client, intent_id)
+    assert intent["status"] == "failed"
+    assert service_logic.gateway.calls - calls == 3
+
+    # The retries were scored as the one attempt they belong to
+    risk_scorer = service_logic.risk_scorer
+    assert risk_scorer.stats["assessed"] == 1
+    assert risk_scorer.totals("method", method_id, "1m") == (1, 80.0)
+    assert risk_scorer.totals("user", "u9", "1h")[0] == 1
+
+
+def test_job_queue_leases_and_reclaims_jobs(tmp_path):
+    """Test that a claimed job is invisible until its lease expires or it is released."""
+    queue = PaymentJobQueue(f"sqlite:///{tmp_path}/jobs.db", lease_seconds=60)
+    first = queue.put("pi_a", JOB_CHARGE, "pm_1")
+    second = queue.put("pi_b", JOB_CHARGE, "pm_1")
+
+    assert queue.claim()["id"] == first
+    assert queue.claim()["id"] == second
+    assert queue.claim() is None
+
+    queue.retry(first, 0, "Payment gateway unavailable")
+    job = queue.claim()
+    assert job["id"] == first and job["attempts"] == 2
+    queue.complete(first)
+
+    # A worker that died mid-job loses its lease
+    queue.lease_seconds = 0
+    expired = queue.put("pi_c", JOB_CHARGE, "pm_1")
+    assert queue.claim()["id"] == expired
+    assert queue.claim()["id"] == expired
+    assert queue.pending_count() == 2
+
+
+def test_idempotency_key_replays_payment_and_refund(client):
+    """Test that retries with the same Idempotency-Key neither charge nor refund twice."""
+    intent_id, method_id = create_intent(client)
+    calls = service_logic.gateway.calls
+    url = f"/api/payments/intents/{intent_id}/process"
+    headers = {"Idempotency-Key": "checkout-1"}
+
+    first = client.post(url, params={"payment_method_id": method_id}, headers=headers)
+    assert first.status_code == 202
+    poll(client, intent_id)
+
+    retry = client.post(url, params={"payment_method_id": method_id}, headers=headers)
+    assert retry.status_code == 202
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert service_logic.gateway.calls - calls == 1
+
+    # The same key for a different request is a client bug
+    response = client.post(url, params={"payment_method_id": "pm_1"}, headers=headers)
+    assert response.status_code == 422
+
+    refund = {"payment_intent_id": intent_id, "amount": 30.0}
+    refunds = [client.post("/api/payments/refunds", json=refund, headers={"Idempotency-Key": "refund-1"}) for _ in range(3)]
+    assert [response.status_code for response in refunds] == [201, 201, 201]
+    assert len({response.json()["id"] for response in refunds}) == 1
+    transactions = client.get("/api/payments/transactions", params={"user_id": "u9"}).json()
+    assert [tx["type"] for tx in transactions if tx["payment_intent_id"] == intent_id].count("refund") == 1
+
+
+def test_idempotency_store_coalesces_concurrent_duplicates():
+    """Test that concurrent requests with one key run once and all get its response."""
+    store = IdempotencyStore(ttl_seconds=60)
+    runs = []
+
+    async def execute():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return StoredResponse(201, {"id": "rf_9"}, {})
+
+    async def main():
+        return await asyncio.gather(*(store.run("u1", "key", "fingerprint", execute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(runs) == 1
+    assert all(response == StoredResponse(201, {"id": "rf_9"}, {}) for response, _ in results)
+    assert [replayed for _, replayed in results].count(False) == 1
+
+    # Keys are scoped to their user
+    asyncio.run(store.run("u2", "key", "fingerprint", execute))
+    assert len(runs) == 2
+
+
+def test_idempotency_store_retries_take_over_cancelled_request():
+    """Test that when the first request is cancelled, one waiting retry runs it and the others replay it."""
+    store = IdempotencyStore(ttl_seconds=60)
+    runs = []
+
+    async def execute():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return StoredResponse(201, {"id": "rf_9"}, {})
+
+    async def main():
+        first = asyncio.create_task(store.run("u1", "key", "fingerprint", execute))
+        await asyncio.sleep(0)
+        retries = [asyncio.create_task(store.run("u1", "key", "fingerprint", execute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        first.cancel()
+        results = await asyncio.gather(*retries)
+        assert first.cancelled()
+        return results
+
+    results = asyncio.run(main())
+    assert len(runs) == 2
+    assert all(response == StoredResponse(201, {"id": "rf_9"}, {}) for response, _ in results)
+    assert [replayed for _, replayed in results].count(False) == 1
+
+
+def test_ledger_pages_with_cursors_and_keeps_stats():
+    """Test keyset pagination of the ledger and its incrementally maintained stats."""
+    ledger = TransactionLedger()
+    for i in range(25):
+        ledger.append({
+            "user_id": "u1" if i % 5 else "u2",
+            "type": TransactionType.REFUND if i % 4 == 0 else TransactionType.PAYMENT,
+            "amount": float(i + 1),
+            "currency": "EUR" if i % 3 == 0 else "USD",
+            "status": PaymentStatus.FAILED if i % 7 == 0 else PaymentStatus.SUCCEEDED
+        })
+
+    # Walking the cursors visits every transaction once, newest first
+    seen, cursor = [], None
+    while True:
+        page, cursor = ledger.page("u1", limit=6, cursor=cursor)
+        seen.extend(page)
+        if cursor is None:
+            break
+    expected = sorted((tx for tx in ledger if tx["user_id"] == "u1"), key=lambda tx: tx["created_at"], reverse=True)
+    assert [tx["id"] for tx in seen] == [tx["id"] for tx in expected]
+    assert [tx["id"] for tx in seen] == sorted((tx["id"] for tx in seen), reverse=True)
+
+    refunds, cursor = ledger.page("u1", TransactionType.REFUND, limit=100)
+    assert cursor is None
+    assert refunds and all(tx["type"] == TransactionType.REFUND for tx in refunds)
+
+    stats = ledger.stats("u1")
+    recomputed = calculate_transaction_stats(expected)
+    for field in ("total_count", "total_amount", "average_amount", "success_rate"):
+        assert stats[field] == pytest.approx(recomputed[field])
+    assert stats["currency_breakdown"] == recomputed["currency_breakdown"]
+    succeeded = [tx for tx in expected if tx["status"] == PaymentStatus.SUCCEEDED]
+    assert sum(stats["balances"].values()) == pytest.approx(
+        sum(tx["amount"] if tx["type"] == TransactionType.PAYMENT else -tx["amount"] for tx in succeeded)
+    )
+
+
+def test_transaction_history_links_next_page(client):
+    """Test that transaction history is paged through the Link header."""
+    response = client.get("/api/payments/transactions", params={"user_id": "u1", "limit": 2})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    next_url = response.headers["Link"].split(">")[0].lstrip("<")
+
+    # The seeded history of u1 has three transactions
+    response = client.get(next_url)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert "Link" not in response.headers
+    assert client.get("/api/payments/transactions", params={"user_id": "u1", "cursor": "nonsense"}).status_code == 400
+
+    stats = client.get("/api/payments/transactions/stats", params={"user_id": "u1"}).json()
+    assert stats["total_count"] == 3
+    assert stats["balances"] == {"USD": 0.0}
+
+
+def test_ids_are_unique_sortable_and_worker_aware():
+    """Test that generated ids sort by creation order, even across threads in one millisecond."""
+    generator = IdGenerator(worker_id=7)
+    batches = []
+
+    def generate():
+        batches.append([generator.new_id() for _ in range(2000)])
+
+    threads = [threading.Thread(target=generate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [generated for batch in batches for generated in batch]
+    assert len(set(ids)) == len(ids)
+    # Each thread saw strictly increasing ids
+    assert all(batch == sorted(batch) for batch in batches)
+
+    def worker_bits(generated):
+        value = 0
+        for char in generated:
+            value = value * 32 + CROCKFORD_ALPHABET.index(char)
+        return (value >> 64) & 0xFFFF
+
+    assert worker_bits(ids[0]) == 7
+    assert worker_bits(IdGenerator(worker_id=8).new_id()) == 8
+
+    transaction_id = generate_transaction_id()
+    assert transaction_id.startswith("tx_") and len(transaction_id) == 29
+    assert abs((datetime.now(timezone.utc) - id_timestamp(transaction_id)).total_seconds()) < 5
+    with pytest.raises(ValueError):
+        id_timestamp("tx_1")
+
+
+def test_concurrent_requests_on_one_intent_lose_no_updates(tmp_path, monkeypatch):
+    """Stress test: racing submissions and refunds on one intent apply exactly once each."""
+    monkeypatch.setattr(service_logic, "gateway", StubGateway(
+        latency_seconds=(0, 0.005), decline_rate=0, action_rate=0, outage_rate=0, seed=1
+    ))
+    monkeypatch.setattr(service_logic.payment_workers, "queue", PaymentJobQueue(f"sqlite:///{tmp_path}/jobs.db"))
+
+    async def main():
+        intent = await service_logic.create_payment_intent(PaymentIntentCreate(user_id="u1", amount=100.0))
+        calls = service_logic.gateway.calls
+
+        # Only one of many simultaneous submissions gets through
+        results = await asyncio.gather(
+            *(service_logic.submit_payment(intent.id, "pm_1") for _ in range(50)),
+            return_exceptions=True
+        )
+        assert sum(not isinstance(result, Exception) for result in results) == 1
+        assert all(isinstance(result, InvalidTransitionError) for result in results if isinstance(result, Exception))
+        await service_logic.payment_workers.drain()
+        assert service_logic.gateway.calls - calls == 1
+
+        # 400 refunds of 2.50 race for 100.00: exactly 40 succeed
+        refunds = await asyncio.gather(*(
+            service_logic.create_refund(RefundRequest(payment_intent_id=intent.id, amount=2.5)) for _ in range(400)
+        ))
+        return intent.id, [refund for refund in refunds if refund is not None]
+
+    intent_id, refunds = asyncio.run(main())
+    assert len(refunds) == 40
+    intent = service_logic._find_intent(intent_id)
+    assert intent["amount_refunded"] == 100.0
+    assert intent["status"] == PaymentStatus.REFUNDED
+    # created, processing, succeeded, then one version per refund
+    assert intent["version"] == 3 + 40
+    refund_transactions = [tx for tx in service_logic.transaction_ledger if tx["payment_intent_id"] == intent_id and tx["type"] == TransactionType.REFUND]
+    assert len(refund_transactions) == 40
+    assert intent_id not in service_logic.REFUND_RESERVATIONS
+
+
+def test_locked_intent_does_not_block_other_intents(monkeypatch):
+    """Test that holding one intent's lock leaves intents on other stripes free."""
+    monkeypatch.setattr(service_logic, "gateway", StubGateway(
+        latency_seconds=(0, 0), decline_rate=0, action_rate=0, outage_rate=0
+    ))
+    locks = service_logic.intent_locks
+
+    async def paid_intent():
+        intent = await service_logic.create_payment_intent(PaymentIntentCreate(user_id="u8", amount=10.0))
+        stored = service_logic._find_intent(intent.id)
+        stored["status"] = PaymentStatus.SUCCEEDED
+        return stored
+
+    busy = asyncio.run(paid_intent())
+    free = asyncio.run(paid_intent())
+    while locks.stripe(free["id"]) == locks.stripe(busy["id"]):
+        free = asyncio.run(paid_intent())
+
+    async def main():
+        async with locks(busy["id"]):
+            refund = RefundRequest(payment_intent_id=free["id"], amount=1.0)
+            return await asyncio.wait_for(service_logic.create_refund(refund), 1.0)
+
+    assert asyncio.run(main()) is not None
+
+
+def test_velocity_windows_slide_and_escalate_decisions():
+    """Test that attempts leave each window on time and repeated attempts escalate to review and block."""
+    scorer = RiskScorer()
+    start = 1_700_000_000.0
+    for i in range(3):
+        assert scorer.assess("u1", "pm_1", "card_a", 100.0, now=start + i).decision == DECISION_ALLOW
+
+    assert scorer.totals("user", "u1", "1m", now=start + 2) == (3, 300.0)
+    assert scorer.totals("card", "card_a", "1h", now=start + 2) == (3, 300.0)
+    # A minute later the attempts have left the 1m window but not the longer ones
+    assert scorer.totals("user", "u1", "1m", now=start + 62) == (0, 0.0)
+    assert scorer.totals("user", "u1", "1h", now=start + 62) == (3, 300.0)
+    assert scorer.totals("user", "u1", "1d", now=start + 2 * 86400) == (0, 0.0)
+
+    # Six attempts in a minute on one method: user_attempts_1m and method_attempts_1m fire
+    now = start + 3600
+    decisions = [scorer.assess("u2", "pm_2", "card_b", 10.0, now=now + i).decision for i in range(6)]
+    assert decisions[:3] == [DECISION_ALLOW] * 3
+    assert decisions[-1] == DECISION_REVIEW
+    assert scorer.assess("u2", "pm_2", "card_b", 6000.0, now=now + 7) == (
+        100, DECISION_BLOCK, ["user_attempts_1m", "user_amount_1d", "method_attempts_1m"]
+    )
+    # Other users and cards are unaffected
+    assert scorer.assess("u3", "pm_3", "card_c", 10.0, now=now + 8).decision == DECISION_ALLOW
+
+
+def test_risk_counters_survive_restart_and_score_within_budget(tmp_path):
+    """Test that checkpointed windows are restored and scoring stays under a millisecond."""
+    path = str(tmp_path / "risk" / "velocity.bin")
+    scorer = RiskScorer(checkpoint_path=path)
+    now = time.time()
+    for i in range(4):
+        scorer.assess("u1", "pm_1", "card_a", 25.0, now=now)
+    scorer.assess("u9", "pm_9", None, 5.0, now=now - 2 * 86400)
+    scorer.checkpoint()
+
+    restored = RiskScorer(checkpoint_path=path)
+    assert restored.totals("method", "pm_1", "1m", now=now) == (4, 100.0)
+    assert restored.totals("card", "card_a", "1d", now=now) == (4, 100.0)
+    # Counters with nothing left in their windows were not written
+    assert len(restored) == 3
+    assert restored.assess("u1", "pm_1", "card_a", 25.0, now=now).reasons == ["method_attempts_1m"]
+
+    # Background checkpoints write only what changed, merged into the previous checkpoint,
+    # and forget counters that went idle
+    written = []
+    write = restored._write
+
+    def recording_write(changes, replace, at):
+        written.append(sorted(changes))
+        return write(changes, replace, at)
+
+    async def checkpoint_in_background():
+        restored.checkpoint_interval_seconds = 0
+        restored.assess("u2", "pm_2", None, 10.0)
+        restored.checkpoint_soon()
+        await restored._checkpointing
+
+    restored.checkpoint()
+    restored._write = recording_write
+    restored.assess("u8", "pm_8", None, 1.0, now=now - 2 * 86400)
+    asyncio.run(checkpoint_in_background())
+    assert written == [[("method", "pm_2"), ("method", "pm_8"), ("user", "u2"), ("user", "u8")]]
+    assert ("user", "u8") not in restored._counters
+    reloaded = RiskScorer(checkpoint_path=path)
+    assert len(reloaded) == 5
+    assert reloaded.totals("user", "u2", "1m")[0] == 1
+    # Four attempts before the restart and the one scored after it
+    assert reloaded.totals("card", "card_a", "1d", now=now) == (5, 125.0)
+
+    # A missing or corrupt checkpoint starts empty instead of failing
+    with open(path, "w") as f:
+        f.write("{not a checkpoint")
+    assert len(RiskScorer(checkpoint_path=path)) == 0
+
+    scorer = RiskScorer()
+    count = 20000
+    started = time.perf_counter()
+    for i in range(count):
+        scorer.assess(f"u{i % 500}", f"pm_{i % 800}", f"card_{i % 700}", 12.5, now=now + i * 0.01)
+    assert (time.perf_counter() - started) / count < 0.001
+
+
+def test_risky_payment_is_blocked_before_reaching_the_gateway(client, monkeypatch):
+    """Test that a blocked attempt fails without a gateway call and a review needs authentication."""
+    monkeypatch.setattr(service_logic, "risk_scorer", RiskScorer(rules=[
+        RiskRule("card_attempts_1m", "card", "1m", "attempts", 1, 50),
+        RiskRule("card_attempts_1h", "card", "1h", "attempts", 2, 30),
+    ]))
+    results = []
+    for _ in range(3):
+        # Each method is new, but the card behind them is the same
+        intent_id, method_id = create_intent(client)
+        calls = service_logic.gateway.calls
+        client.post(f"/api/payments/intents/{intent_id}/process", params={"payment_method_id": method_id})
+        intent, _ = poll(client, intent_id)
+        results.append((intent["status"], service_logic.gateway.calls - calls))
+
+    assert results[0] == ("succeeded", 1)
+    assert results[1] == ("requires_action", 0)
+    assert results[2] == ("failed", 0)
+    assert service_logic._find_intent(intent_id)["risk"]["decision"] == DECISION_BLOCK
+
+
+@pytest.fixture
+def fixed_rates(monkeypatch):
+    """Rates fixed for the day, in place of the stand-in rate service."""
+    snapshot = fx.RateSnapshot("USD", fx._utc_today(), {"EUR": 0.5, "JPY": 150.0, "KWD": 0.3})
+    rates = fx.FxRates(lambda day: snapshot)
+    monkeypatch.setattr(fx, "fx_rates", rates)
+    return snapshot
+
+
+def test_fx_converts_in_batches_and_rounds_to_minor_units(fixed_rates, tmp_path):
+    """Test conversion, per-currency rounding and atomic reloads of the rate table."""
+    assert fixed_rates.convert(10.0, "EUR", "USD") == 20.0
+    assert fixed_rates.convert(0.333, "USD", "JPY") == 50.0
+    assert fixed_rates.convert(1.0, "usd", "KWD") == 0.3
+    assert fx.round_amount(1.005, "USD") == 1.01
+    assert fx.round_amount(-2.5, "JPY") == -3.0
+    converted = fixed_rates.convert_many([10.0, 300.0, 1.0, 0.015], ["EUR", "JPY", "USD", "USD"], "USD")
+    assert converted.tolist() == [20.0, 2.0, 1.0, 0.02]
+    assert fixed_rates.convert_many([1.0, 2.0], "EUR", "JPY").tolist() == [300.0, 600.0]
+    with pytest.raises(fx.UnknownCurrencyError):
+        fixed_rates.convert_many([1.0], ["XYZ"], "USD")
+    with pytest.raises(AttributeError):
+        fixed_rates.base = "EUR"
+
+    # A day's table is loaded once, then swapped for the next day's
+    day = [datetime(2026, 1, 1).date()]
+    loads = []
+    path = tmp_path / "rates.json"
+
+    def load(today):
+        loads.append(today)
+        path.write_text(f'{{"base": "USD", "date": "{today}", "rates": {{"EUR": {0.5 + len(loads) / 10}}}}}')
+        return fx.load_rate_file(str(path))
+
+    rates = fx.FxRates(load, today=lambda: day[0])
+    assert rates.snapshot().rate("USD", "EUR") == pytest.approx(0.6)
+    assert rates.snapshot().rate("USD", "EUR") == pytest.approx(0.6)
+    day[0] = datetime(2026, 1, 2).date()
+    assert rates.snapshot().rate("USD", "EUR") == pytest.approx(0.7)
+    assert len(loads) == 2
+
+
+def test_totals_across_currencies_use_fx(fixed_rates):
+    """Test that payment stats and itinerary budgets add up amounts in different currencies."""
+    ledger = TransactionLedger()
+    for amount, currency in [(10.0, "USD"), (10.0, "EUR"), (1500.0, "JPY")]:
+        ledger.append({
+            "user_id": "u1", "type": TransactionType.PAYMENT, "amount": amount,
+            "currency": currency, "status": PaymentStatus.SUCCEEDED
+        })
+    stats = ledger.stats("u1")
+    assert stats["total_amount"] == 40.0
+    assert stats["currency"] == "USD"
+    assert ledger.stats("u1", "JPY")["total_amount"] == 6000.0
+    assert stats["balances"] == {"USD": 10.0, "EUR": 10.0, "JPY": 1500.0}
+
+    assert format_currency(1234.5, "JPY") == "¥1,235"
+    assert format_currency(1.2345, "KWD") == "KWD1.235"
+    assert is_valid_payment_amount(45.0, "JPY") is False
+    assert is_valid_payment_amount(0.14, "KWD") is False
+    assert is_valid_payment_amount(0.15, "KWD") is True
+
+    itinerary = calculate_itinerary_stats([
+        {"activity_type": "dining", "cost": 40.0, "currency": "EUR", "day_index": 0},
+        {"activity_type": "tour", "cost": 20.0, "currency": "EUR", "day_index": 1},
+        {"activity_type": "museum", "cost": 3000.0, "currency": "JPY", "day_index": 1},
+        {"activity_type": "walk", "cost": 5.0, "currency": "XYZ", "day_index": 1},
+    ])
+    assert itinerary["currency"] == "EUR"
+    assert itinerary["total_cost"] == 70.0
+    assert itinerary["daily_costs"] == {0: 40.0, 1: 30.0}
+
+
+def test_reconciliation_resumes_after_a_crash_and_merge_agrees(tmp_path):
+    """Test that a reconciliation interrupted mid-run resumes to the same result as a clean run."""
+    transactions = []
+    for i in range(3000):
+        intent_id = f"pi_{i:05d}"
+        transactions.append({"payment_intent_id": intent_id, "type": "payment", "amount": 10.0 + i % 7,
+                             "currency": "EUR" if i % 5 == 0 else "USD", "status": "succeeded"})
+        if i % 10 == 0:
+            transactions.append({"payment_intent_id": intent_id, "type": "refund", "amount": 2.0,
+                                 "currency": "EUR" if i % 5 == 0 else "USD", "status": "succeeded"})
+        if i % 13 == 0:
+            transactions.append({"payment_intent_id": intent_id, "type": "payment", "amount": 99.0,
+                                 "currency": "USD", "status": "failed"})
+    records = list(ledger_records(transactions))
+    settlement_path = str(tmp_path / "settlement.csv")
+    write_settlement_fixture(records, settlement_path, drop_rate=0.01, amount_error_rate=0.01, extra_rate=0.01, seed=3)
+
+    def ledger():
+        return iter(records)
+
+    def settlement():
+        return read_settlement_csv(settlement_path)
+
+    clean = ReconciliationJob(str(tmp_path / "clean"), partitions=8, chunk_size=250).run(ledger, settlement)
+    stats = clean.stats
+    assert stats["ledger_records"] == len(records)
+    assert stats["ledger_intents"] == 3000
+    assert stats["missing_in_settlement"] > 0 and stats["missing_in_ledger"] > 0 and stats["amount_mismatch"] > 0
+    assert stats["matched"] + stats["missing_in_settlement"] + stats["amount_mismatch"] + stats["currency_mismatch"] == 3000
+    with open(clean.mismatches_path) as f:
+        clean_rows = sorted(f.read().splitlines()[1:])
+    assert len(clean_rows) == sum(stats[kind] for kind in
+                                  ("missing_in_settlement", "missing_in_ledger", "amount_mismatch", "currency_mismatch"))
+
+    class Crash(Exception):
+        pass
+
+    def crashing(source, after):
+        def open_source():
+            for i, record in enumerate(source()):
+                if i == after:
+                    raise Crash()
+                yield record
+        return open_source
+
+    work_dir = str(tmp_path / "crashy")
+    job = ReconciliationJob(work_dir, partitions=8, chunk_size=250)
+    # Crash while partitioning the settlement side, then again while merging partitions
+    with pytest.raises(Crash):
+        job.run(ledger, crashing(settlement, 1700))
+    aggregate = job._aggregate
+
+    def crash_on_fourth_partition(path):
+        if path == job._partition_path("ledger", 3):
+            raise Crash()
+        return aggregate(path)
+
+    job._aggregate = crash_on_fourth_partition
+    with pytest.raises(Crash):
+        job.run(ledger, settlement)
+    del job._aggregate
+    with open(os.path.join(work_dir, "checkpoint.json")) as f:
+        assert json.load(f)["joined"] == 3
+
+    resumed = job.run(ledger, settlement)
+    assert resumed.stats == stats
+    with open(resumed.mismatches_path) as f:
+        assert sorted(f.read().splitlines()[1:]) == clean_rows
+    assert not [name for name in os.listdir(work_dir) if name.startswith(("ledger-", "settlement-"))]
+
+    # Sorted inputs joined with a sort-merge, also resumed after a crash, find the same mismatches
+    sorted_records = sorted(records, key=lambda record: record[0])
+    sorted_settlement = sorted(read_settlement_csv(settlement_path), key=lambda record: record[0])
+    merge_job = ReconciliationJob(str(tmp_path / "merge"), chunk_size=250)
+    with pytest.raises(Crash):
+        merge_job.run(lambda: iter(sorted_records), crashing(lambda: iter(sorted_settlement), 2000), presorted=True)
+    merged = merge_job.run(lambda: iter(sorted_records), lambda: iter(sorted_settlement), presorted=True)
+    assert merged.stats == stats
+    with open(merged.mismatches_path) as f:
+        assert sorted(f.read().splitlines()[1:]) == clean_rows
+
+    with pytest.raises(ValueError):
+        ReconciliationJob(str(tmp_path / "unsorted")).run(ledger, settlement, presorted=True)
+
+
+def test_transaction_export_streams_gzipped_csv_and_ndjson(client, monkeypatch, tmp_path):
+    """Test that the whole history is exported, compressed when the client accepts gzip."""
+    ledger = TransactionLedger()
+    for i in range(1234):
+        ledger.append({
+            "user_id": "u7", "type": TransactionType.REFUND if i % 9 == 0 else TransactionType.PAYMENT,
+            "amount": 5.0 + i, "currency": "USD", "status": PaymentStatus.SUCCEEDED,
+            "description": f'Booking, "tour" #{i}', "payment_intent_id": f"pi_{i:05d}"
+        })
+    monkeypatch.setattr(service_logic, "transaction_ledger", ledger)
+
+    with client.stream("GET", "/api/payments/transactions/export", params={"user_id": "u7"},
+                       headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Content-Type"].startswith("text/csv")
+        assert 'filename="transactions-u7.csv"' in response.headers["Content-Disposition"]
+        text = gzip.decompress(b"".join(response.iter_raw())).decode("utf-8")
+    path = tmp_path / "export.csv"
+    path.write_text(text)
+    # The export is a ledger file the reconciliation job can read back
+    assert sorted(read_ledger_csv(str(path))) == sorted(ledger_records(ledger))
+    assert text.splitlines()[0].startswith("id,user_id,type,amount")
+
+    response = client.get("/api/payments/transactions/export",
+                          params={"user_id": "u7", "format": "ndjson", "transaction_type": "refund"},
+                          headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 138
+    assert all(row["type"] == "refund" for row in rows)
+    assert [row["id"] for row in rows] == sorted((row["id"] for row in rows), reverse=True)
+
+    assert client.get("/api/payments/transactions/export", params={"user_id": "nobody", "format": "ndjson"}).text == ""
+    assert client.get("/api/payments/transactions/export", params={"user_id": "u7", "format": "xml"}).status_code == 422
+
+
+def test_batch_refund_validates_upfront_and_refunds_with_bounded_concurrency(client, monkeypatch):
+    """Test a mass cancellation: per-item results, bounded gateway concurrency and bulk ledger writes."""
+
+    class CountingGateway(StubGateway):
+        def __init__(self):
+            super().__init__(latency_seconds=(0.02, 0.02), decline_rate=0, action_rate=0, outage_rate=0)
+            self.in_flight = 0
+            self.most_in_flight = 0
+            self.outages = set()
+
+        async def refund(self, intent, amount):
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            try:
+                await super().refund(intent, amount)
+                # The first refund of a flaky intent finds the gateway down
+                if intent["id"] in self.outages:
+                    self.outages.discard(intent["id"])
+                    raise GatewayUnavailableError("Payment gateway unavailable")
+            finally:
+                self.in_flight -= 1
+
+    gateway = CountingGateway()
+    monkeypatch.setattr(service_logic, "gateway", gateway)
+    monkeypatch.setattr(service_logic, "REFUND_BATCH_BACKOFF_SECONDS", 0.01)
+    extends = []
+    original_extend = service_logic.transaction_ledger.extend
+    monkeypatch.setattr(service_logic.transaction_ledger, "extend",
+                        lambda transactions: extends.append(len(transactions)) or original_extend(transactions))
+
+    async def paid_intents(count):
+        intents = []
+        for _ in range(count):
+            intent = await service_logic.create_payment_intent(PaymentIntentCreate(user_id="u6", amount=100.0))
+            stored = service_logic._find_intent(intent.id)
+            stored["status"] = PaymentStatus.SUCCEEDED
+            intents.append(intent.id)
+        return intents
+
+    intent_ids = asyncio.run(paid_intents(60))
+    pending = client.post("/api/payments/intents", json={"user_id": "u6", "amount": 10.0}).json()["id"]
+    gateway.outages.add(intent_ids[5])
+    items = [{"payment_intent_id": intent_id, "reason": "Event cancelled"} for intent_id in intent_ids]
+    items += [
+        {"payment_intent_id": intent_ids[0], "amount": 1.0},  # Nothing left after the full refund above
+        {"payment_intent_id": "pi_missing"},
+        {"payment_intent_id": pending},
+    ]
+
+    response = client.post("/api/payments/refunds/batch", json={"refunds": items})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results, summary = lines[:-1], lines[-1]["summary"]
+    assert summary == {"succeeded": 60, "rejected": 3, "failed": 0}
+    assert sorted(result["index"] for result in results) == list(range(len(items)))
+    errors = {result["index"]: result["error"] for result in results if result["status"] == "rejected"}
+    assert errors == {60: "Nothing left to refund", 61: "Payment intent not found", 62: "Payment cannot be refunded"}
+    assert all(result["refund"]["amount"] == 100.0 for result in results if result["status"] == "succeeded")
+
+    assert gateway.most_in_flight == service_logic.REFUND_BATCH_CONCURRENCY
+    assert all(service_logic._find_intent(intent_id)["status"] == PaymentStatus.REFUNDED for intent_id in intent_ids)
+    assert extends == [50, 10]
+    history, _ = service_logic.transaction_ledger.page("u6", TransactionType.REFUND, limit=100)
+    assert sorted(tx["payment_intent_id"] for tx in history) == sorted(intent_ids)
+    assert not any(intent_id in service_logic.REFUND_RESERVATIONS for intent_id in intent_ids)
+
+    assert client.post("/api/payments/refunds/batch", json={"refunds": []}).status_code == 422
+
+
+def test_ledger_bulk_writes_keep_indexes_sorted():
+    """Test that extend() matches one-by-one appends, including entries older than the index."""
+    one_by_one = TransactionLedger()
+    bulk = TransactionLedger()
+    base = datetime(2026, 1, 1)
+    transactions = [
+        {"id": f"tx_{i:03d}", "user_id": "u1", "type": TransactionType.PAYMENT, "amount": 1.0,
+         "currency": "USD", "status": PaymentStatus.SUCCEEDED, "created_at": base.replace(minute=(i * 37) % 60)}
+        for i in range(40)
+    ]
+    for transaction in transactions:
+        one_by_one.append(transaction)
+    bulk.extend(transactions[:20])
+    bulk.extend(transactions[20:])
+    assert bulk.page("u1", limit=100) == one_by_one.page("u1", limit=100)
+    assert bulk.stats("u1") == one_by_one.stats("u1")
+    with pytest.raises(ValueError):
+        bulk.extend([dict(transactions[0], id="tx_new"), transactions[1]])
+    assert len(bulk) == 40
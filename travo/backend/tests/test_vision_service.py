@@ -140,4 +140,179 @@ def test_monument_info_endpoint():
     
     # Test with an invalid ID
     response = client.get("/vision/monument/non-existent-id")
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def test_descriptor_index_search():
+    """Test nearest-neighbour search over reference descriptors."""
+    import numpy as np
+    from services.vision_service.retrieval import DescriptorIndex, DESCRIPTOR_DIM
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, DESCRIPTOR_DIM)).astype(np.float32)
+    labels = [f"monument-{i % 10}" for i in range(50)]
+
+    index = DescriptorIndex()
+    index.add(vectors, labels)
+
+    # Each reference should be its own nearest neighbour
+    results = index.search(vectors[17], k=3)
+    assert results[0][0] == "monument-7"
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert len({label for label, _ in results}) == len(results)
+
+    # Appending a new monument does not require rebuilding the index
+    new_vector = rng.normal(size=DESCRIPTOR_DIM).astype(np.float32)
+    index.add(new_vector[None, :], ["new-monument"])
+    assert index.search(new_vector, k=1)[0][0] == "new-monument"
+
+
+def test_descriptor_index_ivf_save_load(tmp_path):
+    """Test the inverted-file search path and memory-mapped loading."""
+    import numpy as np
+    from services.vision_service.retrieval import DescriptorIndex, DESCRIPTOR_DIM
+
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(2000, DESCRIPTOR_DIM)).astype(np.float32)
+    labels = [f"monument-{i}" for i in range(2000)]
+
+    index = DescriptorIndex()
+    index.add(vectors, labels)
+    index.build_ivf(nlist=16)
+    index.save(str(tmp_path))
+
+    loaded = DescriptorIndex.load(str(tmp_path))
+    assert len(loaded) == 2000
+    assert loaded.search(vectors[123], k=1)[0][0] == "monument-123"
+
+
+def test_geo_prior_restricts_candidates():
+    """Test that a known photo location prunes the monument candidates."""
+    from services.vision_service.service_logic import get_candidate_monuments
+
+    # Near the Colosseum only Roman monuments are candidates
+    candidates = get_candidate_monuments({"latitude": 41.89, "longitude": 12.49}, radius_km=10)
+    assert candidates is not None
+    assert "colosseum-rome" in candidates
+    assert "taj-mahal-agra" not in candidates
+
+    # Unknown location, or nothing nearby, falls back to a global search
+    assert get_candidate_monuments(None) is None
+    assert get_candidate_monuments({"latitude": 0.0, "longitude": 0.0}, radius_km=10) is None
+
+
+def test_extract_gps_location():
+    """Test reading the GPS position from EXIF metadata."""
+    from PIL import Image
+    from services.vision_service.geo import extract_gps_location
+
+    exif = Image.Exif()
+    exif[0x8825] = {1: "S", 2: (13.0, 9.0, 47.16), 3: "W", 4: (72.0, 32.0, 42.0)}
+    buffer = BytesIO()
+    Image.new("RGB", (16, 16)).save(buffer, "JPEG", exif=exif)
+
+    location = extract_gps_location(buffer.getvalue())
+    assert location["latitude"] == pytest.approx(-13.1631, abs=1e-3)
+    assert location["longitude"] == pytest.approx(-72.545, abs=1e-3)
+
+    # Images without EXIF data have no location
+    assert extract_gps_location(b"test image content") is None
+
+
+def test_identify_batch_endpoint():
+    """Test that the batch endpoint streams one NDJSON result per image."""
+    import numpy as np
+    import cv2
+
+    _, encoded = cv2.imencode(".jpg", np.zeros((32, 32, 3), dtype=np.uint8))
+    files = [("images", (f"photo_{i}.jpg", encoded.tobytes(), "image/jpeg")) for i in range(3)]
+    files.append(("images", ("broken.jpg", b"test image content", "image/jpeg")))
+
+    response = client.post("/api/vision/identify/batch", files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["filename"] for result in results] == ["photo_0.jpg", "photo_1.jpg", "photo_2.jpg", "broken.jpg"]
+    assert "identified_monument" in results[0]
+    assert "error" in results[3]
+
+
+def test_identify_batch_endpoint_enforces_size_limits(monkeypatch):
+    """Test that oversized batches are refused with 413 before any image is decoded."""
+    from services.vision_service import routes
+
+    monkeypatch.setattr(routes, "MAX_BATCH_IMAGE_BYTES", 1000)
+    monkeypatch.setattr(routes, "MAX_BATCH_TOTAL_BYTES", 2500)
+    monkeypatch.setattr(routes, "MAX_BATCH_IMAGES", 4)
+
+    def post(*sizes):
+        files = [("images", (f"photo_{i}.jpg", b"x" * size, "image/jpeg")) for i, size in enumerate(sizes)]
+        return client.post("/api/vision/identify/batch", files=files)
+
+    assert post(1001).status_code == 413
+    assert post(900, 900, 900).status_code == 413
+    assert post(10, 10, 10, 10, 10).status_code == 413
+    assert post(900, 900).status_code == 200
+
+
+def test_identify_video_endpoint_enforces_size_limit(monkeypatch):
+    """Test that a video over the size limit is refused with 413 without being identified."""
+    from services.vision_service import routes
+
+    identified = []
+
+    def identify(path, location):
+        identified.append(path)
+        return {
+            "identified_monument": "Parthenon", "confidence": 0.9, "frames_read": 1,
+            "frames_processed": 1, "keyframes_recognized": 1, "processing_time_ms": 1.0
+        }
+
+    monkeypatch.setattr(routes, "MAX_VIDEO_BYTES", 1000)
+    monkeypatch.setattr(routes, "identify_monuments_in_video", identify)
+
+    def post(size):
+        return client.post("/api/vision/identify/video", files={"video": ("clip.mp4", b"x" * size, "video/mp4")})
+
+    assert post(1001).status_code == 413
+    assert not identified
+    assert post(1000).status_code == 200
+    assert len(identified) == 1 and not os.path.exists(identified[0])
+
+
+def test_frame_stream_answers_text_messages_with_an_error(monkeypatch):
+    """Test that a text message gets an error and the stream keeps accepting frames."""
+    from services.vision_service import routes
+
+    monkeypatch.setattr(routes, "process_stream_frame", lambda recognizer, frame: {"frame": 0, "size": len(frame)})
+
+    with client.websocket_connect("/api/vision/stream") as websocket:
+        websocket.send_text("hello")
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_bytes(b"frame")
+        assert websocket.receive_json() == {"frame": 0, "size": 5}
+
+
+def test_frame_stream_skips_duplicate_frames():
+    """Test that only keyframes reach the recognizer and results are tracked."""
+    import numpy as np
+    from services.vision_service.video import FrameStreamRecognizer
+
+    calls = []
+
+    def match_fn(descriptors, locations):
+        calls.append(len(descriptors))
+        return [{"identified_monument": "Parthenon", "confidence": 0.9}]
+
+    rng = np.random.default_rng(0)
+    scene_a = (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+    scene_b = (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+
+    recognizer = FrameStreamRecognizer(match_fn, max_interval=100)
+    results = [recognizer.process_frame(scene_a) for _ in range(10)]
+    results += [recognizer.process_frame(scene_b) for _ in range(10)]
+
+    # One recognition per distinct scene
+    assert len(calls) == 2
+    assert [r["frame"] for r in results if r["keyframe"]] == [0, 10]
+    assert all(r["identified_monument"] == "Parthenon" for r in results)
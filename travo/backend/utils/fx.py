@@ -0,0 +1,277 @@
+"""Currency conversion from daily FX rate tables
+
+Rates are loaded once a day, from a JSON file (FX_RATES_FILE) or from the
+stand-in rate service, into an immutable RateSnapshot. Readers take the
+current snapshot and convert against it in memory; a reload builds a new
+snapshot and swaps it in with one assignment, so a conversion never sees
+half of one table and half of another. Converting a batch of amounts is a
+single numpy pass, and results are rounded to the minor units of the
+target currency (2 for USD, 0 for JPY, 3 for KWD).
+
+The rate file looks like:
+
+    {"base": "USD", "date": "2026-10-19", "rates": {"EUR": 0.92, "JPY": 149.5}}
+
+with each rate in units of the currency per one unit of the base.
+"""
+import os
+import json
+import math
+import random
+import threading
+from datetime import date, datetime, timezone
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+BASE_CURRENCY = "USD"
+
+# ISO 4217 minor units for currencies that don't use two decimals
+MINOR_UNITS: Mapping[str, int] = MappingProxyType({
+    "BHD": 3, "CLP": 0, "HUF": 2, "IDR": 0, "ISK": 0, "JOD": 3, "JPY": 0,
+    "KRW": 0, "KWD": 3, "OMR": 3, "PYG": 0, "TND": 3, "TWD": 2, "UGX": 0,
+    "VND": 0, "XAF": 0, "XOF": 0,
+})
+
+# Units per US dollar the stand-in rate service moves around from day to day
+REFERENCE_RATES: Mapping[str, float] = MappingProxyType({
+    "USD": 1.0, "EUR": 0.92, "GBP": 0.79, "JPY": 149.5, "CHF": 0.88, "CAD": 1.37,
+    "AUD": 1.52, "NZD": 1.66, "CNY": 7.24, "HKD": 7.82, "SGD": 1.35, "INR": 83.2,
+    "IDR": 15600.0, "THB": 35.9, "KRW": 1345.0, "MXN": 17.9, "BRL": 5.0, "ZAR": 18.6,
+    "AED": 3.6725, "TRY": 32.2, "SEK": 10.6, "NOK": 10.7, "DKK": 6.87, "KWD": 0.307,
+})
+
+
+class UnknownCurrencyError(ValueError):
+    """A currency is not in the rate table"""
+
+
+def minor_units(currency: str) -> int:
+    """Decimal places of a currency's smallest unit"""
+    return MINOR_UNITS.get(currency.upper(), 2)
+
+
+def round_amount(amount: float, currency: str) -> float:
+    """Round to the currency's minor units, halves away from zero"""
+    scale = 10 ** minor_units(currency)
+    # Rounding the scaled value first keeps 1.005 * 100 = 100.49999... from rounding down
+    scaled = round(abs(amount) * scale, 6)
+    return math.copysign(math.floor(scaled + 0.5) / scale, amount)
+
+
+def round_amounts(amounts: np.ndarray, currency: str) -> np.ndarray:
+    """round_amount over an array"""
+    scale = 10 ** minor_units(currency)
+    scaled = np.round(np.abs(amounts) * scale, 6)
+    return np.copysign(np.floor(scaled + 0.5) / scale, amounts)
+
+
+class RateSnapshot:
+    """One day's rate table; cannot be changed once built
+
+    Args:
+        base: Currency the rates are quoted against
+        as_of: Day the rates apply to
+        rates: Units of each currency per one unit of `base`
+    """
+
+    __slots__ = ("base", "as_of", "currencies", "_index", "_rates")
+
+    def __init__(self, base: str, as_of: date, rates: Mapping[str, float]):
+        table = {code.upper(): float(rate) for code, rate in rates.items()}
+        table[base.upper()] = 1.0
+        for code, rate in table.items():
+            if not rate > 0 or math.isinf(rate):
+                raise ValueError(f"Invalid rate for {code}: {rate}")
+        currencies = tuple(sorted(table))
+        values = np.array([table[code] for code in currencies], dtype=np.float64)
+        values.setflags(write=False)
+        object.__setattr__(self, "base", base.upper())
+        object.__setattr__(self, "as_of", as_of)
+        object.__setattr__(self, "currencies", currencies)
+        object.__setattr__(self, "_index", MappingProxyType({code: i for i, code in enumerate(currencies)}))
+        object.__setattr__(self, "_rates", values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RateSnapshot is immutable")
+
+    def __contains__(self, currency: str) -> bool:
+        return currency.upper() in self._index
+
+    def _position(self, currency: str) -> int:
+        try:
+            return self._index[currency.upper()]
+        except KeyError:
+            raise UnknownCurrencyError(f"No exchange rate for {currency}")
+
+    def rate(self, source: str, target: str) -> float:
+        """Units of `target` per one unit of `source`"""
+        return float(self._rates[self._position(target)] / self._rates[self._position(source)])
+
+    def convert(self, amount: float, source: str, target: str) -> float:
+        """Convert an amount, rounded to the target currency's minor units"""
+        if source.upper() == target.upper():
+            return round_amount(amount, target)
+        return round_amount(amount * self.rate(source, target), target)
+
+    def convert_many(
+        self,
+        amounts: Union[Sequence[float], np.ndarray],
+        currencies: Union[str, Sequence[str]],
+        target: str
+    ) -> np.ndarray:
+        """Convert amounts in one or many currencies to `target` in one pass
+
+        Args:
+            amounts: Amounts to convert
+            currencies: The currency of all amounts, or one currency per amount
+            target: Currency to convert to
+
+        Returns:
+            Converted amounts, rounded to the target currency's minor units
+
+        Raises:
+            UnknownCurrencyError: If any currency is not in the table
+        """
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if isinstance(currencies, str):
+            factors = self.rate(currencies, target)
+        else:
+            if len(currencies) != len(amounts):
+                raise ValueError("Need one currency per amount")
+            # Look up each distinct currency once rather than once per amount
+            codes, inverse = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+            positions = np.array([self._position(code) for code in codes], dtype=np.intp)
+            factors = self._rates[self._position(target)] / self._rates[positions][inverse]
+        return round_amounts(amounts * factors, target)
+
+    def as_dict(self) -> Dict:
+        return {
+            "base": self.base,
+            "date": self.as_of.isoformat(),
+            "rates": {code: float(rate) for code, rate in zip(self.currencies, self._rates)}
+        }
+
+
+def load_rate_file(path: str) -> RateSnapshot:
+    """Read a rate table file
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If it is not a valid rate table
+    """
+    with open(path) as f:
+        try:
+            data = json.load(f)
+            return RateSnapshot(data["base"], date.fromisoformat(data["date"]), data["rates"])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid rate file {path}: {e}")
+
+
+class StubRateService:
+    """Stand-in for a rate provider until one is integrated
+
+    Publishes REFERENCE_RATES moved by up to `daily_spread` each day; the
+    same day always gets the same table.
+    """
+
+    def __init__(self, daily_spread: float = 0.01):
+        self.daily_spread = daily_spread
+        self.fetches = 0
+
+    def fetch(self, day: date) -> RateSnapshot:
+        self.fetches += 1
+        jitter = random.Random(day.toordinal())
+        rates = {
+            code: rate * (1 + jitter.uniform(-self.daily_spread, self.daily_spread))
+            for code, rate in REFERENCE_RATES.items() if code != BASE_CURRENCY
+        }
+        return RateSnapshot(BASE_CURRENCY, day, rates)
+
+
+def _utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class FxRates:
+    """Holder of the current RateSnapshot, reloaded when the day changes
+
+    Args:
+        loader: Builds the snapshot for a day
+        today: Current day; UTC date if None
+    """
+
+    def __init__(self, loader: Callable[[date], RateSnapshot], today: Optional[Callable[[], date]] = None):
+        self._loader = loader
+        self._today = today or _utc_today
+        self._snapshot: Optional[RateSnapshot] = None
+        self._attempted: Optional[date] = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> RateSnapshot:
+        """The current rates, loading the day's table on first use each day
+
+        A failed reload keeps the previous table rather than failing conversions.
+        """
+        today = self._today()
+        snapshot = self._snapshot
+        if snapshot is not None and (snapshot.as_of >= today or self._attempted == today):
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or (self._snapshot.as_of < today and self._attempted != today):
+                self._attempted = today
+                try:
+                    self.swap(self._loader(today))
+                except (OSError, ValueError):
+                    if self._snapshot is None:
+                        raise
+            return self._snapshot
+
+    def swap(self, snapshot: RateSnapshot) -> None:
+        """Make `snapshot` the current table"""
+        self._snapshot = snapshot
+
+    def refresh(self) -> RateSnapshot:
+        """Reload today's table now"""
+        snapshot = self._loader(self._today())
+        self.swap(snapshot)
+        return snapshot
+
+
+def _default_loader() -> Callable[[date], RateSnapshot]:
+    path = os.getenv("FX_RATES_FILE")
+    if path:
+        return lambda day: load_rate_file(path)
+    return StubRateService().fetch
+
+
+fx_rates = FxRates(_default_loader())
+
+
+def convert(amount: float, source: str, target: str) -> float:
+    """Convert an amount with the current rates"""
+    return fx_rates.snapshot().convert(amount, source, target)
+
+
+def convert_many(
+    amounts: Union[Sequence[float], np.ndarray],
+    currencies: Union[str, Sequence[str]],
+    target: str
+) -> np.ndarray:
+    """Convert many amounts with the current rates; see RateSnapshot.convert_many"""
+    return fx_rates.snapshot().convert_many(amounts, currencies, target)
+
+
+def is_known_currency(currency: Optional[str]) -> bool:
+    return bool(currency) and currency in fx_rates.snapshot()
+
+
+def total_in(amounts_by_currency: Iterable, target: str) -> float:
+    """Sum (currency, amount) pairs in `target`, rounded to its minor units"""
+    pairs = list(amounts_by_currency)
+    if not pairs:
+        return 0.0
+    currencies, amounts = zip(*pairs)
+    converted = convert_many(amounts, list(currencies), target)
+    return round_amount(float(converted.sum()), target)
@@ -0,0 +1,116 @@
+"""Time-sortable unique ids
+
+Ids use the ULID layout, 128 bits written as 26 Crockford base32 characters:
+
+    48 bits  milliseconds since the Unix epoch
+    16 bits  worker id
+    64 bits  sequence, starting from a random value every millisecond
+
+Ids sort by creation time, so inserts keyed by them append to the end of a
+B-tree index instead of landing on random pages. Within a millisecond a
+worker's ids go up by one; ids of different workers differ in the worker
+bits. The worker id comes from TRAVO_WORKER_ID, or is derived from the host
+name and process id when that is unset.
+"""
+import os
+import time
+import zlib
+import socket
+import secrets
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LENGTH = 26
+
+TIMESTAMP_BITS = 48
+WORKER_BITS = 16
+SEQUENCE_BITS = 64
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# The random start leaves room for 2^63 ids in the same millisecond before spilling into the next
+SEQUENCE_START_BITS = SEQUENCE_BITS - 1
+
+
+def default_worker_id() -> int:
+    configured = os.getenv("TRAVO_WORKER_ID")
+    if configured:
+        return int(configured) & ((1 << WORKER_BITS) - 1)
+    return zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode("utf-8")) & ((1 << WORKER_BITS) - 1)
+
+
+def encode_id(value: int) -> str:
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+class IdGenerator:
+    """Generator of ULID-style ids, monotonic within the process
+
+    Args:
+        worker_id: 16-bit id distinguishing this worker; default_worker_id() if None
+    """
+
+    def __init__(self, worker_id: Optional[int] = None):
+        self._configured_worker_id = worker_id
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        worker_id = self._configured_worker_id
+        self.worker_id = default_worker_id() if worker_id is None else worker_id & ((1 << WORKER_BITS) - 1)
+        self._last_millis = -1
+        self._sequence = 0
+
+    def new_id(self) -> str:
+        """A new 26-character id, greater than every id this generator returned before"""
+        with self._lock:
+            # A forked child must not continue its parent's sequence
+            if os.getpid() != self._pid and self._configured_worker_id is None:
+                self._reset()
+
+            millis = time.time_ns() // 1_000_000
+            if millis > self._last_millis:
+                self._last_millis = millis
+                self._sequence = secrets.randbits(SEQUENCE_START_BITS)
+            else:
+                # Same millisecond, or the clock stepped back: keep counting from the last id
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_millis += 1
+                    self._sequence = secrets.randbits(SEQUENCE_START_BITS)
+
+            value = (
+                (self._last_millis << (WORKER_BITS + SEQUENCE_BITS))
+                | (self.worker_id << SEQUENCE_BITS)
+                | self._sequence
+            )
+        return encode_id(value)
+
+
+_generator = IdGenerator()
+
+
+def generate_id(prefix: str = "") -> str:
+    """A new time-sortable id, e.g. generate_id("tx_") -> "tx_01J9Z3K8Q4..." """
+    return prefix + _generator.new_id()
+
+
+def id_timestamp(generated_id: str) -> datetime:
+    """The UTC creation time encoded in an id from generate_id, prefix included or not
+
+    Raises:
+        ValueError: If the id does not end in a 26-character Crockford base32 id
+    """
+    encoded = generated_id[-ID_LENGTH:].upper()
+    if len(encoded) != ID_LENGTH or any(char not in CROCKFORD_ALPHABET for char in encoded):
+        raise ValueError(f"Not a generated id: {generated_id}")
+    value = 0
+    for char in encoded:
+        value = value * 32 + CROCKFORD_ALPHABET.index(char)
+    millis = value >> (WORKER_BITS + SEQUENCE_BITS)
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
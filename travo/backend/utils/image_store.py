@@ -0,0 +1,227 @@
+import io
+import os
+import queue
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Optional
+
+import cv2
+import numpy as np
+
+from config import settings
+
+CHUNK_SIZE = 64 * 1024
+
+# Magic numbers of the image formats we accept, used to pick a media type when serving
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured maximum size"""
+
+
+def sniff_media_type(header: bytes) -> Optional[str]:
+    """Guess an image's media type from its first bytes"""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return media_type
+    return None
+
+
+class ImageStore:
+    """Content-addressed image storage on the local filesystem
+
+    Every image is stored once under the SHA-256 of its content, fanned out
+    into two levels of directories (ab/cd/abcd...) so no directory grows too
+    large. Writes stream into a temporary file in the same filesystem and are
+    renamed into place, so readers never see a partial file and concurrent
+    uploads of the same image simply converge on one copy.
+
+    Thumbnails are generated by a background worker thread after the
+    original has been stored.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_size: int = settings.MAX_CONTENT_LENGTH,
+        thumbnail_max_size: int = settings.THUMBNAIL_MAX_SIZE
+    ):
+        self.root = root
+        self.max_size = max_size
+        self.thumbnail_max_size = thumbnail_max_size
+        self.originals_dir = os.path.join(root, "originals")
+        self.thumbnails_dir = os.path.join(root, "thumbnails")
+        self.tmp_dir = os.path.join(root, "tmp")
+
+        self._thumbnail_queue: "queue.Queue[str]" = queue.Queue()
+        self._thumbnail_pending = set()
+        self._thumbnail_failed = set()  # Digests that could not be decoded
+        self._thumbnail_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _fan_out(base_dir: str, digest: str, suffix: str = "") -> str:
+        return os.path.join(base_dir, digest[:2], digest[2:4], digest + suffix)
+
+    def original_path(self, digest: str) -> str:
+        """Filesystem path of a stored original"""
+        return self._fan_out(self.originals_dir, digest)
+
+    def thumbnail_path(self, digest: str) -> str:
+        """Filesystem path of a stored image's thumbnail"""
+        return self._fan_out(self.thumbnails_dir, digest, ".jpg")
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.original_path(digest))
+
+    def save_fileobj(self, fileobj: BinaryIO) -> Dict:
+        """Stream a file-like object into the store
+
+        Returns:
+            {"digest", "size", "media_type", "deduplicated"}
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        header = b""
+
+        fd, temp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise ImageTooLargeError(f"Image exceeds the maximum size of {self.max_size} bytes")
+                    if len(header) < 16:
+                        header += chunk[:16 - len(header)]
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+
+            digest = hasher.hexdigest()
+            final_path = self.original_path(digest)
+            deduplicated = os.path.exists(final_path)
+            if deduplicated:
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self.request_thumbnail(digest)
+
+        return {
+            "digest": digest,
+            "size": size,
+            "media_type": sniff_media_type(header) or "application/octet-stream",
+            "deduplicated": deduplicated
+        }
+
+    def save_bytes(self, content: bytes) -> Dict:
+        """Store an image that is already in memory"""
+        digest = hashlib.sha256(content).hexdigest()
+        if self.exists(digest):
+            self.request_thumbnail(digest)
+            return {
+                "digest": digest,
+                "size": len(content),
+                "media_type": sniff_media_type(content[:16]) or "application/octet-stream",
+                "deduplicated": True
+            }
+
+        return self.save_fileobj(io.BytesIO(content))
+
+    def media_type(self, digest: str) -> str:
+        """Media type of a stored original, sniffed from its first bytes"""
+        with open(self.original_path(digest), "rb") as f:
+            return sniff_media_type(f.read(16)) or "application/octet-stream"
+
+    def request_thumbnail(self, digest: str) -> None:
+        """Queue thumbnail generation for a stored image unless it already exists"""
+        if os.path.exists(self.thumbnail_path(digest)):
+            return
+
+        with self._thumbnail_lock:
+            if digest in self._thumbnail_pending or digest in self._thumbnail_failed:
+                return
+            self._thumbnail_pending.add(digest)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._thumbnail_worker, name="thumbnail-worker", daemon=True)
+                self._worker.start()
+
+        self._thumbnail_queue.put(digest)
+
+    def wait_for_thumbnails(self) -> None:
+        """Block until every queued thumbnail has been processed"""
+        self._thumbnail_queue.join()
+
+    def _thumbnail_worker(self) -> None:
+        while True:
+            digest = self._thumbnail_queue.get()
+            try:
+                generated = self.generate_thumbnail(digest) is not None
+            except Exception:
+                # A broken image must not stop the worker; it is simply served without a thumbnail
+                generated = False
+
+            with self._thumbnail_lock:
+                self._thumbnail_pending.discard(digest)
+                if not generated:
+                    self._thumbnail_failed.add(digest)
+            self._thumbnail_queue.task_done()
+
+    def generate_thumbnail(self, digest: str) -> Optional[str]:
+        """Write a JPEG thumbnail of a stored image and return its path"""
+        target_path = self.thumbnail_path(digest)
+        if os.path.exists(target_path):
+            return target_path
+
+        image = cv2.imdecode(np.fromfile(self.original_path(digest), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+
+        height, width = image.shape[:2]
+        scale = self.thumbnail_max_size / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            return None
+
+        # Same temp file + rename pattern as originals
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(encoded.tobytes())
+        os.replace(temp_path, target_path)
+
+        return target_path
+
+
+# Shared store rooted at the configured upload folder
+image_store = ImageStore(os.path.join(settings.UPLOAD_FOLDER, "images"))
+
+
+def image_url(digest: str, variant: str = "original") -> str:
+    """Public URL of a stored image"""
+    url = f"{settings.MEDIA_BASE_URL}/images/{digest}"
+    return url if variant == "original" else f"{url}?variant={variant}"